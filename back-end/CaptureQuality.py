@@ -0,0 +1,107 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+from models import Message, CaptureSettingsPayload
+from ShotIntake import DetectionLimiter
+import services.config as cfg
+
+# Adaptive capture quality
+#  - The server tells the clients what frames to send with a "capture_settings" message: the largest frame size,
+#    the JPEG quality and the maximum fire rate. When the detection is overloaded the settings are lowered(smaller
+#    and more compressed frames, fewer shots), so the cost per shot drops instead of the latency going up
+#  - The load is checked every `interval` seconds from the shots that were processed since the last check:
+#    the average detection time, how full the detection was(see DetectionLimiter) and the shots that were rejected
+#  - The settings go down one level as soon as the server is overloaded and only go back up after the server has been
+#    calm for `recover_after` checks in a row(so the clients do not flip between two levels)
+#  - The fire rate of the level is also enforced: a player's shots closer together than the level allows are
+#    answered with "busy"(see cooldown), so a client that ignores the settings does not add to the load
+#  - The load is measured per server worker, the settings are sent to the players connected to this worker
+#    (the players the worker runs the detection for) and to every player that connects. With more than one worker
+#    the players of a lobby that are connected to different workers can get different settings(and fire rates)
+
+#Capture settings levels(level 0 is used when the server is not loaded)
+#- max_size: the longest side(in pixels) of the frames, the aspect ratio of the camera is kept
+#- jpeg_quality: JPEG quality(0-100) of the frames
+#- max_fire_rate: maximum number of shots per second of a player
+CAPTURE_LEVELS = [
+    {"max_size": 1280, "jpeg_quality": 80, "max_fire_rate": 1.0},
+    {"max_size": 640, "jpeg_quality": 70, "max_fire_rate": 1.0},
+    {"max_size": 480, "jpeg_quality": 60, "max_fire_rate": 0.75},
+    {"max_size": 320, "jpeg_quality": 50, "max_fire_rate": 0.5},
+]
+#Part of the time between two shots(1 / max_fire_rate) that is enforced, the rest allows for the network jitter
+FIRE_RATE_SLACK = 0.9
+
+class CaptureController:
+    def __init__(self, limiter: DetectionLimiter, enabled: bool = cfg.CAPTURE_ADAPTIVE,
+                 interval: float = cfg.CAPTURE_INTERVAL, latency_high: float = cfg.CAPTURE_LATENCY_HIGH,
+                 latency_low: float = cfg.CAPTURE_LATENCY_LOW, recover_after: int = 3,
+                 min_cooldown: float = cfg.SHOT_COOLDOWN):
+        self.limiter = limiter
+        self.min_cooldown = min_cooldown
+        self.enabled = enabled
+        self.interval = interval
+        self.latency_high = latency_high
+        self.latency_low = latency_low
+        self.recover_after = recover_after
+        self.level = 0
+        #measurements since the last check
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self._rejected = 0
+        self._peak_fill = 0.0
+        #number of calm checks in a row
+        self._calm = 0
+
+    #Method for recording the detection time(in seconds) of a processed shot
+    def observe(self, seconds: float):
+        self._latency_sum += seconds
+        self._latency_count += 1
+        self._peak_fill = max(self._peak_fill, self.limiter.in_flight / self.limiter.max_in_flight)
+
+    #Method for recording a shot that was rejected because the server could not keep up
+    def observe_rejected(self):
+        self._rejected += 1
+        self._peak_fill = 1.0
+
+    #Method that checks the load since the last check and changes the level, returns True if the level changed
+    def evaluate(self) -> bool:
+        latency = self._latency_sum / self._latency_count if self._latency_count else 0.0
+        fill = self._peak_fill
+        overloaded = self._rejected > 0 or latency > self.latency_high or fill >= 0.75
+        calm = latency < self.latency_low and fill < 0.5
+        self._latency_sum, self._latency_count, self._rejected, self._peak_fill = 0.0, 0, 0, 0.0
+
+        if overloaded:
+            self._calm = 0
+            if self.level < len(CAPTURE_LEVELS) - 1:
+                self.level += 1
+                return True
+            return False
+        self._calm = self._calm + 1 if calm else 0
+        if self._calm >= self.recover_after and self.level > 0:
+            self._calm = 0
+            self.level -= 1
+            return True
+        return False
+
+    #Method that returns the minimum time(in seconds) between two shots of a player at the current level
+    #- never less than `min_cooldown`(SHOT_COOLDOWN), the fire rate is only used if the settings are sent
+    def cooldown(self) -> float:
+        if not self.enabled:
+            return self.min_cooldown
+        return max(self.min_cooldown, FIRE_RATE_SLACK / CAPTURE_LEVELS[self.level]["max_fire_rate"])
+
+    #Method that returns the capture settings message of the current level
+    def message(self) -> Message:
+        return Message(type="capture_settings", payload=CaptureSettingsPayload(level=self.level, **CAPTURE_LEVELS[self.level]))
+
+    #Task that checks the load every `interval` seconds and sends the new settings when the level changes
+    async def run(self, c_manager):
+        if not self.enabled:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.evaluate():
+                await c_manager.send_message_to_local_players(self.message())
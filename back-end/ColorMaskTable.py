@@ -0,0 +1,109 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import cv2
+import numpy as np
+
+# Colour mask table used by the computer vision model
+#  - The HSV colour ranges(see "services/service.py") are compiled once when the table is created,
+#    so there are no numpy arrays to build for every frame
+#  - A colour with one range is masked with a single `inRange` pass
+#  - A colour with more than one range that only differ in hue(red wraps around the hue circle) is masked with
+#    one `inRange` pass for the saturation/value bounds and one hue lookup table(LUT) pass
+#  - The table can also build a label image that has one bit per colour for every pixel(one pass for all colours)
+
+class ColorMaskTable:
+    def __init__(self, color_ranges: dict[str, list[tuple[list,list]]]):
+        self.colors = list(color_ranges.keys())
+        self._masks = {color: self._compile_color(ranges) for color, ranges in color_ranges.items()}
+        self._compile_labels(color_ranges)
+
+    #Method for creating the mask(255 where the pixel has the colour, 0 otherwise) of a colour
+    #- returns None if the colour is not in the table
+    def mask(self, hsv, color: str):
+        compiled = self._masks.get(color)
+        if compiled is None:
+            return None
+
+        kind, bounds = compiled
+        if kind == "box":
+            lower, upper = bounds
+            return cv2.inRange(hsv, lower, upper)
+        if kind == "hue_table":
+            lower, upper, hue_table = bounds
+            mask = cv2.inRange(hsv, lower, upper)
+            hue_mask = cv2.LUT(cv2.extractChannel(hsv, 0), hue_table)
+            return cv2.bitwise_and(mask, hue_mask)
+
+        #ranges that can not be combined, create a mask by using a 'bitwise or ' operator
+        mask = None
+        for lower, upper in bounds:
+            current_mask = cv2.inRange(hsv, lower, upper)
+            mask = current_mask if mask is None else cv2.bitwise_or(mask, current_mask)
+        return mask
+
+    #Method for creating a label image for all the colours in a single pass
+    #- bit i of a pixel is set if the pixel has the colour self.colors[i]
+    def labels(self, hsv):
+        h, s, v = cv2.split(hsv)
+        range_bits = cv2.bitwise_and(cv2.bitwise_and(cv2.LUT(h, self._channel_tables[0]), cv2.LUT(s, self._channel_tables[1])),
+                                     cv2.LUT(v, self._channel_tables[2]))
+        if self._range_to_label is not None:
+            return cv2.LUT(range_bits, self._range_to_label)
+
+        #more than 8 ranges, map the range bits to the colour bits one colour at a time
+        labels = np.zeros(range_bits.shape, np.int32)
+        for index, bits in enumerate(self._color_range_bits):
+            labels[(range_bits & bits) != 0] |= 1 << index
+        return labels
+
+    #Method for getting the mask of a colour from a label image
+    def mask_from_labels(self, labels, color: str):
+        if color not in self.colors:
+            return None
+        bit = 1 << self.colors.index(color)
+        return cv2.compare(cv2.bitwise_and(labels, bit), 0, cv2.CMP_NE)
+
+    #Method that compiles the ranges of one colour
+    @staticmethod
+    def _compile_color(ranges: list[tuple[list,list]]):
+        bounds = [(np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8)) for lower, upper in ranges]
+        if len(bounds) == 1:
+            return "box", bounds[0]
+
+        #ranges with the same saturation and value bounds can be combined with a hue table
+        sv_bounds = {(tuple(lower[1:]), tuple(upper[1:])) for lower, upper in ranges}
+        if len(sv_bounds) == 1:
+            (sv_lower, sv_upper), = sv_bounds
+            hue_table = np.zeros(256, dtype=np.uint8)
+            for lower, upper in ranges:
+                hue_table[lower[0]:upper[0] + 1] = 255
+            lower = np.array([0, *sv_lower], dtype=np.uint8)
+            upper = np.array([255, *sv_upper], dtype=np.uint8)
+            return "hue_table", (lower, upper, hue_table)
+
+        return "ranges", bounds
+
+    #Method that compiles the per channel tables used for the label image
+    #- every (colour, range) pair gets a bit, a pixel is in the range if the bit is set for all 3 channels
+    def _compile_labels(self, color_ranges: dict[str, list[tuple[list,list]]]):
+        ranges = [(index, lower, upper) for index, color in enumerate(self.colors) for lower, upper in color_ranges[color]]
+        if len(ranges) > 31:
+            raise ValueError("Too many colour ranges for the colour mask table.")
+        dtype = np.uint8 if len(ranges) <= 8 else np.int32
+
+        self._channel_tables = [np.zeros(256, dtype=dtype) for _ in range(3)]
+        self._color_range_bits = [0] * len(self.colors)
+        for bit, (index, lower, upper) in enumerate(ranges):
+            for channel in range(3):
+                self._channel_tables[channel][lower[channel]:upper[channel] + 1] |= 1 << bit
+            self._color_range_bits[index] |= 1 << bit
+
+        #table that maps the range bits straight to the colour bits(only possible with 8 bit range masks)
+        self._range_to_label = None
+        if dtype == np.uint8 and len(self.colors) <= 8:
+            self._range_to_label = np.zeros(256, dtype=np.uint8)
+            for value in range(256):
+                for index, bits in enumerate(self._color_range_bits):
+                    if value & bits:
+                        self._range_to_label[value] |= 1 << index
@@ -3,53 +3,159 @@
 
 import cv2
 import base64
+import time
 import numpy as np
 import services.service as sv
+from ColorMaskTable import ColorMaskTable
+from ContourClassifier import ContourClassifier
+from ImageDecoder import ImageDecoder
 
 # Computer vision model used for shape detection
 #  - The model utilizes HSV(Hue Saturation and Value) color ranges defined in the "services/service.py" file
-#    to mask the image
+#    to mask the image, the ranges are compiled once into a colour mask table
 #  - It then detects closed contour lines and predicts the shape if the area enclosed
-#    by the contour is greater than the minimum threshold, `min_area`
+#    by the contour is greater than the minimum threshold, `min_area`(see ContourClassifier)
+#  - The frames are decoded at a reduced scale when the targets are large enough(see ImageDecoder), `min_area`
+#    and the region of interest are always given in the pixels of the full frame
+#  - The detection methods take an optional `timings` dictionary, the time(in seconds) spent in every stage
+#    ("base64", "imdecode", "hsv", "mask", "contours", "classify") is added to it
+
+#The colour mask table is compiled once(when the module is imported) and shared by all the models
+_color_table = ColorMaskTable(sv.color_ranges)
 
 class ComputerVisionModel:
-    def __init__(self, min_area=100):
+    #Region of interest(ROI) modes:
+    #- "full": the whole frame is used
+    #- "window": only a window around the crosshair(centre of the frame) is used, `roi_size` is the
+    #    size of the window as a fraction of the frame size
+    #- "grow": starts with a `roi_size` window around the crosshair and doubles it while the largest
+    #    shape found is cut by the edge of the window(the shape under the crosshair is bigger than the window)
+    #- A region of interest declared by the client replaces the crosshair window in the "window" and "grow" modes(it
+    #    can still grow), it is ignored in the "full" mode
+    def __init__(self, min_area=100, roi_mode="full", roi_size=0.5, decoder: ImageDecoder | None = None):
         self.min_area = min_area
         self.shapes = sv.shapes;
+        self.color_table = _color_table
+        self.classifier = ContourClassifier()
+        self.decoder = decoder if decoder is not None else ImageDecoder()
+        self.roi_mode = roi_mode if roi_mode in ("full", "window", "grow") else "full"
+        self.roi_size = min(max(roi_size, 0.05), 1.0)
     
     #Method for detecting the shape recieving:
     # - The base64 encoded image which will be decoded
-    # - HSV color ranges(upper and lower bounds) for the colour of the shape to be detected(front-end will detect it)
-    def detect_shape(self, image_base64, hsv_color_ranges: list[tuple[list,list]]) -> list:
-        image = self._decode_image(image_base64=image_base64)
-        if image is None:
+    # - The colour of the shape to be detected(front-end will detect it), must be one of the colours in "services/service.py"
+    # - (optional) the region of interest declared by the client as (x, y, width, height) in pixels(see the ROI modes)
+    def detect_shape(self, image_base64, color: str, roi=None, timings: dict | None = None) -> list:
+        image, scale = self._decode_image(image_base64=image_base64, timings=timings)
+        return self._detect_shape_in_image(image, color, roi, timings, scale)
+
+    #Method for detecting the shape from the raw(already base64 decoded) JPEG bytes
+    #- Used by the vision engine workers which recieve the frame bytes from shared memory
+    def detect_shape_from_bytes(self, image_bytes, color: str, roi=None, timings: dict | None = None) -> list:
+        image, scale = self._decode_image_bytes(image_bytes=image_bytes, timings=timings)
+        return self._detect_shape_in_image(image, color, roi, timings, scale)
+
+    #Method for warming up the model: runs the detection of every colour on a synthetic frame(see _warm_up_frame)
+    #- The first calls of OpenCV and of the decoder load and initialise their code, so the first shots would be
+    #    slower than the rest. Returns the shapes detected in the frame(a triangle of every colour)
+    def warm_up(self) -> list:
+        frame = _warm_up_frame()
+        detected = [self.detect_shape_from_bytes(frame, color) for color in self.color_table.colors]
+        self.detect_shape(base64.b64encode(frame).decode(), self.color_table.colors[0])
+        return detected
+
+    #Method that runs the detection on the decoded image
+    #- Only the region of interest is converted to HSV and searched for contours
+    #- scale is the scale the image was decoded at(the image is 1/scale of the frame size)
+    def _detect_shape_in_image(self, image, color: str, roi=None, timings: dict | None = None, scale: int = 1) -> list:
+        if image is None or color not in self.color_table.colors:
             return []
         
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        mask = None
-        #Using the hsv colour ranges, create a mask by using a 'bitwise or ' operator
-        for lower, upper in hsv_color_ranges:
-            lower_np = np.array(lower)
-            upper_np = np.array(upper)
-            current_mask = cv2.inRange(hsv, lower_np, upper_np)
-            mask = current_mask if mask is None else cv2.bitwise_or(mask, current_mask)
+        height, width = image.shape[:2]
+        min_area = self.min_area / (scale * scale)
+        full_frame = (0, 0, width, height)
+        if self.roi_mode == "full":
+            region = full_frame
+        elif roi is not None:
+            region = self._clip_region(roi, width, height, scale)
+        else:
+            region = self._centre_region(width, height, self.roi_size)
+        if region is None:
+            return []
+
+        shapes, cut_by_edge = self._detect_shapes_in_region(image, color, region, min_area, timings)
+        #grow the window outwards while the shape under the crosshair does not fit in it
+        while self.roi_mode == "grow" and cut_by_edge and region != full_frame:
+            region = self._grow_region(region, width, height)
+            shapes, cut_by_edge = self._detect_shapes_in_region(image, color, region, min_area, timings)
+        
+        #return the shapes with the largest area(incase they are equally large)
+        return self._detemine_largest_shapes(shapes)
+
+    #Method for detecting the shapes in a region (x, y, width, height) of the image
+    #- Returns the shapes and if the largest contour touches an edge of the region that is not an edge of the frame
+    #    (a shape that is cut by the region can not be classified correctly)
+    def _detect_shapes_in_region(self, image, color: str, region, min_area: float,
+                                 timings: dict | None = None) -> tuple[list, bool]:
+        x, y, w, h = region
+        frame_height, frame_width = image.shape[:2]
+        start = time.perf_counter()
+        hsv = cv2.cvtColor(image[y:y + h, x:x + w], cv2.COLOR_BGR2HSV)
+        hsv_done = time.perf_counter()
+        #Using the compiled hsv colour ranges, create a mask of the colour
+        mask = self.color_table.mask(hsv, color)
 
         #mask image using mask to detect shape contours
         mask_uint8 = np.ascontiguousarray(mask, dtype=np.uint8)
+        mask_done = time.perf_counter()
 
         #Get all the bounding lines of the colors detected
         contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        shapes: list[tuple[str,float]] = []
-        for cnt in contours:
-            #Shape must be within the minimum allowed area, otherwise we ignore
-            shape_area = cv2.contourArea(cnt)
-            if shape_area >= self.min_area:
-                shape_type = self._determine_shape_type(cnt)
-                if shape_type in self.shapes: 
-                    shapes.append((shape_type, shape_area))
-        
-        #return the shapes with the largest area(incase they are equally large)
-        return self._detemine_largest_shapes(shapes)
+        contours_done = time.perf_counter()
+        #classify the contours from the largest one down
+        shapes, largest_contour = self.classifier.classify(contours, self.shapes, min_area)
+        if timings is not None:
+            _add_timing(timings, "hsv", hsv_done - start)
+            _add_timing(timings, "mask", mask_done - hsv_done)
+            _add_timing(timings, "contours", contours_done - mask_done)
+            _add_timing(timings, "classify", time.perf_counter() - contours_done)
+
+        if largest_contour is None:
+            return shapes, False
+        cx, cy, cw, ch = cv2.boundingRect(largest_contour)
+        cut_by_edge = (cx <= 0 and x > 0) or (cy <= 0 and y > 0) \
+            or (cx + cw >= w and x + w < frame_width) or (cy + ch >= h and y + h < frame_height)
+        return shapes, cut_by_edge
+
+    #Method for getting the region around the centre of the frame(the crosshair)
+    @staticmethod
+    def _centre_region(width: int, height: int, size: float):
+        w, h = max(1, int(width * size)), max(1, int(height * size))
+        return (width - w) // 2, (height - h) // 2, w, h
+
+    #Method that doubles the size of a region around its centre(kept inside the frame)
+    @staticmethod
+    def _grow_region(region, width: int, height: int):
+        x, y, w, h = region
+        grown_w, grown_h = min(width, w * 2), min(height, h * 2)
+        x = min(max(x + (w - grown_w) // 2, 0), width - grown_w)
+        y = min(max(y + (h - grown_h) // 2, 0), height - grown_h)
+        return x, y, grown_w, grown_h
+
+    #Method for clipping a region (x, y, width, height) declared by the client to the frame
+    #- the region is in the pixels of the full frame and is scaled to the image that was decoded at 1/scale
+    #- returns None if the region is outside the frame
+    @staticmethod
+    def _clip_region(roi, width: int, height: int, scale: int = 1):
+        try:
+            x, y, w, h = (int(value) // scale for value in roi)
+        except (TypeError, ValueError):
+            return 0, 0, width, height
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
     
     #Method to determine the largest shape based on the shape areas
     #- if two shapes are equally large, both will be returned
@@ -65,47 +171,48 @@ class ComputerVisionModel:
         
         return largest_shapes
 
-    # Method for determining the shapes detected using the contor map generated by the color mask
-    @staticmethod 
-    def _determine_shape_type(contor_map) -> str:
-        #estimate the number of vertices from the contor map
-        #-epsilon = 4% for better approximation for circles
-        vertices_approx  = cv2.approxPolyDP(contor_map, 0.04 * cv2.arcLength(contor_map, True), True)
-        
-        if len(vertices_approx) == 3:
-            return"triangle" 
-
-        if len(vertices_approx) == 4:
-            _, _, w, h = cv2.boundingRect(vertices_approx)
-            aspect_ratio = float(w) / h
-
-            #For squares, they should have almost the same width and height(aspect ratio should be close to 1)
-            if 0.90 <= aspect_ratio <= 1.10:
-                return "square"
-            else:
-                return "rectangle"
-        
-        #Anything with verticies more than 4 could potentially be a circle
-        #-For an exact shape, we 
-        if len(vertices_approx) > 4:
-            area = cv2.contourArea(contor_map)
-            perimeter = cv2.arcLength(contor_map, True)
-            if perimeter == 0:
-                return ''
-            #For a circles, the circularity should be 1(or really close to it)
-            circularity = 4 * np.pi * (area / (perimeter * perimeter))
-            if circularity > 0.7:
-                return "circle"
-
-        return ''
     #Method used for decoding a base64 image and reads it
-    @staticmethod
-    def _decode_image(image_base64):
+    #- returns the image and the scale it was decoded at
+    def _decode_image(self, image_base64, timings: dict | None = None):
+        start = time.perf_counter()
         try:
             image_data = base64.b64decode(image_base64)
-            np_arr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            return image
         except Exception as e:
             print(f"Error decoding image: {e}")
-            return None
\ No newline at end of file
+            return None, 1
+        if timings is not None:
+            _add_timing(timings, "base64", time.perf_counter() - start)
+        return self._decode_image_bytes(image_data, timings)
+
+    #Method used for reading an image from the raw JPEG bytes
+    #- returns the image and the scale it was decoded at
+    def _decode_image_bytes(self, image_bytes, timings: dict | None = None):
+        start = time.perf_counter()
+        try:
+            image, scale = self.decoder.decode(image_bytes, self.min_area)
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return None, 1
+        if timings is not None:
+            _add_timing(timings, "imdecode", time.perf_counter() - start)
+        return image, scale
+
+#Helper method for adding the time of a stage to the timings(a stage can run more than once in "grow" mode)
+def _add_timing(timings: dict, stage: str, seconds: float):
+    timings[stage] = timings.get(stage, 0.0) + seconds
+
+#Helper method that builds the JPEG frame used to warm up the models: a triangle of the first HSV range of every colour
+#- the frame is the size of the clients' largest frames(see CaptureQuality), so the decoder is warmed up for it
+def _warm_up_frame(width: int = 1280, height: int = 720) -> bytes:
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    colors = _color_table.colors
+    cell = width // max(1, len(colors))
+    for index, color in enumerate(colors):
+        low, high = sv.color_ranges[color][0]
+        hsv = np.uint8([[[(low[i] + high[i]) // 2 for i in range(3)]]])
+        bgr = tuple(int(c) for c in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0])
+        x = index * cell
+        triangle = np.array([[x + cell // 2, height // 4], [x + cell // 8, height * 3 // 4], [x + cell * 7 // 8, height * 3 // 4]])
+        cv2.fillPoly(image, [triangle], bgr)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return encoded.tobytes()
@@ -1,86 +1,427 @@
 # Phiwokwakhe Khathwane : 2022004325
-# Welcome Galane        : 2024671386 
+# Welcome Galane        : 2024671386
 
+import asyncio
+import secrets
+import time
+from collections import deque
 from fastapi import WebSocket
-from models import Message
+from models import Message, PingPayload
+from PubSub import MemoryPubSub
+from SpectatorHub import SpectatorHub, sse_event, snapshot_event
+from services.metrics import metrics
 from starlette.websockets import WebSocketState
+import services.config as cfg
+
+#Sentinel put in the send queue to close the connection after all the queued messages were sent
+_CLOSE = object()
+
+# This class wraps a websocket with a bounded send queue
+#- A writer task sends the queued messages one after the other, so a slow client only holds up its own queue
+#- Messages are queued already encoded, so a broadcast is only encoded once for all the recipients
+#- last_seen is the(monotonic) time the client last sent something, used to close dead connections
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, max_backlog: int, player_id: int | None = None,
+                 lobby_code: str | None = None, team_name: str | None = None):
+        self.websocket = websocket
+        self.player_id = player_id
+        self.lobby_code = lobby_code
+        self.team_name = team_name
+        self.last_seen = time.monotonic()
+        #set when the client answered a ping(older clients never do, they are not closed for being silent)
+        self.answers_pings = False
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_backlog)
+        self.closed = False
+        self._writer = asyncio.create_task(self._write_loop())
+
+    #Method for queueing an encoded message, returns False if the backlog is full
+    def send(self, data: str) -> bool:
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    #Method for closing the connection once all the queued messages have been sent
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((_CLOSE, code))
+        except asyncio.QueueFull:
+            self.abort(code)
+
+    #Method for closing the connection straight away(queued messages are dropped)
+    def abort(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.cancel()
+        asyncio.create_task(self._close_websocket(code))
+
+    #Method for stopping the writer task(the websocket was disconnected by the client)
+    def stop(self):
+        self.closed = True
+        self._writer.cancel()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                if isinstance(data, tuple) and data[0] is _CLOSE:
+                    self.closed = True
+                    await self._close_websocket(data[1])
+                    return
+                if self.websocket.client_state != WebSocketState.CONNECTED:
+                    continue
+                if metrics.enabled:
+                    start = time.perf_counter()
+                    await self.websocket.send_text(data)
+                    metrics.ws_send_seconds.observe(time.perf_counter() - start)
+                else:
+                    await self.websocket.send_text(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            #the socket is gone, the endpoint will remove the connection when the disconnect is recieved
+            self.closed = True
+
+    async def _close_websocket(self, code: int):
+        try:
+            if self.websocket.client_state == WebSocketState.CONNECTED:
+                await asyncio.wait_for(self.websocket.close(code=code), timeout=cfg.WS_CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+# Broadcasts of a lobby that can be replayed to a player that connects again
+#- Every broadcast gets the next message id of the lobby, the id is added to the message("id") so the clients know
+#    the last message they got. Only the last `size` broadcasts are kept
+#- Team broadcasts are kept with the team name, they are only replayed to the players of that team
+class MessageLog:
+    def __init__(self, size: int):
+        self.messages: deque[tuple[int, str | None, str]] = deque(maxlen=size)
+        self.last_id = 0
+        #(monotonic) time the last player of the lobby disconnected, None while players are connected
+        self.idle_since: float | None = None
+
+    #Method that gives a broadcast the next message id and keeps it, returns the message with the id
+    def append(self, team_name: str | None, data: str) -> str:
+        self.last_id += 1
+        data = f'{data[:-1]},"id":{self.last_id}}}'
+        self.messages.append((self.last_id, team_name, data))
+        return data
+
+    #Method that returns the broadcasts sent after `last_id` to a player of the team
+    #- None if some of them are not kept anymore(or the id is not from this log)
+    def since(self, last_id: int, team_name: str) -> list[str] | None:
+        if last_id > self.last_id:
+            return None
+        if last_id == self.last_id:
+            return []
+        if not self.messages or self.messages[0][0] > last_id + 1:
+            return None
+        return [data for message_id, team, data in self.messages
+                if message_id > last_id and (team is None or team == team_name)]
 
 # This class handle all the connections for lobbies and teams
 # It also handles the sending of messages to different teams, lobbies and individuals
+#- Messages are sent to the websockets of this worker and published(see PubSub) to the other server workers,
+#    the messages published by the other workers are sent to the websockets of this worker
+#- The spectators' events(see SpectatorHub) are sent the same way, after the players' messages
+#- Heartbeat: every `ping_interval` seconds a "ping" is sent to every player, the clients answer with a "pong".
+#    A connection that answered a ping before and did not send anything for `idle_timeout` seconds is dead(for
+#    example a phone that lost its network without closing the socket), it is removed and closed so it does not get
+#    the broadcasts anymore. Clients that never answer the pings(older clients) are only removed when a send fails
+#- Reconnects: the lobby and team broadcasts are kept in a message log per lobby(see MessageLog). A player that
+#    connects again with its resume token and the id of the last message it got only gets the messages it missed.
+#    The message ids are counted by every server worker(the stream id), the messages can not be replayed if the
+#    player connects to another worker or a restarted server
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_backlog: int = cfg.WS_SEND_QUEUE_SIZE, backlog_policy: str = cfg.WS_BACKLOG_POLICY,
+                 pubsub=None, ping_interval: float = cfg.WS_PING_INTERVAL, idle_timeout: float = cfg.WS_IDLE_TIMEOUT,
+                 replay_size: int = cfg.WS_REPLAY_SIZE, resume_window: float = cfg.WS_RESUME_WINDOW):
        # Dictionary for all active lobbies
         #- The outer dictionary key is the lobby code
-        #- The inner dictionary key is the team name and the value is a list of WebSocket connections for that team
-        self.active_connections: dict[str, dict[str,list[WebSocket]]] = {}
-    
+        #- The inner dictionary key is the team name and the value is the connections for that team
+        #    indexed by the player id
+        self.active_connections: dict[str, dict[str,dict[int, ClientConnection]]] = {}
+        #Connection wrapper of every connected websocket
+        self.connections: dict[WebSocket, ClientConnection] = {}
+        #Connection of every connected player(indexed by the player id)
+        self.player_connections: dict[int, ClientConnection] = {}
+
+        #What to do with a client that has more than `max_backlog` messages waiting to be sent
+        #- "drop": the new message is dropped for that client
+        #- "disconnect": the client is disconnected
+        self.max_backlog = max_backlog
+        self.backlog_policy = backlog_policy if backlog_policy in ("drop", "disconnect") else "disconnect"
+        self.dropped_messages = 0
+        self.pubsub = pubsub if pubsub is not None else MemoryPubSub()
+        #spectators connected to this worker
+        self.spectators = SpectatorHub()
+
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.reaped_connections = 0
+        #message log of every lobby with players connected to this worker(see MessageLog)
+        self.stream_id = secrets.token_hex(4)
+        self.logs: dict[str, MessageLog] = {}
+        self.replay_size = replay_size
+        self.resume_window = resume_window
+
+    #Method for subscribing to the messages of the other workers(called from the app lifespan)
+    async def start(self):
+        await self.pubsub.start(self._on_published)
+
+    async def shutdown(self):
+        await self.pubsub.close()
+
+    #Method for switching the recording of the metrics on or off, in this worker and in the other workers
+    def set_metrics(self, enabled: bool):
+        metrics.enabled = enabled
+        self.pubsub.publish("metrics:" + ("on" if enabled else "off"), "")
+
     #Method for adding and connecting a client(player) to the lobby
-    async def connect(self, lobby_code: str, team_name: str, websocket: WebSocket):
-        await websocket.accept()
+    #- subprotocol is the websocket subprotocol that was negotiated with the client(if any)
+    #- If the player is already connected(reconnecting), the old connection is closed and replaced
+    async def connect(self, lobby_code: str, team_name: str, websocket: WebSocket, player_id: int,
+                      subprotocol: str | None = None) -> ClientConnection:
+        await websocket.accept(subprotocol=subprotocol)
         if lobby_code not in self.active_connections.keys():
             self.active_connections[lobby_code] = {} #Initialize the lobby entry if it doesn't exist
 
         #Check if the team already has an entry in the lobby's connection list
         if team_name not in self.active_connections[lobby_code].keys():
-            self.active_connections[lobby_code][team_name] = [] #Initialize the team entry if it doesn't exist
-        
-        #Add the new connection to the list for this team
-        self.active_connections[lobby_code][team_name].append(websocket)
+            self.active_connections[lobby_code][team_name] = {} #Initialize the team entry if it doesn't exist
+
+        #Close the player's previous connection
+        previous = self.player_connections.get(player_id)
+        if previous:
+            self.connections.pop(previous.websocket, None)
+            previous.abort(code=1000)
+
+        #Add the new connection for this team
+        connection = ClientConnection(websocket, self.max_backlog, player_id, lobby_code, team_name)
+        self.connections[websocket] = connection
+        self.player_connections[player_id] = connection
+        self.active_connections[lobby_code][team_name][player_id] = connection
+        log = self.logs.get(lobby_code)
+        if log is None:
+            log = self.logs[lobby_code] = MessageLog(self.replay_size)
+        log.idle_since = None
+        return connection
+
+    #Method for sending the broadcasts a player missed(the player connected again)
+    #- stream and last_id: the stream id and the id of the last message the player got
+    #- returns the number of messages replayed, None if they could not be replayed
+    def replay(self, connection: ClientConnection, stream: str | None, last_id: int) -> int | None:
+        log = self.logs.get(connection.lobby_code)
+        if log is None or stream != self.stream_id:
+            return None
+        messages = log.since(last_id, connection.team_name)
+        if messages is None:
+            return None
+        for data in messages:
+            self._push(connection, data)
+        return len(messages)
 
     #Method for removing a websocket from the lobby and team
     #- The actual disconnecting of the websocket will be handled on the websocket endpoint
     def disconnect(self, lobby_code: str, team_name: str, websocket: WebSocket):
-        if lobby_code in self.active_connections and team_name in self.active_connections[lobby_code]:
-            self.active_connections[lobby_code][team_name].remove(websocket)
-        else:
+        connection = self.connections.pop(websocket, None)
+        if not connection:
+            return
+        connection.stop()
+        if self.player_connections.get(connection.player_id) is connection:
+            del self.player_connections[connection.player_id]
+
+        team_connections = self.active_connections.get(lobby_code, {}).get(team_name)
+        if team_connections is None or team_connections.get(connection.player_id) is not connection:
             return
-        
+        del team_connections[connection.player_id]
+
         #If the team has no more active connections, remove the team entry
         if not self.active_connections[lobby_code][team_name]:
             del self.active_connections[lobby_code][team_name]
 
         #If the lobby has no more active connections, remove the lobby entry
+        #- its messages are kept for the players that connect again(see heartbeat_loop)
         if not self.active_connections[lobby_code]:
             del self.active_connections[lobby_code]
-    
+            if lobby_code in self.logs:
+                self.logs[lobby_code].idle_since = time.monotonic()
+
+    #Task that sends the pings and closes the connections that are dead(see above)
+    #- the message logs of the lobbies without players are dropped after the resume window
+    async def heartbeat_loop(self):
+        if not self.ping_interval:
+            return
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            data = self.encode(Message(type="ping", payload=PingPayload(server_time=time.time())))
+            for connection in list(self.connections.values()):
+                if connection.answers_pings and now - connection.last_seen > self.idle_timeout:
+                    self._reap(connection)
+                else:
+                    self._push(connection, data)
+            for lobby_code, log in list(self.logs.items()):
+                if log.idle_since is not None and now - log.idle_since > self.resume_window:
+                    del self.logs[lobby_code]
+
+    #Method for removing and closing a dead connection
+    def _reap(self, connection: ClientConnection):
+        self.reaped_connections += 1
+        #1001: going away, the client can connect again with its resume token
+        connection.abort(code=1001)
+        self.disconnect(connection.lobby_code, connection.team_name, connection.websocket)
+
     #Broadcasting a message to a specific team in a specific lobby
-    #-broadcast if the connection is open
+    #-the message is encoded once and queued for every connection in the team
     async def send_message_to_team(self,lobby_code:str, team_name:str, message: Message):
-        if lobby_code in self.active_connections.keys():
-            if team_name in self.active_connections[lobby_code].keys():
-                for connection in self.active_connections[lobby_code][team_name]:
-                    if connection.client_state == WebSocketState.CONNECTED:
-                        await connection.send_json(message.model_dump_json())
+        start = time.perf_counter()
+        data = self.encode(message)
+        self._deliver_to_team(lobby_code, team_name, data)
+        self.pubsub.publish(f"team:{lobby_code}:{team_name}", data)
+        if metrics.enabled:
+            metrics.broadcast_seconds.observe(time.perf_counter() - start, "team")
 
     #Broadcasting a message to a specific lobby
-    #-broadcast if the connection is open
+    #-the message is encoded once and queued for every connection in the lobby
     async def send_message_to_Lobby(self, lobby_code:str,message:Message):
-        if lobby_code in self.active_connections.keys():
-            #At most, we will have 2 teams in a lobby, so we can iterate through both teams and send the message to each
-            for team in self.active_connections[lobby_code].keys():
-                for connection in self.active_connections[lobby_code][team]:
-                    if connection.client_state == WebSocketState.CONNECTED:
-                        await connection.send_json(message.model_dump_json())
+        start = time.perf_counter()
+        data = self.encode(message)
+        self._deliver_to_lobby(lobby_code, data)
+        self.pubsub.publish(f"lobby:{lobby_code}", data)
+        if metrics.enabled:
+            metrics.broadcast_seconds.observe(time.perf_counter() - start, "lobby")
 
     #Send a message to just one player
     async def send_personal_message(self, message: Message, websocket: WebSocket):
-        if websocket.client_state == WebSocketState.CONNECTED:
-            await websocket.send_json(message.model_dump_json())
-    
+        connection = self.connections.get(websocket)
+        if connection:
+            self._push(connection, self.encode(message))
+
+    #Send a message to a player given the player id
+    async def send_message_to_player(self, player_id: int, message: Message):
+        data = self.encode(message)
+        connection = self.player_connections.get(player_id)
+        if connection:
+            self._push(connection, data)
+        else:
+            self.pubsub.publish(f"player:{player_id}", data)
+
+    #Send a message to every player connected to this worker(the message is not published to the other workers)
+    async def send_message_to_local_players(self, message: Message):
+        data = self.encode(message)
+        for connection in list(self.connections.values()):
+            self._push(connection, data)
+
+    #Method to determine if the events of a lobby must be sent to spectators
+    #- with more than one worker the spectators can be connected to any worker
+    def has_spectators(self, lobby_code: str) -> bool:
+        return self.spectators.has_spectators(lobby_code) or not isinstance(self.pubsub, MemoryPubSub)
+
+    #Send a message to the spectators of a lobby
+    async def send_message_to_spectators(self, lobby_code: str, message: Message):
+        self._send_to_spectators(lobby_code, sse_event(self.encode(message)))
+
+    #Send the lobby details(see LobbySnapshots) to the spectators of a lobby
+    async def send_snapshot_to_spectators(self, lobby_code: str, details: bytes):
+        self._send_to_spectators(lobby_code, snapshot_event(details))
+
+    #Method for ending the spectators' streams of a lobby(after the events that are already queued)
+    async def close_spectators(self, lobby_code: str):
+        self.spectators.end_lobby(lobby_code)
+        self.pubsub.publish(f"spectate-close:{lobby_code}", "")
+
+    def _send_to_spectators(self, lobby_code: str, data: str):
+        self.spectators.deliver(lobby_code, data)
+        self.pubsub.publish(f"spectate:{lobby_code}", data)
+
+    #Method to get the connection of a player, None if the player is not connected
+    def get_player_connection(self, player_id: int) -> ClientConnection | None:
+        return self.player_connections.get(player_id)
+
     #Method for disconnecting the entire lobby from the game sockets
+    #- The connections are closed after the messages that are already queued have been sent
     async def disconnect_lobby(self, lobby_code:str):
+        self._close_lobby(lobby_code)
+        self.pubsub.publish(f"close:{lobby_code}", "")
+
+    def _close_lobby(self, lobby_code:str):
+        self.logs.pop(lobby_code, None)
         lobby = self.active_connections.get(lobby_code)
         if not lobby:
             return
         #Disconnect everyone on the lobby
         for team_id, team_connections in list(lobby.items()):
-            for connection in team_connections:
-                if connection.client_state == WebSocketState.CONNECTED:
-                    await connection.close(code=1000)
+            for connection in team_connections.values():
+                connection.close(code=1000)
+                self.connections.pop(connection.websocket, None)
+                if self.player_connections.get(connection.player_id) is connection:
+                    del self.player_connections[connection.player_id]
 
         #delete lobby connections
-        await self._remove_lobby_connections(lobby_code)
+        del self.active_connections[lobby_code]
 
-    async def _remove_lobby_connections(self, lobby_code:str):
-        if lobby_code in self.active_connections:
-            del self.active_connections[lobby_code]
+    #- the broadcasts are given a message id by the lobby's message log(the id is added to the encoded message)
+    def _deliver_to_team(self, lobby_code:str, team_name:str, data: str):
+        log = self.logs.get(lobby_code)
+        if log is not None:
+            data = log.append(team_name, data)
+        if lobby_code in self.active_connections.keys():
+            if team_name in self.active_connections[lobby_code].keys():
+                for connection in list(self.active_connections[lobby_code][team_name].values()):
+                    self._push(connection, data)
+
+    def _deliver_to_lobby(self, lobby_code:str, data: str):
+        log = self.logs.get(lobby_code)
+        if log is not None:
+            data = log.append(None, data)
+        if lobby_code in self.active_connections.keys():
+            #At most, we will have 2 teams in a lobby, so we can iterate through both teams and send the message to each
+            for team in list(self.active_connections[lobby_code].keys()):
+                for connection in list(self.active_connections[lobby_code][team].values()):
+                    self._push(connection, data)
+
+    #Method that handles a message published by another worker
+    #- topics: "lobby:<lobby code>", "team:<lobby code>:<team name>", "player:<player id>", "close:<lobby code>",
+    #    "spectate:<lobby code>", "spectate-close:<lobby code>" and "metrics:<on|off>"
+    def _on_published(self, topic: str, data: str):
+        kind, _, target = topic.partition(":")
+        if kind == "lobby":
+            self._deliver_to_lobby(target, data)
+        elif kind == "team":
+            lobby_code, _, team_name = target.partition(":")
+            self._deliver_to_team(lobby_code, team_name, data)
+        elif kind == "player":
+            connection = self.player_connections.get(int(target))
+            if connection:
+                self._push(connection, data)
+        elif kind == "close":
+            self._close_lobby(target)
+        elif kind == "spectate":
+            self.spectators.deliver(target, data)
+        elif kind == "spectate-close":
+            self.spectators.end_lobby(target)
+        elif kind == "metrics":
+            metrics.enabled = target == "on"
+
+    #Method for encoding a message once before it is sent to the recipients
+    @staticmethod
+    def encode(message: Message) -> str:
+        return message.to_json()
+
+    #Method for queueing an encoded message to a connection and applying the backlog policy
+    def _push(self, connection: ClientConnection, data: str):
+        if connection.send(data):
+            if metrics.enabled:
+                metrics.messages_queued_total.inc()
+            return
+        self.dropped_messages += 1
+        if self.backlog_policy == "disconnect":
+            #1013: try again later, the client could not keep up
+            connection.abort(code=1013)
@@ -0,0 +1,76 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import cv2
+import numpy as np
+
+# Classifier for the contours found in the colour mask(used by the computer vision model)
+#  - Only the largest shape is detected(or the shapes that are equally large), so the contours are sorted by area
+#    and classified from the largest one down. The classification stops as soon as the largest shape is found,
+#    the smaller contours can not change the answer(in a frame with a lot of noise every contour may be classified)
+#  - A contour whose area fills less than `min_extent` of its bounding box(lines, thin strips and ragged noise) is
+#    not a shape, it is rejected before the polygon approximation. This also rejects very thin shapes that are
+#    turned diagonally(the original model could classify them), `min_extent=0` classifies every contour
+#  - The area and perimeter of a contour are only computed once
+
+class ContourClassifier:
+    def __init__(self, min_extent: float = 0.25):
+        self.min_extent = min_extent
+
+    #Method for classifying the contours
+    #- returns the largest shapes(shape, area) that are in `shapes` and the largest contour(None if
+    #    there is no contour with an area of at least `min_area`)
+    def classify(self, contours, shapes, min_area: float) -> tuple[list[tuple[str, float]], np.ndarray | None]:
+        #Shape must be within the minimum allowed area, otherwise we ignore
+        candidates = []
+        for cnt in contours:
+            area = cv2.contourArea(cnt)
+            if area >= min_area:
+                candidates.append((area, cnt))
+        if not candidates:
+            return [], None
+
+        #largest first(the sort is stable, equally large contours keep their order)
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        found: list[tuple[str, float]] = []
+        for area, cnt in candidates:
+            if found and area < found[0][1]:
+                break
+            shape_type = self.shape_type(cnt, area)
+            if shape_type in shapes:
+                found.append((shape_type, area))
+        return found, candidates[0][1]
+
+    # Method for determining the shape of a contour with the given area
+    def shape_type(self, contour, area: float) -> str:
+        _, _, w, h = cv2.boundingRect(contour)
+        if area < self.min_extent * w * h:
+            return ''
+        perimeter = cv2.arcLength(contour, True)
+        if perimeter == 0:
+            return ''
+
+        #estimate the number of vertices from the contour
+        #-epsilon = 4% for better approximation for circles
+        vertices_approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
+
+        if len(vertices_approx) == 3:
+            return "triangle"
+
+        if len(vertices_approx) == 4:
+            _, _, w, h = cv2.boundingRect(vertices_approx)
+            aspect_ratio = float(w) / h
+
+            #For squares, they should have almost the same width and height(aspect ratio should be close to 1)
+            if 0.90 <= aspect_ratio <= 1.10:
+                return "square"
+            return "rectangle"
+
+        #Anything with verticies more than 4 could potentially be a circle
+        #-For a circle, the circularity should be 1(or really close to it)
+        if len(vertices_approx) > 4:
+            circularity = 4 * np.pi * (area / (perimeter * perimeter))
+            if circularity > 0.7:
+                return "circle"
+
+        return ''
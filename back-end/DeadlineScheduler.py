@@ -0,0 +1,79 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import heapq
+import itertools
+import time
+
+# Deadline scheduler used by the lobby manager's game timer loop
+#  - Every deadline is identified by a kind(e.g. "game_end") and a key(the lobby code) and is stored as an
+#    absolute monotonic time in a heap, so the loop only wakes up when the next deadline is due
+#  - Re-scheduling or cancelling a deadline leaves the old heap entry behind, it is skipped when it is popped
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int, str, str]] = []
+        self._deadlines: dict[tuple[str, str], float] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    #Method for scheduling(or re-scheduling) a deadline `delay` seconds from now
+    #- `at` can be used instead of `delay` to give the absolute monotonic time
+    def schedule(self, kind: str, key: str, delay: float = 0, at: float | None = None) -> float:
+        deadline = at if at is not None else time.monotonic() + delay
+        self._deadlines[(kind, key)] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), kind, key))
+        #wake the loop up, the new deadline could be earlier than the one it is waiting for
+        self._wakeup.set()
+        return deadline
+
+    #Method for cancelling a deadline
+    def cancel(self, kind: str, key: str):
+        self._deadlines.pop((kind, key), None)
+
+    #Method for cancelling all the deadlines of a key
+    def cancel_all(self, key: str):
+        for kind, deadline_key in list(self._deadlines.keys()):
+            if deadline_key == key:
+                del self._deadlines[(kind, deadline_key)]
+
+    #Method to get the(absolute monotonic) time of a deadline, None if it is not scheduled
+    def deadline(self, kind: str, key: str) -> float | None:
+        return self._deadlines.get((kind, key))
+
+    #Method that returns all the deadlines that are scheduled as (kind, key, deadline)
+    def scheduled(self) -> list[tuple[str, str, float]]:
+        return [(kind, key, deadline) for (kind, key), deadline in self._deadlines.items()]
+
+    #Method to get the time of the next deadline, None if there are no deadlines
+    def next_deadline(self) -> float | None:
+        while self._heap:
+            deadline, _, kind, key = self._heap[0]
+            if self._deadlines.get((kind, key)) == deadline:
+                return deadline
+            heapq.heappop(self._heap) #cancelled or re-scheduled
+        return None
+
+    #Method that removes and returns all the deadlines that are due(in order) as (kind, key, deadline)
+    def pop_due(self, now: float | None = None) -> list[tuple[str, str, float]]:
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, kind, key = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, key)) == deadline:
+                del self._deadlines[(kind, key)]
+                due.append((kind, key, deadline))
+        return due
+
+    #Method that waits until the next deadline is due(or a new deadline is scheduled)
+    async def wait(self):
+        self._wakeup.clear()
+        next_deadline = self.next_deadline()
+        timeout = None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+        if timeout == 0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,73 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+from models import Player, Team
+
+# Game state kept by the state backend(lobbies, teams and players)
+#  - Plain classes with __slots__ instead of pydantic models, the state is read and updated for every shot
+#    and timer deadline and does not need to be validated
+#  - The pydantic models in "models.py" are only used at the HTTP API edge, to_model() converts the state
+#    for an API response
+#  - The classes can be pickled, so the "shared" state backend can send them to the server workers
+
+class PlayerState:
+    __slots__ = ("id", "name", "team_id", "hits")
+
+    def __init__(self, id: int, name: str, team_id: str = "", hits: int = 0):
+        self.id = id
+        self.name = name
+        self.team_id = team_id
+        self.hits = hits
+
+    def to_model(self) -> Player:
+        return Player(id=self.id, name=self.name, team_id=self.team_id, hits=self.hits)
+
+#-The players are indexed by their id
+class TeamState:
+    __slots__ = ("id", "color", "shape", "max_players", "score", "hits", "misses", "shots", "players")
+
+    def __init__(self, id: str, color: str, shape: str, max_players: int = 0):
+        self.id = id
+        self.color = color
+        self.shape = shape
+        self.max_players = max_players
+        self.score = 0
+        self.hits = 0
+        self.misses = 0
+        self.shots = 0
+        self.players: dict[int, PlayerState] = {}
+
+    #gets the player from the players
+    def get_player(self, user_id: int) -> PlayerState | None:
+        return self.players.get(user_id)
+
+    #adds a player to the team
+    def add_player(self, player: PlayerState):
+        self.players[player.id] = player
+
+    #removes a player from the team, returns the removed player(None if the player was not in the team)
+    def remove_player(self, user_id: int) -> PlayerState | None:
+        return self.players.pop(user_id, None)
+
+    def to_model(self) -> Team:
+        return Team(id=self.id, score=self.score, color=self.color, shape=self.shape, hits=self.hits,
+                    misses=self.misses, shots=self.shots, max_players=self.max_players,
+                    players={player_id: player.to_model() for player_id, player in self.players.items()})
+
+class LobbyState:
+    __slots__ = ("teams", "game_status", "time_remaining", "start_time", "duration",
+                 "allowed_inactive_time", "allowed_active_time_for_detail", "version")
+
+    def __init__(self, teams: dict[str, TeamState]):
+        self.teams = teams
+        #'not_started', 'running' or 'game_over'
+        self.game_status = 'not_started'
+        #see the Lobby model for the times
+        self.time_remaining: float = 60
+        self.start_time: float | None = None
+        self.duration: float = 60
+        self.allowed_inactive_time = 120
+        #only used if the result of the game could not be written to the results store(see LobbyManager)
+        self.allowed_active_time_for_detail = 30
+        #changed by the state backend every time the lobby is changed(see StateBackend)
+        self.version = 0
@@ -0,0 +1,103 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import math
+import struct
+import cv2
+import numpy as np
+import services.config as cfg
+
+#libjpeg-turbo decoder(optional), only used if the "PyTurboJPEG" package and the libjpeg-turbo library are installed
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+# JPEG decoder used by the computer vision model
+#  - The shape detection does not need the full resolution of a camera frame, so the frame can be decoded at
+#    1/2, 1/4 or 1/8 of its size. The scaling is done by the JPEG decoder(in the DCT domain), the full resolution
+#    image is never built, which makes the decoding a lot faster
+#  - Decoders: "opencv" uses cv2.imdecode with the reduced read modes(IMREAD_REDUCED_COLOR_2/4/8) and "turbojpeg" uses
+#    libjpeg-turbo directly, "auto" uses turbojpeg when it is installed and opencv otherwise
+#  - In "auto" scale mode the scale is picked from the frame size(read from the JPEG header), so that the smallest
+#    expected target(`target_size` of the shorter side of the frame, and never less than `min_area`) still has
+#    MIN_TARGET_SIDE pixels across after scaling
+#  - The decoder returns the scale it used, the caller must scale the areas and regions it uses(by 1/scale)
+
+SCALES = (1, 2, 4, 8)
+#Smallest size(in pixels) of a target after scaling that still gives a reliable polygon approximation
+MIN_TARGET_SIDE = 24
+
+#OpenCV read modes that decode the image at 1/scale of its size
+_OPENCV_MODES = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+#JPEG start of frame markers(the frame header has the size of the image)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_SOF_SIZE = struct.Struct(">HH")
+
+#Method that reads the width and height of a JPEG image from its frame header, None if it is not a JPEG image
+def jpeg_size(data) -> tuple[int, int] | None:
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    offset = 2
+    while offset + 9 <= len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        #fill bytes and markers without a segment
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height, width = _SOF_SIZE.unpack_from(view, offset + 5)
+            return width, height
+        if marker == 0xD9 or marker == 0xDA:
+            return None #end of image or start of the image data, there was no frame header
+        offset += 2 + ((view[offset + 2] << 8) | view[offset + 3])
+    return None
+
+class ImageDecoder:
+    def __init__(self, backend: str = cfg.VISION_DECODER, scale: str | int = cfg.VISION_DECODE_SCALE,
+                 target_size: float = cfg.VISION_TARGET_SIZE):
+        self.scale = int(scale) if str(scale) in ("1", "2", "4", "8") else "auto"
+        self.target_size = min(max(target_size, 0.0), 1.0)
+        self._turbo = None
+        if backend in ("auto", "turbojpeg") and TurboJPEG is not None:
+            try:
+                self._turbo = TurboJPEG()
+            except Exception as e:
+                #the python package is installed but the libjpeg-turbo library was not found
+                if backend == "turbojpeg":
+                    print(f"Error loading libjpeg-turbo, falling back to the OpenCV decoder: {e}")
+        elif backend == "turbojpeg":
+            print("PyTurboJPEG is not installed, falling back to the OpenCV decoder")
+        self.backend = "turbojpeg" if self._turbo is not None else "opencv"
+
+    #Method for decoding the image bytes, returns the image(BGR, None if it could not be decoded) and the scale it
+    #was decoded at
+    def decode(self, data, min_area: float = 0) -> tuple[np.ndarray | None, int]:
+        scale = self.scale
+        if scale == "auto":
+            size = jpeg_size(data)
+            scale = self.pick_scale(size[0], size[1], min_area) if size else 1
+
+        if self._turbo is not None:
+            try:
+                return self._turbo.decode(data, pixel_format=TJPF_BGR,
+                                          scaling_factor=(1, scale) if scale > 1 else None), scale
+            except Exception:
+                pass #not a JPEG image, OpenCV also reads other formats
+        return cv2.imdecode(np.frombuffer(data, np.uint8), _OPENCV_MODES[scale]), scale
+
+    #Method that picks the largest scale at which the smallest expected target still has MIN_TARGET_SIDE pixels across
+    def pick_scale(self, width: int, height: int, min_area: float = 0) -> int:
+        target_side = max(self.target_size * min(width, height), math.sqrt(max(min_area, 0)))
+        for scale in reversed(SCALES):
+            if target_side / scale >= MIN_TARGET_SIDE:
+                return scale
+        return 1
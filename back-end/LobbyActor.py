@@ -0,0 +1,76 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+from typing import Awaitable, Callable
+
+#Sentinel put in the inbox to stop the actor after the events that are already queued
+_STOP = object()
+
+# Actor of a lobby: a task with an inbox that handles the events of one lobby one at a time
+#  - The events(players joining and leaving, hits, timer deadlines and the game over) are coroutines that are put
+#    in the inbox and handled in the order they were posted, so they never interleave(for example, a hit can not
+#    be scored while the game over is being broadcast)
+#  - post() does not wait for the event, so the shooters' loops do not wait for the broadcasts. call() waits for the
+#    event and returns its result
+#  - The actor stops when stop() is called or when it had no events for `idle_timeout` seconds(a new actor is
+#    created for the next event). A stopping actor still handles the events posted after stop() and only stops when
+#    its inbox is empty, so a lobby never has two actors running its events at the same time
+
+class LobbyActor:
+    def __init__(self, lobby_code: str, on_stop: Callable[["LobbyActor"], None] | None = None,
+                 idle_timeout: float = 300):
+        self.lobby_code = lobby_code
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        #stop() was called, the actor stops once its inbox is empty
+        self.stopping = False
+        #the actor's task has ended, events posted to it are not handled
+        self.stopped = False
+        self.idle_timeout = idle_timeout
+        self._on_stop = on_stop
+        self._task = asyncio.create_task(self._run())
+
+    #Method for posting an event, the event is handled after the events that are already in the inbox
+    def post(self, handler: Callable[..., Awaitable], *args):
+        self.inbox.put_nowait((handler, args, None))
+
+    #Method for posting an event and waiting for its result
+    async def call(self, handler: Callable[..., Awaitable], *args):
+        future = asyncio.get_running_loop().create_future()
+        self.inbox.put_nowait((handler, args, future))
+        return await future
+
+    #Method for stopping the actor once the events in the inbox have been handled
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            self.inbox.put_nowait(_STOP)
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(self.inbox.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if self.inbox.empty():
+                        break
+                    continue
+                if event is _STOP:
+                    #events posted after stop() are handled first
+                    if self.inbox.empty():
+                        break
+                    self.inbox.put_nowait(_STOP)
+                    continue
+                handler, args, future = event
+                try:
+                    result = await handler(*args)
+                    if future is not None and not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    print(f"Error handling an event of lobby {self.lobby_code}: {e!r}")
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+        finally:
+            self.stopped = True
+            if self._on_stop:
+                self._on_stop(self)
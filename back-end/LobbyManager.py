@@ -2,120 +2,437 @@
 # Welcome Galane        : 2024671386 
 
 from fastapi import HTTPException
-from models import Lobby, Message, GameOverPayload, Player
+from models import Message, GameOverPayload, StartGamePayload, ClockSyncPayload, JoinedTeamPayload, ShotHitPayload, MissedShotPayload, SpectatorScorePayload, SyncPayload
 from ConnectionManager import ConnectionManager
 import services.service as sv
-from models import Team, TimerReportPayload
+import services.config as cfg
+from models import TimerReportPayload
+from GameState import LobbyState, PlayerState, TeamState
+from DeadlineScheduler import DeadlineScheduler
+from LobbyActor import LobbyActor
+from LobbySnapshots import LobbySnapshots, LobbySnapshot
+from ResultsStore import ResultsStore
+from StateSnapshot import StateSnapshot
+from StateBackend import MemoryStateBackend
+from services.metrics import metrics
 import time
-import asyncio
 
 #Classed used to handle all lobby related operations
 #- Uses the Connection manager for sending messages when it needs to.
 #- This class also contains the game loop(for lobbies) and keeps track of which lobbies are active
+#- The game loop is driven by deadlines(game end, timer reports, inactivity expiry and lobby eviction),
+#    so it only wakes up for the lobbies that have something due
+#- Timer modes(TIMER_SYNC_MODE):
+#    "broadcast": a timer_report is sent to the lobby every second
+#    "client": the clients count down from the start_game message and a clock_sync correction
+#              is only sent every CLOCK_SYNC_INTERVAL seconds
+#- The lobbies are kept in the state backend(see StateBackend), with more than one server worker a lobby can be
+#    used from any worker. The deadlines of a lobby are kept by the worker that scheduled them(the worker that
+#    created the lobby or started the game), they are checked against the shared state when they are due
+#- The events of a lobby(players joining and leaving, hits and the timer deadlines) are handled by the lobby's
+#    actor(see LobbyActor) one at a time and in order, the callers only post them and do not wait for the broadcasts
+#- When a game is over its final details are added to the results store(see ResultsStore) and the lobby is
+#    removed as soon as they are written, the details of a finished game are then read from the store
+#- The spectators(see SpectatorHub) get the same events after the players: the lobby details when a player joins
+#    or leaves and when the game starts or ends, the new totals after a hit and the timer reports
+#- With the "memory" state backend the lobbies and their timers are written to a snapshot(see StateSnapshot) and
+#    restored by the next server process. The timers keep the time they had left when the snapshot was captured
+#    and the players of a restored game can connect again with their resume token while it is running(the key of
+#    the tokens is kept in the snapshot when WS_RESUME_SECRET is not set)
+#- A player that lost its connection can connect again with its resume token, the messages it missed are replayed
+#    by the connection manager when they can be. Otherwise the player gets the game time and the scores("sync")
+
+#Player found in the lobbies: lobby code, team id and player
+class PlayerEntry:
+    __slots__ = ("lobby_code", "team_id", "player")
+
+    def __init__(self, lobby_code: str, team_id: str, player: PlayerState):
+        self.lobby_code = lobby_code
+        self.team_id = team_id
+        self.player = player
+
+#Kinds of deadlines used by the game timer loop
+GAME_END = "game_end"
+TIMER_REPORT = "timer_report"
+INACTIVE = "inactive"
+EVICT = "evict"
 
 class LobbyManager:
-    def __init__(self, c_manager: ConnectionManager):
+    def __init__(self, c_manager: ConnectionManager, state=None, timer_mode: str = cfg.TIMER_SYNC_MODE,
+                 results: ResultsStore | None = None, snapshot: StateSnapshot | None = None):
         self.c_manager = c_manager
-        self.lobbies: dict[str, Lobby] = {}
+        self.state = state if state is not None else MemoryStateBackend()
+        #games started by this worker(the worker keeps their timers)
         self.active_lobbies = {}
+        self.scheduler = DeadlineScheduler()
+        self.timer_mode = timer_mode if timer_mode in ("broadcast", "client") else "broadcast"
+        #actor of every lobby that has events on this worker
+        self.actors: dict[str, LobbyActor] = {}
+        #serialised lobby details per lobby version(for the spectators)
+        self.snapshots = LobbySnapshots()
+        #results of the finished games
+        self.results = results if results is not None else ResultsStore()
+        #snapshots of the state for restarts(only the "memory" state backend is kept by this worker)
+        self.snapshot = snapshot if snapshot is not None else StateSnapshot()
+        if not isinstance(self.state, MemoryStateBackend):
+            self.snapshot.path = ""
+        self._snapshot_version = None
+
+    #Method to get the actor of a lobby(a new actor is started if the lobby does not have one)
+    #- an actor that is stopping is still used(it handles the event before it stops), it is only replaced once it
+    #    has stopped(see _on_actor_stopped)
+    def _actor(self, lobby_code: str) -> LobbyActor:
+        actor = self.actors.get(lobby_code)
+        if actor is None or actor.stopped:
+            actor = self.actors[lobby_code] = LobbyActor(lobby_code, on_stop=self._on_actor_stopped)
+        return actor
+
+    #Method for stopping the actor of a lobby(after the events that are already posted)
+    def _stop_actor(self, lobby_code: str):
+        actor = self.actors.get(lobby_code)
+        if actor:
+            actor.stop()
+
+    def _on_actor_stopped(self, actor: LobbyActor):
+        if self.actors.get(actor.lobby_code) is actor:
+            del self.actors[actor.lobby_code]
+
+    #Event posted when a player connected to the lobby's websocket
+    #- the join is broadcast to the lobby and the game is started when both teams are full
+    def player_joined(self, lobby_code: str, team_id: str, player: PlayerState):
+        self._actor(lobby_code).post(self._on_player_joined, lobby_code, team_id, player)
+
+    #Event posted when a player connected again with its resume token(see ConnectionManager)
+    #- replayed: the messages the player missed were replayed, otherwise the player gets the game time and the scores
+    def player_resumed(self, lobby_code: str, team_id: str, player: PlayerState, replayed: bool):
+        if not replayed:
+            self._actor(lobby_code).post(self._on_player_resumed, lobby_code, team_id, player)
+
+    #Event posted when a player hit the opposing team
+    def player_hit(self, lobby_code: str, team_shooter_id: str, team_shot_id: str, player_id: int, seq: int | None = None):
+        self._actor(lobby_code).post(self._on_player_hit, lobby_code, team_shooter_id, team_shot_id, player_id, seq)
+
+    #Event for a player that leaves their team, waits for the event to be handled
+    #- returns the number of players left in the team(None if the player was not in the lobby)
+    #- the lobby is removed when the team is empty
+    async def player_left(self, lobby_code: str, player_id: int) -> int | None:
+        return await self._actor(lobby_code).call(self._on_player_left, lobby_code, player_id)
+
+    async def _on_player_joined(self, lobby_code: str, team_id: str, player: PlayerState):
+        team = self.get_team_from_lobby(lobby_code, team_id)
+        if not team:
+            return
+        #Broadcast successful joined message to lobby
+        joined_payload = JoinedTeamPayload(user_name=player.name, team_name=team_id,
+                                           members_remaining=team.max_players - len(team.players), max_members=team.max_players)
+        await self.c_manager.send_message_to_Lobby(lobby_code, Message(type='join', payload=joined_payload))
+        await self._send_details_to_spectators(lobby_code)
+
+        #a player that connected again to a running game(after a restart) gets the game time
+        lobby = self.state.get_lobby(lobby_code)
+        if lobby and lobby.game_status == 'running':
+            await self._send_game_time(lobby_code, player.id, lobby)
+            return
+
+        #Check if the lobby is full yet
+        if self.are_teams_full(lobby_code):
+            await self.start_lobby_game(lobby_code)
+
+    async def _on_player_resumed(self, lobby_code: str, team_id: str, player: PlayerState):
+        lobby = self.state.get_lobby(lobby_code)
+        if not lobby or team_id not in lobby.teams:
+            return
+        if lobby.game_status == 'running':
+            await self._send_game_time(lobby_code, player.id, lobby)
+        team = lobby.teams[team_id]
+        enemy = next(other for other in lobby.teams.values() if other.id != team_id)
+        payload = SyncPayload(team_name=team.id, team_score=team.score, enemy_team_name=enemy.id, enemy_team_score=enemy.score)
+        await self.c_manager.send_message_to_player(player.id, Message(type="sync", payload=payload))
+
+    #Method for sending the time of a running game to a player that connected again
+    async def _send_game_time(self, lobby_code: str, player_id: int, lobby: LobbyState):
+        payload = StartGamePayload(start_time=lobby.start_time, duration=lobby.duration, server_time=time.time(),
+                                   time_remaining=self.get_time_remaining(lobby_code, lobby), timer_mode=self.timer_mode)
+        await self.c_manager.send_message_to_player(player_id, Message(type="start_game", payload=payload))
+
+    async def _on_player_hit(self, lobby_code: str, team_shooter_id: str, team_shot_id: str, player_id: int, seq: int | None):
+        #Record a hit(and the shot on the opposing team), a hit only counts while the game is running
+        scores = self.record_hit(lobby_code, team_shooter_id, team_shot_id, player_id)
+        if scores is None:
+            message = Message(type="missed_shot", payload=MissedShotPayload(shooter_id=player_id, seq=seq))
+            await self.c_manager.send_message_to_player(player_id, message)
+            return
+        shooter_score, shot_score, shooter_hits, player_hits, shots = scores
+
+        #braodcast a hit message to all players in the shooter team
+        hit_payload = ShotHitPayload(team_score=shooter_score, team_name=team_shooter_id, player_id=player_id, seq=seq)
+        await self.c_manager.send_message_to_team(lobby_code, team_shooter_id, Message(type="hit", payload=hit_payload))
+
+        #broadcast a shot message to all players in the opposing team
+        shot_payload = ShotHitPayload(team_score=shot_score, team_name=team_shot_id, player_id=player_id, seq=seq)
+        await self.c_manager.send_message_to_team(lobby_code, team_shot_id, Message(type="shot", payload=shot_payload))
+
+        #send the new totals to the spectators
+        if self.c_manager.has_spectators(lobby_code):
+            score_payload = SpectatorScorePayload(team_id=team_shooter_id, score=shooter_score, hits=shooter_hits,
+                                                  player_id=player_id, player_hits=player_hits,
+                                                  target_team_id=team_shot_id, target_shots=shots)
+            await self.c_manager.send_message_to_spectators(lobby_code, Message(type="score", payload=score_payload))
+
+    async def _on_player_left(self, lobby_code: str, player_id: int) -> int | None:
+        players_left = self.remove_player(player_id)
+        #if there are no players on the team, delete the lobby session
+        if players_left == 0:
+            self.remove_lobby(lobby_code)
+        await self._send_details_to_spectators(lobby_code)
+        if players_left == 0:
+            await self.c_manager.close_spectators(lobby_code)
+        return players_left
+
+    #Method for sending the lobby details to the spectators of a lobby(after the lobby changed)
+    async def _send_details_to_spectators(self, lobby_code: str):
+        if not self.c_manager.has_spectators(lobby_code):
+            return
+        details = self.get_lobby_details(lobby_code)
+        if details:
+            await self.c_manager.send_snapshot_to_spectators(lobby_code, details[1])
     
     #Method creates a new lobby with teams, and returns the teams and lobby code
     # It takes in the max number of people that can be in the lobby
-    def create_lobby(self, max_players) -> tuple[str, Team, Team]:
-        #create a new lobby code
-        lobby_code = sv.generate_lobby_code(list(self.lobbies.keys()))
-
+    def create_lobby(self, max_players) -> tuple[str, TeamState, TeamState]:
         #create two teams with random color/shape combinations
         #TODO: Make sure teams get unique shape and colours, so that they don't overlap
         teamA, teamB = sv.create_teams()
         teamA.max_players = max_players // 2
         teamB.max_players = max_players // 2
 
-        self.lobbies[lobby_code] = Lobby(teams = {teamA.id : teamA, teamB.id : teamB})
+        #add the lobby(the state backend creates a new lobby code)
+        lobby = LobbyState(teams = {teamA.id : teamA, teamB.id : teamB})
+        lobby_code = self.state.create_lobby(lobby)
+        #the lobby will be disposed if the game is not started in time
+        self.scheduler.schedule(INACTIVE, lobby_code, lobby.allowed_inactive_time)
 
         return lobby_code, teamA, teamB
     
     #Method which will start a certain lobby given the lobby code
-    #- This will add the lobby in the list of active lobbies
+    #- This will add the lobby in the list of active lobbies and send the start game signal
     async def start_lobby_game(self,lobby_code:str):
-        if not self.lobbies.get(lobby_code):
-            return #lobby was not found
-        if lobby_code in self.active_lobbies:
-            return
-        #start the game
-        self.active_lobbies[lobby_code] = {"start_time": time.time() , "duration":60, "time_remaining" : 60}
-        self.lobbies[lobby_code].game_status = 'running'
+        #start the game(only once, the game could have been started by another worker)
+        #- "start_time" is the wall clock time(for the clients) and "started_at" is the monotonic time used for the deadlines
+        duration = 60
+        start_time = time.time()
+        if not self.state.start_game(lobby_code, start_time, duration):
+            return #lobby was not found or the game was already started
+        started_at = time.monotonic()
+        self.active_lobbies[lobby_code] = {"start_time": start_time, "started_at": started_at, "duration": duration}
+
+        #send a start game signal with the server time, so that the clients can count down
+        payload = StartGamePayload(start_time=start_time, duration=duration, server_time=time.time(),
+                                   time_remaining=duration, timer_mode=self.timer_mode)
+        await self.c_manager.send_message_to_Lobby(lobby_code=lobby_code, message=Message(type="start_game", payload=payload))
+        await self._send_details_to_spectators(lobby_code)
+
+        self.scheduler.cancel(INACTIVE, lobby_code)
+        self.scheduler.schedule(GAME_END, lobby_code, at=started_at + duration)
+        if self.timer_mode == "broadcast":
+            self.scheduler.schedule(TIMER_REPORT, lobby_code, at=started_at)
+        else:
+            self.scheduler.schedule(TIMER_REPORT, lobby_code, at=started_at + cfg.CLOCK_SYNC_INTERVAL)
     
     #Game timer loop which manages the game_status state and lobby sessions
     #- Each lobby match will play for 1min
-    #- If game isn't started with 3min, the lobby will be disposed
-    #- After the game has completed, spectators will have another 1min to pull lobby details
+    #- If game isn't started within the allowed inactive time, the lobby will be disposed
+    #- After the game has completed, spectators will have some time to pull lobby details
+    #- The loop sleeps until the next deadline and only handles the lobbies that are due
     async def game_timer_loop(self):
         while True:
-            now = time.time()
-            for lobby_code, lobby_det in list(self.active_lobbies.items()):
-                #Calculate the time elapsed
-                elapsed = now - lobby_det["start_time"]
-                self.active_lobbies[lobby_code]["time_remaining"] = lobby_det["duration"] - elapsed
-                remaining = self.active_lobbies[lobby_code]["time_remaining"]
-
-                if remaining <= 0:
-                    await self._handle_game_over(lobby_code)
-                else:
-                    #broadcast timer results
+            await self.scheduler.wait()
+            start = time.monotonic()
+            for kind, lobby_code, deadline in self.scheduler.pop_due(start):
+                if metrics.enabled:
+                    metrics.timer_lateness_seconds.observe(max(0.0, start - deadline), kind)
+                #the deadline is handled by the lobby's actor(in order with the other events of the lobby)
+                self._actor(lobby_code).post(self._handle_deadline, kind, lobby_code, deadline)
+            if metrics.enabled:
+                metrics.timer_loop_seconds.observe(time.monotonic() - start)
+
+    #Method that handles a deadline that is due
+    async def _handle_deadline(self, kind: str, lobby_code: str, deadline: float):
+        lobby = self.state.get_lobby(lobby_code)
+        if not lobby:
+            self.scheduler.cancel_all(lobby_code)
+            self.active_lobbies.pop(lobby_code, None)
+            self._stop_actor(lobby_code)
+            return
+
+        #The game time is over
+        if kind == GAME_END:
+            if lobby_code in self.active_lobbies:
+                await self._handle_game_over(lobby_code)
+
+        #broadcast timer results(the next report is based on this deadline so it does not drift)
+        #- every second in the "broadcast" mode, or a clock sync every few seconds in the "client" mode
+        elif kind == TIMER_REPORT:
+            remaining = self.get_time_remaining(lobby_code)
+            if lobby_code in self.active_lobbies and lobby.game_status == 'running' and remaining > 0:
+                if self.timer_mode == "broadcast":
                     message = Message(type="timer_report",payload= TimerReportPayload(time_remaining=remaining))
-                    await self.c_manager.send_message_to_Lobby(lobby_code=lobby_code, message=message)
-            
-            #check for stale lobbyies
-            # All lobies that are in-ective for more than 3minutes will be remove(and disconnected)
-            for lobby_code, _ in list(self.lobbies.items()):
-                #if lobby is active, we ignore it
-                if lobby_code in self.active_lobbies:
-                    continue
-                
-                #if lobby has exceeded it's inactive time, we mark it as game over to be disposed of
-                #- This will send a message to the connected devices
-                if self.lobbies[lobby_code].allowed_inactive_time <= 0:
-                    await self._handle_game_over(lobby_code)
+                    interval = 1
                 else:
-                    self.lobbies[lobby_code].allowed_inactive_time -= 1;
-                
-                #If game over, do a count down before deleting the lobby
-                if self.lobbies[lobby_code].game_status == 'game_over':
-                    self.lobbies[lobby_code].allowed_active_time_for_detail-=1
-                
-                #Lobby cleanup
-                if self.lobbies[lobby_code].allowed_active_time_for_detail <= 0:
-                    # delete the lobby
-                    del self.lobbies[lobby_code]
-
-            #sleep for 1 second
-            await asyncio.sleep(1)
+                    message = Message(type="clock_sync", payload=ClockSyncPayload(server_time=time.time(), time_remaining=remaining))
+                    interval = cfg.CLOCK_SYNC_INTERVAL
+                await self.c_manager.send_message_to_Lobby(lobby_code=lobby_code, message=message)
+                if self.c_manager.has_spectators(lobby_code):
+                    report = Message(type="timer_report", payload=TimerReportPayload(time_remaining=remaining))
+                    await self.c_manager.send_message_to_spectators(lobby_code, report)
+                self.scheduler.schedule(TIMER_REPORT, lobby_code, at=deadline + interval)
+
+        #if lobby has exceeded it's inactive time, we mark it as game over to be disposed of
+        #- This will send a message to the connected devices
+        #- The game could have been started by another worker
+        elif kind == INACTIVE:
+            if lobby.game_status == 'not_started':
+                await self._handle_game_over(lobby_code)
+
+        #Lobby cleanup
+        elif kind == EVICT:
+            self._evict(lobby_code)
 
     #This method haldes the game_over broadcast message to lobby and disconnect lobbies
     async def _handle_game_over(self, lobby_code):
+        #Remove the lobby from active lobbies
+        self.active_lobbies.pop(lobby_code, None)
+
+        #update lobby game status(the game could have already been ended by another worker)
+        lobby = self.state.end_game(lobby_code)
+        if not lobby:
+            self.scheduler.cancel_all(lobby_code)
+            return
+
         #game over broadcast
-        winner,looser = self.get_team_ranking(lobby_code)
+        winner,looser = self.get_team_ranking(lobby_code, lobby)
         game_over = GameOverPayload(winning_team_name=winner.id, winning_team_score=looser.score, 
                                     losing_team_name=looser.id, losing_team_score=looser.score)
         message = Message(type="game_over",payload=game_over)
-        
-        #update lobby game status
-        self.lobbies[lobby_code].game_status = 'game_over'
 
         #broad-cast results
         await self.c_manager.send_message_to_Lobby(lobby_code=lobby_code, message=message)
         await self.c_manager.disconnect_lobby(lobby_code=lobby_code)
 
-        #Remove the lobby from active lobbies
-        if lobby_code in self.active_lobbies:
-            del self.active_lobbies[lobby_code]
+        #the spectators get the final details and the results, then their streams are ended
+        if self.c_manager.has_spectators(lobby_code):
+            await self._send_details_to_spectators(lobby_code)
+            await self.c_manager.send_message_to_spectators(lobby_code, message)
+            await self.c_manager.close_spectators(lobby_code)
+
+        #The lobby is deleted once its result is written to the results store
+        self._store_result(lobby_code, lobby)
+
+    #Method for adding the final details of a lobby that is over to the results store
+    #- the lobby is removed when the result is written(see _on_results_written)
+    def _store_result(self, lobby_code: str, lobby: LobbyState):
+        self.scheduler.cancel_all(lobby_code)
+        snapshot = self.snapshots.get(lobby_code, lobby.version) or self.snapshots.build(lobby_code, lobby)
+        self.results.add(lobby_code, snapshot.version, snapshot.render(0)[1])
+
+    #Method for removing the lobbies whose results were written
+    def _on_results_written(self, lobby_codes: list[str]):
+        for lobby_code in lobby_codes:
+            self._evict(lobby_code)
+
+    #Method for the lobbies whose results could not be written, they are removed after the spectators had time
+    #    to pull the details(like before there was a results store)
+    def _on_results_failed(self, lobby_codes: list[str]):
+        for lobby_code in lobby_codes:
+            lobby = self.state.get_lobby(lobby_code)
+            if lobby:
+                self._schedule_eviction(lobby_code, lobby)
+
+    #Method for scheduling the removal of a lobby that is over
+    def _schedule_eviction(self, lobby_code: str, lobby: LobbyState):
+        self.scheduler.cancel_all(lobby_code)
+        self.scheduler.schedule(EVICT, lobby_code, lobby.allowed_active_time_for_detail)
+
+    #Method for removing a lobby that is over
+    def _evict(self, lobby_code: str):
+        self.scheduler.cancel_all(lobby_code)
+        self.state.delete_lobby(lobby_code)
+        self.snapshots.discard(lobby_code)
+        self._stop_actor(lobby_code)
+
+    #Task that writes the results of the finished games(see ResultsStore)
+    async def results_loop(self):
+        await self.results.run(self._on_results_written, self._on_results_failed)
+
+    #Method for writing the last results(called when the server shuts down)
+    async def close_results(self):
+        await self.results.close(self._on_results_written, self._on_results_failed)
+
+    #Method that captures the state for a snapshot: the lobbies(see MemoryStateBackend.dump_state), the running games
+    #    as (lobby code, duration, seconds elapsed), the deadlines as (kind, lobby code, seconds left) and the key of
+    #    the resume tokens(so the players can connect again to the restarted server)
+    #- returns None if nothing changed since the last capture(and no game is running), unless `force` is set
+    def capture_state(self, force: bool = False) -> tuple | None:
+        lobbies = self.state.dump_state()
+        if not force and lobbies[1] == self._snapshot_version and not self.active_lobbies:
+            return None
+        self._snapshot_version = lobbies[1]
+        now = time.monotonic()
+        games = [(lobby_code, game["duration"], now - game["started_at"]) for lobby_code, game in self.active_lobbies.items()]
+        deadlines = [(kind, lobby_code, deadline - now) for kind, lobby_code, deadline in self.scheduler.scheduled()]
+        return lobbies, games, deadlines, cfg.WS_RESUME_SECRET
+
+    #Method for restoring the state from the snapshot(at startup, before the game timer loop is started)
+    #- returns the number of lobbies that were restored
+    def restore_state(self) -> int:
+        snapshot = self.snapshot.read()
+        if snapshot is None:
+            return 0
+        _, (lobbies, games, deadlines, resume_secret) = snapshot
+        self.state.load_state(lobbies)
+        #the resume tokens of the last process stay valid, unless WS_RESUME_SECRET was set(it may have been changed)
+        if not cfg.WS_RESUME_SECRET_SET:
+            cfg.WS_RESUME_SECRET = resume_secret
+        self._snapshot_version = lobbies[1]
+
+        #the games continue with the time they had left
+        now, wall_time = time.monotonic(), time.time()
+        for lobby_code, duration, elapsed in games:
+            if self.state.rebase_game(lobby_code, wall_time - elapsed):
+                self.active_lobbies[lobby_code] = {"start_time": wall_time - elapsed, "started_at": now - elapsed,
+                                                   "duration": duration}
+        for kind, lobby_code, remaining in deadlines:
+            self.scheduler.schedule(kind, lobby_code, at=now + max(0.0, remaining))
+
+        #the results of the games that were over are written(again, if the last process did not write them)
+        for lobby in lobbies[2]:
+            lobby_code, game_status, version = lobby[0], lobby[1], lobby[7]
+            if game_status == 'game_over' and self.scheduler.deadline(EVICT, lobby_code) is None:
+                result = self.results.get(lobby_code)
+                if result is not None and result[0] == version:
+                    self._evict(lobby_code)
+                else:
+                    self._store_result(lobby_code, self.state.get_lobby(lobby_code))
+        return len(lobbies[2])
+
+    #Task that writes a snapshot of the state every few seconds(see StateSnapshot)
+    async def snapshot_loop(self):
+        await self.snapshot.run(self.capture_state)
+
+    #Method for writing the last snapshot(called when the server shuts down, after the last results were written)
+    def save_state(self):
+        if not self.snapshot.enabled:
+            return
+        try:
+            self.snapshot.write(self.capture_state(force=True))
+        except Exception as e:
+            print(f"Error writing the state snapshot: {e!r}")
 
     #This method gets the team rankings according to the scores
     # First team is the winning team, and the second one is the lossig team
-    def get_team_ranking(self, lobby_code:str) -> tuple[Team , Team]:
+    def get_team_ranking(self, lobby_code:str, lobby: LobbyState | None = None) -> tuple[TeamState , TeamState]:
         #determine winning and lossing teams
-        teamA,teamB = self.get_teams_in_lobby(lobby_code=lobby_code)
+        teamA,teamB = self.get_teams_in_lobby(lobby_code=lobby_code, lobby=lobby)
         if teamA.score > teamB.score:
             return teamA,teamB #(winning, lossing)
         return teamB, teamA #(winning, lossing)
@@ -127,24 +444,97 @@ class LobbyManager:
 
     #Method to determine if the lobby exists given a lobby code
     def lobby_code_exists(self,lobby_code)->bool:
-        return not not self.lobbies.get(lobby_code) #FIXME: Make this code more readable
+        return self.state.lobby_exists(lobby_code)
     
     #Method to get a certain team from a certain lobby
-    def get_team_from_lobby(self, lobby_code:str, team_name:str) -> Team | None:
-        if self.lobby_code_exists(lobby_code):
-            return self.lobbies[lobby_code].teams[team_name]
+    def get_team_from_lobby(self, lobby_code:str, team_name:str) -> TeamState | None:
+        lobby = self.state.get_lobby(lobby_code)
+        if lobby:
+            return lobby.teams.get(team_name)
         return None
     
     #Method to get a lobby from lobby code
-    def get_lobby(self, lobby_code: str) -> Lobby | None:
-        lobby = self.lobbies.get(lobby_code)
-        if lobby_code in self.active_lobbies and lobby:
-            lobby.time_remaining = self.active_lobbies[lobby_code]["time_remaining"]
+    def get_lobby(self, lobby_code: str) -> LobbyState | None:
+        lobby = self.state.get_lobby(lobby_code)
+        if lobby and lobby.game_status == 'running':
+            lobby.time_remaining = self.get_time_remaining(lobby_code, lobby)
         return lobby
+
+    #Method to get the details of a lobby for the API, returns the ETag and the JSON body(None if the lobby does not exist)
+    #- the details are only serialised again when the lobby version changed(see LobbySnapshots)
+    #- the details of a finished game that was removed are read from the results store
+    def get_lobby_details(self, lobby_code: str) -> tuple[str, bytes] | None:
+        snapshot = self._get_snapshot(lobby_code)
+        if snapshot is None:
+            result = self.results.get(lobby_code)
+            if result is None:
+                return None
+            version, details = result
+            return f'"{version}"', details
+        return snapshot.render(self.get_time_remaining(lobby_code, snapshot))
+
+    #Method to determine if the game of a lobby is over(or the lobby was removed)
+    def is_game_over(self, lobby_code: str) -> bool:
+        snapshot = self._get_snapshot(lobby_code)
+        return snapshot is None or snapshot.game_status == 'game_over'
+
+    #Method to get the snapshot of the current version of a lobby, None if the lobby does not exist
+    def _get_snapshot(self, lobby_code: str) -> LobbySnapshot | None:
+        version = self.state.get_lobby_version(lobby_code)
+        if version is None:
+            self.snapshots.discard(lobby_code)
+            return None
+        snapshot = self.snapshots.get(lobby_code, version)
+        if snapshot is None:
+            lobby = self.state.get_lobby(lobby_code)
+            if not lobby:
+                return None
+            snapshot = self.snapshots.build(lobby_code, lobby)
+        return snapshot
+
+    #Method to get the time remaining(in seconds) of a running game
+    #- games started by another worker use the start time in the lobby state
+    #- `lobby` can also be a lobby snapshot(it has the same game status and times)
+    def get_time_remaining(self, lobby_code: str, lobby: LobbyState | None = None) -> float:
+        lobby_det = self.active_lobbies.get(lobby_code)
+        if lobby_det:
+            elapsed = time.monotonic() - lobby_det["started_at"]
+            return max(0, lobby_det["duration"] - elapsed)
+        if lobby and lobby.game_status == 'running' and lobby.start_time is not None:
+            return max(0, lobby.duration - (time.time() - lobby.start_time))
+        return 0
+
+    #Method that returns a new(unique) player id
+    def next_player_id(self) -> int:
+        return self.state.next_player_id()
     
+    #Method for adding a player to the team with the least players
+    #- returns the player(with the team id) or None if both teams are full
+    def add_player(self, lobby_code: str, player: PlayerState) -> PlayerState | None:
+        return self.state.add_player(lobby_code, player)
+
+    #Method to find a player in the lobbies, None if the player is not in any lobby
+    def find_player(self, player_id: int) -> PlayerEntry | None:
+        found = self.state.find_player(player_id)
+        if not found:
+            return None
+        return PlayerEntry(*found)
+
+    #Method for removing a player from their team
+    #- returns the number of players left in the team(None if the player was not in any lobby)
+    def remove_player(self, player_id: int) -> int | None:
+        return self.state.remove_player(player_id)
+
+    #Method for recording a valid hit, returns the score of the shooter team, the score of the team that was shot,
+    #    the hits of the shooter team, the hits of the player and the shots of the team that was shot
+    #- returns None if the lobby was not found or the game is not running
+    def record_hit(self, lobby_code: str, team_shooter_id: str, team_shot_id: str,
+                   player_id: int) -> tuple[int, int, int, int, int] | None:
+        return self.state.record_hit(lobby_code, team_shooter_id, team_shot_id, player_id)
+
     #Method to get the two teams from a lobby
-    def get_teams_in_lobby(self,lobby_code:str) -> tuple[Team,Team]:
-        lobby = self.lobbies.get(lobby_code)
+    def get_teams_in_lobby(self,lobby_code:str, lobby: LobbyState | None = None) -> tuple[TeamState,TeamState]:
+        lobby = lobby or self.state.get_lobby(lobby_code)
         if not lobby:
             raise HTTPException(status_code=500, detail="Lobby was not found.")
         #get teams
@@ -154,11 +544,18 @@ class LobbyManager:
     
     #A method that checks if a lobby is active or not
     def is_lobby_active(self, lobby_code: str)-> bool:
-        return lobby_code in self.active_lobbies
+        if lobby_code in self.active_lobbies:
+            return True
+        lobby = self.state.get_lobby(lobby_code)
+        return lobby is not None and lobby.game_status == 'running'
     
     #Method the removes a lobby, by settting the game_status to "game_over"
+    #- The lobby will be deleted once its result is written to the results store
     def remove_lobby(self, lobby_code: str):
         # if lobby_code in self.lobbies:
         #     del self.lobbies[lobby_code]
-        self.lobbies[lobby_code].game_status = 'game_over'
+        self.active_lobbies.pop(lobby_code, None)
+        lobby = self.state.end_game(lobby_code)
+        if lobby:
+            self._store_result(lobby_code, lobby)
 
@@ -0,0 +1,76 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import json
+from GameState import LobbyState
+import services.service as sv
+
+# Cached lobby details for the "GetLobbyDetails" endpoint(polled by the spectators)
+#  - The details of a lobby are serialised once per lobby version(see StateBackend) instead of for every poll,
+#    a poll only asks the state backend for the version of the lobby
+#  - "time_remaining" is the last key of the details, so the serialised details are kept without it and the time
+#    is added to the cached bytes. While the game is running the time is given in whole seconds(the clients show
+#    whole seconds), so the details only change once a second
+#  - The ETag of the details is the lobby version(and the second for a running game), a client that sends the
+#    ETag back in "If-None-Match" gets a 304 reply without a body
+#  - Every server worker has its own cache, the versions come from the state backend so they are the same on
+#    every worker
+
+_encode_json = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+#Serialised details of one version of a lobby
+#- game_status, start_time and duration are kept to work out the time remaining without getting the lobby
+class LobbySnapshot:
+    __slots__ = ("version", "game_status", "start_time", "duration", "time_remaining", "prefix")
+
+    def __init__(self, lobby_code: str, lobby: LobbyState):
+        self.version = lobby.version
+        self.game_status = lobby.game_status
+        self.start_time = lobby.start_time
+        self.duration = lobby.duration
+        self.time_remaining = lobby.time_remaining
+        details = sv.to_lobby_details_json(lobby_code, lobby)
+        del details["time_remaining"]
+        details["teams"] = [team.model_dump(mode="json") for team in details["teams"]]
+        #the details without the closing brace, followed by the "time_remaining" key
+        self.prefix = _encode_json(details)[:-1].encode() + b',"time_remaining":'
+
+    #Method that returns the ETag and the body of the details with the given time remaining
+    def render(self, time_remaining: float) -> tuple[str, bytes]:
+        if self.game_status == 'running':
+            seconds = int(time_remaining)
+            return f'"{self.version}-{seconds}"', self.prefix + str(seconds).encode() + b"}"
+        return f'"{self.version}"', self.prefix + _encode_json(self.time_remaining).encode() + b"}"
+
+class LobbySnapshots:
+    def __init__(self):
+        self._snapshots: dict[str, LobbySnapshot] = {}
+
+    #Method to get the snapshot of a lobby version, None if it was not built yet
+    def get(self, lobby_code: str, version: int) -> LobbySnapshot | None:
+        snapshot = self._snapshots.get(lobby_code)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        return None
+
+    #Method that builds(and keeps) the snapshot of the lobby's current version
+    def build(self, lobby_code: str, lobby: LobbyState) -> LobbySnapshot:
+        snapshot = self._snapshots[lobby_code] = LobbySnapshot(lobby_code, lobby)
+        return snapshot
+
+    #Method for removing the snapshot of a lobby that was deleted
+    def discard(self, lobby_code: str):
+        self._snapshots.pop(lobby_code, None)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+#Method that checks if an "If-None-Match" header matches the ETag
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,121 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import struct
+from typing import Callable
+import services.config as cfg
+
+# Publish/subscribe used by the connection manager to reach the websockets that are connected to other server workers
+#  - The publishing worker delivers a message to its own websockets, the pub/sub only forwards it to the other workers
+#  - "memory": there are no other workers, nothing is forwarded(the original behaviour)
+#  - "socket": every worker is connected to a hub(started by "cluster.py") over a local socket and the hub
+#    forwards every message to all the other workers
+#  - A message is a topic(which websockets it is for) and the already encoded message
+
+#Frame used on the hub socket: topic length(2 bytes) and message length(4 bytes) followed by the topic and message
+_FRAME = struct.Struct("!HI")
+
+#Handler called for every message that was published by another worker
+Handler = Callable[[str, str], None]
+
+class MemoryPubSub:
+    async def start(self, handler: Handler):
+        pass
+
+    def publish(self, topic: str, message: str):
+        pass
+
+    async def close(self):
+        pass
+
+class SocketPubSub:
+    def __init__(self, address: str = cfg.PUBSUB_ADDRESS):
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+
+    #Method for connecting to the hub, the handler is called for the messages of the other workers
+    async def start(self, handler: Handler):
+        self._handler = handler
+        await self._connect()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    #Method for forwarding a message to the other workers
+    #- messages published while the hub is not connected are dropped(the hub only forwards live messages)
+    def publish(self, topic: str, message: str):
+        if self._writer is None or self._writer.is_closing():
+            return
+        topic_bytes, message_bytes = topic.encode(), message.encode()
+        self._writer.write(_FRAME.pack(len(topic_bytes), len(message_bytes)) + topic_bytes + message_bytes)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    async def _connect(self):
+        reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._reader = reader
+
+    #Reads the messages from the hub(and reconnects if the hub connection is lost)
+    async def _read_loop(self):
+        while True:
+            try:
+                topic, message = await _read_frame(self._reader)
+                self._handler(topic, message)
+            except asyncio.CancelledError:
+                return
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                self._writer = None
+                await asyncio.sleep(1)
+                try:
+                    await self._connect()
+                except OSError:
+                    pass
+            except Exception as e:
+                print(f"Error handling a published message: {e}")
+
+#Hub that forwards the messages of every worker to all the other workers
+class PubSubHub:
+    def __init__(self, address: str = cfg.PUBSUB_ADDRESS):
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self._workers: set[asyncio.StreamWriter] = set()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle_worker, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._workers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(_FRAME.size)
+                topic_length, message_length = _FRAME.unpack(header)
+                frame = header + await reader.readexactly(topic_length + message_length)
+                for worker in self._workers:
+                    if worker is not writer:
+                        worker.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._workers.discard(writer)
+            writer.close()
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[str, str]:
+    topic_length, message_length = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    data = await reader.readexactly(topic_length + message_length)
+    return data[:topic_length].decode(), data[topic_length:].decode()
+
+#Method for creating the pub/sub that is configured with PUBSUB_BACKEND
+def create_pubsub(kind: str = cfg.PUBSUB_BACKEND, address: str = cfg.PUBSUB_ADDRESS):
+    if kind == "socket":
+        return SocketPubSub(address)
+    return MemoryPubSub()
@@ -0,0 +1,132 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Callable
+import services.config as cfg
+
+# Results of the finished games(an append-only SQLite file)
+#  - At the game over the final lobby details(the same JSON as "GetLobbyDetails") are added to the store and the
+#    lobby is removed from the lobby state as soon as they are written, the spectators then read the results
+#    from the store(indexed by the lobby code)
+#  - The results are written in batches by a background task every RESULTS_FLUSH_INTERVAL seconds(on a thread,
+#    the event loop never waits for the disk), the results that are not written yet are read from memory
+#  - A lobby code can be used again after its lobby was removed, the latest result of a code is returned
+#  - With more than one server worker every worker opens the same file(in WAL mode, so the workers can read
+#    while another worker writes)
+#  - Results older than RESULTS_MAX_AGE seconds are deleted when the store is opened and every hour
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    lobby_code TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    ended_at REAL NOT NULL,
+    details BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lobby_code ON results (lobby_code, id);
+"""
+
+#Result of a game: lobby code, lobby version, end time(seconds since the epoch) and the encoded lobby details
+Result = tuple[str, int, float, bytes]
+
+class ResultsStore:
+    def __init__(self, path: str = cfg.RESULTS_DB, flush_interval: float = cfg.RESULTS_FLUSH_INTERVAL,
+                 max_age: float = cfg.RESULTS_MAX_AGE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        #results that are not written yet(indexed by the lobby code)
+        self.pending: dict[str, Result] = {}
+        self.written = 0
+        self._last_prune = 0.0
+        #the writer connection is used on the flush threads, the reader connection on the event loop
+        self._lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript(_SCHEMA)
+        self._reader = self._connect()
+        self._prune()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    #Method for adding the result of a game, it is written by the next flush
+    def add(self, lobby_code: str, version: int, details: bytes):
+        self.pending[lobby_code] = (lobby_code, version, time.time(), details)
+
+    #Method to get the latest result of a lobby code, returns the lobby version and the encoded details
+    #- None if there is no result for the lobby code
+    def get(self, lobby_code: str) -> tuple[int, bytes] | None:
+        result = self.pending.get(lobby_code)
+        if result:
+            return result[1], result[3]
+        row = self._reader.execute("SELECT version, details FROM results WHERE lobby_code = ? ORDER BY id DESC LIMIT 1",
+                                   (lobby_code,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    #Method for writing the pending results, returns the lobby codes that were written
+    #- the results stay pending if they could not be written
+    async def flush(self) -> list[str]:
+        if not self.pending:
+            return []
+        results = list(self.pending.values())
+        await asyncio.to_thread(self._write, results)
+        for result in results:
+            #the lobby code could have a newer result that was added while writing
+            if self.pending.get(result[0]) is result:
+                del self.pending[result[0]]
+        self.written += len(results)
+        return [result[0] for result in results]
+
+    def _write(self, results: list[Result]):
+        with self._lock:
+            self._writer.execute("BEGIN")
+            try:
+                self._writer.executemany("INSERT INTO results (lobby_code, version, ended_at, details) VALUES (?, ?, ?, ?)",
+                                         results)
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+            if time.monotonic() - self._last_prune > 3600:
+                self._prune()
+
+    #Method for deleting the results older than max_age
+    def _prune(self):
+        self._last_prune = time.monotonic()
+        if self.max_age > 0:
+            self._writer.execute("DELETE FROM results WHERE ended_at < ?", (time.time() - self.max_age,))
+
+    #Task that writes the pending results every `flush_interval` seconds
+    #- on_written is called with the lobby codes that were written, on_failed with the codes that could not be
+    #    written(they are not retried)
+    async def run(self, on_written: Callable[[list[str]], None], on_failed: Callable[[list[str]], None]):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_and_report(on_written, on_failed)
+
+    async def _flush_and_report(self, on_written: Callable[[list[str]], None], on_failed: Callable[[list[str]], None]):
+        try:
+            written = await self.flush()
+        except Exception as e:
+            print(f"Error writing the game results: {e!r}")
+            failed = list(self.pending)
+            self.pending.clear()
+            on_failed(failed)
+            return
+        if written:
+            on_written(written)
+
+    #Method for writing the last results and closing the store
+    async def close(self, on_written: Callable[[list[str]], None], on_failed: Callable[[list[str]], None]):
+        await self._flush_and_report(on_written, on_failed)
+        with self._lock:
+            self._writer.close()
+        self._reader.close()
@@ -0,0 +1,252 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator
+import services.config as cfg
+import services.service as sv
+
+# Capture of the shots recieved on the websockets(opt-in, see SHOT_CAPTURE), replayed by "tools/shot_replay.py"
+#  - Every shot is appended to the capture file as one record: the time it was recieved, the lobby, team, player,
+#    sequence number, colour and region of interest, the frame exactly as it was sent(JPEG bytes or base64 text),
+#    the result(hit, miss, no_color or the reason it was rejected), the detected shapes and the time spent in
+#    every stage of the detection
+#  - The records are encoded when the shot is answered and written in batches by a background task every
+#    `flush_interval` seconds(on a thread, the event loop never waits for the disk)
+#  - If the writes can not keep up(more than `max_pending` bytes waiting) or the file reached `max_bytes`, the
+#    shots are not captured(counted in `dropped`)
+#  - The file is a header(magic and format version) followed by the records, every record starts with its size,
+#    so the file can be mapped in memory and read without copying the frames(see read_capture). A record that was
+#    cut off(the server stopped while writing) ends the capture, it is removed when the file is opened again
+#  - "{pid}" in the path is replaced by the process id, so every server worker can write its own file
+
+_MAGIC = b"LSCAPT"
+_FORMAT = 1
+_FILE_HEADER = _MAGIC + bytes((_FORMAT,))
+
+#Header of a record(little endian): record size, time recieved(seconds since the epoch), player id, sequence
+#    number(-1 if none), colour id(255 if none), result id, flags, lengths of the lobby code, team name and
+#    detected shapes, number of stage timings, region of interest(x, y, width, height), time waiting before the
+#    detection, time spent in the detection and the frame size
+#- followed by the lobby code, team name, detected shapes(comma separated), the stage timings and the frame
+RECORD_HEADER = struct.Struct("<Idii7Bx4fffI")
+#Stage timing: stage id and seconds
+STAGE_TIMING = struct.Struct("<Bf")
+
+#Results of a shot: answered after the detection, or rejected before it(see ShotIntake)
+RESULTS = ("hit", "miss", "no_color", "cooldown", "superseded", "overloaded", "error")
+#Stages of the detection(see VisionEngine and ComputerVisionModel)
+STAGES = ("queue", "base64", "imdecode", "hsv", "mask", "contours", "classify")
+FLAG_BASE64 = 0x1
+FLAG_ROI = 0x2
+#the client declared a region of interest that is not 4 numbers(the model then searches the whole frame)
+FLAG_ROI_INVALID = 0x4
+
+_RESULT_IDS = {result: index for index, result in enumerate(RESULTS)}
+_STAGE_IDS = {stage: index for index, stage in enumerate(STAGES)}
+_NO_COLOR = 255
+_INT32 = (-2**31, 2**31)
+
+#A shot read from a capture file
+#- image is a view of the mapped file(the JPEG bytes, or the base64 text if is_base64), it can only be used
+#    while the capture is being read
+#- roi is None if the client did not declare a region of interest, () if it was not valid
+class CapturedShot:
+    __slots__ = ("received_at", "lobby_code", "team_name", "player_id", "seq", "color", "result", "shapes", "roi",
+                 "is_base64", "timings", "wait", "detection", "image")
+
+class ShotCapture:
+    def __init__(self, path: str = cfg.SHOT_CAPTURE, max_bytes: int = cfg.SHOT_CAPTURE_MAX_BYTES,
+                 flush_interval: float = cfg.SHOT_CAPTURE_FLUSH_INTERVAL, max_pending: int = cfg.SHOT_CAPTURE_MAX_PENDING):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.captured = 0
+        self.dropped = 0
+        #size of the file(known once it is opened)
+        self.size = 0
+        #records that are not written yet
+        self.pending: list[bytes] = []
+        self.pending_bytes = 0
+        self._file = None
+        #the final flush at shutdown waits for a flush that is being written
+        self._lock = threading.Lock()
+
+    #Method to determine if the capture is switched on
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    #Method for capturing a shot, the record is written by the next flush
+    #- shot: the shot as it was recieved(image, colour, sequence number, region of interest, is_base64, time recieved)
+    #- result: one of RESULTS, shapes: the detected shapes, timings: the stage timings of the detection(see
+    #    ComputerVisionModel), detection: the time(in seconds) from the start of the detection to the answer
+    def record(self, shot, lobby_code: str, team_name: str, player_id: int, result: str, shapes=(),
+               timings: dict | None = None, detection: float = 0.0):
+        if not self.enabled:
+            return
+        data = self.encode(shot, lobby_code, team_name, player_id, result, shapes, timings, detection)
+        if self.pending_bytes + len(data) > self.max_pending or \
+                (self.max_bytes and self.size + self.pending_bytes + len(data) > self.max_bytes):
+            self.dropped += 1
+            return
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+
+    #Method that encodes a shot as a record(see RECORD_HEADER)
+    @staticmethod
+    def encode(shot, lobby_code: str, team_name: str, player_id: int, result: str, shapes=(),
+               timings: dict | None = None, detection: float = 0.0) -> bytes:
+        image, color, seq, roi, is_base64, received_at = shot
+        flags = FLAG_BASE64 if is_base64 else 0
+        if isinstance(image, str):
+            image = image.encode()
+        elif not isinstance(image, (bytes, bytearray, memoryview)):
+            image = b""
+        roi_values = (0.0, 0.0, 0.0, 0.0)
+        if roi is not None:
+            try:
+                x, y, w, h = roi
+                roi_values = (float(x), float(y), float(w), float(h))
+                flags |= FLAG_ROI
+            except (TypeError, ValueError):
+                flags |= FLAG_ROI_INVALID
+        lobby = lobby_code.encode()[:255]
+        team = team_name.encode()[:255]
+        detected = ",".join(shapes).encode()[:255]
+        stages = [STAGE_TIMING.pack(_STAGE_IDS[stage], seconds) for stage, seconds in (timings or {}).items()
+                  if stage in _STAGE_IDS]
+        seq = seq if isinstance(seq, int) and _INT32[0] <= seq < _INT32[1] else -1
+        color_id = sv.color_ids.index(color) if color in sv.color_ids else _NO_COLOR
+        wait = max(0.0, time.time() - received_at - detection)
+        size = RECORD_HEADER.size + len(lobby) + len(team) + len(detected) + STAGE_TIMING.size * len(stages) + len(image)
+        header = RECORD_HEADER.pack(size, received_at, player_id, seq, color_id, _RESULT_IDS[result], flags,
+                                    len(lobby), len(team), len(detected), len(stages), *roi_values, wait, detection,
+                                    len(image))
+        return b"".join((header, lobby, team, detected, *stages, image))
+
+    #Method for writing the pending records
+    async def flush(self):
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        self.pending_bytes = 0
+        await asyncio.to_thread(self._write, records)
+        self.captured += len(records)
+
+    def _write(self, records: list[bytes]):
+        with self._lock:
+            self._file.writelines(records)
+            self._file.flush()
+            self.size = self._file.tell()
+
+    #Method for opening the capture file(a new file gets the header, an existing file must be a capture)
+    #- a record that was cut off at the end of an existing file is removed, so the new records can be read
+    def _open(self):
+        file = open(self.path, "ab")
+        if file.tell() == 0:
+            file.write(_FILE_HEADER)
+        else:
+            with open(self.path, "r+b") as existing:
+                if existing.read(len(_FILE_HEADER)) != _FILE_HEADER:
+                    file.close()
+                    raise ValueError(f"{self.path} is not a shot capture of format {_FORMAT}")
+                end = existing.seek(0, 2)
+                offset = len(_FILE_HEADER)
+                while offset + RECORD_HEADER.size <= end:
+                    existing.seek(offset)
+                    size = struct.unpack("<I", existing.read(4))[0]
+                    if size < RECORD_HEADER.size or offset + size > end:
+                        break
+                    offset += size
+                if offset < end:
+                    existing.truncate(offset)
+            file.seek(0, 2)
+        self._file = file
+        self.size = file.tell()
+
+    #Task that opens the file and writes the pending records every `flush_interval` seconds
+    #- the capture is switched off if the file can not be opened or written
+    async def run(self):
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._open)
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except Exception as e:
+            print(f"Error writing the shot capture, the capture is switched off: {e!r}")
+            self.path = ""
+            self.pending.clear()
+            self.pending_bytes = 0
+
+    #Method for writing the last records and closing the file
+    async def close(self):
+        if self._file is None:
+            return
+        if self.enabled:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error writing the shot capture: {e!r}")
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+#Method that reads the shots of a capture file, in the order they were captured
+#- The file is mapped in memory, the frames are views of the mapped file(see CapturedShot)
+#- Raises ValueError if the file is not a capture
+def read_capture(path: str) -> Iterator[CapturedShot]:
+    with open(path, "rb") as file:
+        if file.read(len(_FILE_HEADER)) != _FILE_HEADER:
+            raise ValueError(f"{path} is not a shot capture of format {_FORMAT}")
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    try:
+        offset = len(_FILE_HEADER)
+        while offset + RECORD_HEADER.size <= len(view):
+            (size, received_at, player_id, seq, color_id, result_id, flags, lobby_length, team_length, shapes_length,
+             stage_count, x, y, w, h, wait, detection, image_length) = RECORD_HEADER.unpack_from(view, offset)
+            if size < RECORD_HEADER.size or offset + size > len(view):
+                break
+            position = offset + RECORD_HEADER.size
+            shot = CapturedShot()
+            shot.received_at = received_at
+            shot.player_id = player_id
+            shot.seq = None if seq < 0 else seq
+            shot.color = sv.color_ids[color_id] if color_id < len(sv.color_ids) else None
+            shot.result = RESULTS[result_id] if result_id < len(RESULTS) else "error"
+            shot.is_base64 = bool(flags & FLAG_BASE64)
+            shot.roi = (x, y, w, h) if flags & FLAG_ROI else (() if flags & FLAG_ROI_INVALID else None)
+            shot.wait = wait
+            shot.detection = detection
+            shot.lobby_code = bytes(view[position:position + lobby_length]).decode()
+            position += lobby_length
+            shot.team_name = bytes(view[position:position + team_length]).decode()
+            position += team_length
+            shapes = bytes(view[position:position + shapes_length]).decode()
+            shot.shapes = shapes.split(",") if shapes else []
+            position += shapes_length
+            shot.timings = {}
+            for _ in range(stage_count):
+                stage_id, seconds = STAGE_TIMING.unpack_from(view, position)
+                if stage_id < len(STAGES):
+                    shot.timings[STAGES[stage_id]] = seconds
+                position += STAGE_TIMING.size
+            shot.image = view[position:position + image_length]
+            yield shot
+            offset += size
+    finally:
+        view.release()
+        try:
+            data.close()
+        except BufferError:
+            #a caller still holds a frame, the mapping is closed when it is released
+            pass
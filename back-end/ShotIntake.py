@@ -0,0 +1,63 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import time
+import services.config as cfg
+
+# Admission control for the shots sent by the players
+#  - Every connection has a ShotIntake that holds the latest shot that is waiting for detection, a newer shot
+#    replaces(supersedes) the waiting one, so a client that sends faster than the server can detect never builds
+#    up a backlog of old frames
+#  - A player can only shoot once every `cooldown` seconds(the shots in between are rejected straight away), the
+#    caller can give the cooldown of each shot(the fire rate of the capture settings, see CaptureController)
+#  - The DetectionLimiter caps the number of shots in detection over all the connections, when it is full the
+#    shot is rejected straight away instead of waiting for the vision engine
+#  - Rejected shots are answered with a "busy" message, so the client knows the shot was not processed
+
+class ShotIntake:
+    def __init__(self, cooldown: float = cfg.SHOT_COOLDOWN):
+        self.cooldown = cooldown
+        self._pending = None
+        self._ready = asyncio.Event()
+        self._last_admitted = float("-inf")
+
+    #Method that checks(and starts) the player's cooldown, returns False if the player must wait
+    #- cooldown: the cooldown to use for this shot(`self.cooldown` if None)
+    def admit(self, now: float | None = None, cooldown: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        cooldown = self.cooldown if cooldown is None else cooldown
+        if now - self._last_admitted < cooldown:
+            return False
+        self._last_admitted = now
+        return True
+
+    #Method for adding a shot, returns the shot that it replaces(None if there was no shot waiting)
+    def offer(self, shot):
+        superseded = self._pending
+        self._pending = shot
+        self._ready.set()
+        return superseded
+
+    #Method that waits for the next shot and removes it from the intake
+    async def next(self):
+        while self._pending is None:
+            self._ready.clear()
+            await self._ready.wait()
+        shot, self._pending = self._pending, None
+        return shot
+
+class DetectionLimiter:
+    def __init__(self, max_in_flight: int = cfg.SHOT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    #Method for reserving a place for a shot, returns False if all the places are taken
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
@@ -0,0 +1,139 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Callable
+import services.config as cfg
+
+# Live lobby events for the spectators(Server-Sent Events, see the "/SpectateLobby" endpoint)
+#  - A spectator first gets a "snapshot" message with the lobby details(the same JSON as "GetLobbyDetails"),
+#    then the events of the lobby: "score" after every hit, "timer_report" for the timer, a new "snapshot" when
+#    a player joins or leaves and when the game starts or ends, and "game_over" at the end of the game
+#  - The "score" messages have the new totals(not increments), so a spectator that missed one is corrected
+#    by the next one
+#  - The events are encoded once and queued for every spectator of the lobby, every spectator has its own
+#    bounded queue and is written by its own response task
+#  - The events are handed to the spectators by one task, SPECTATOR_FANOUT_BATCH spectators at a time with a pause
+#    in between, so that hundreds of spectators waking up for the same event do not hold up the event loop(and the
+#    players' messages) for the whole fan-out
+#  - A spectator that falls more than SPECTATOR_QUEUE_SIZE events behind loses the queued events and gets a
+#    new snapshot instead
+#  - The stream is ended after the game over(or when the lobby was removed)
+
+#Sentinels put in a spectator's queue: send a new snapshot, end the stream
+_RESYNC = object()
+_END = object()
+
+#Method that frames an encoded message as a Server-Sent Event
+def sse_event(data: str) -> str:
+    return f"data: {data}\n\n"
+
+#Method that encodes the lobby details(see LobbySnapshots) as a "snapshot" event
+def snapshot_event(details: bytes) -> str:
+    return sse_event('{"type":"snapshot","payload":' + details.decode() + "}")
+
+class SpectatorStream:
+    def __init__(self, lobby_code: str, max_backlog: int):
+        self.lobby_code = lobby_code
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_backlog)
+
+    #Method for queueing an event, the queued events are replaced by a new snapshot if the queue is full
+    def send(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self._clear()
+            self.queue.put_nowait(_RESYNC)
+            if data is _END:
+                self.queue.put_nowait(_END)
+
+    def _clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    #Method that returns the events of the stream(the caller sends them to the spectator)
+    #- details: the encoded lobby details to start with
+    #- get_details: returns the current lobby details(ETag, encoded details) of a lobby, None if the lobby is gone
+    #- is_game_over: returns True if the game of a lobby is over(only the details are sent then)
+    async def events(self, details: bytes, get_details: Callable[[str], tuple[str, bytes] | None],
+                     is_game_over: Callable[[str], bool], keepalive: float = cfg.SPECTATOR_KEEPALIVE) -> AsyncIterator[str]:
+        yield snapshot_event(details)
+        if is_game_over(self.lobby_code):
+            return
+        while True:
+            try:
+                data = await asyncio.wait_for(self.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                #the game could have ended without the stream being ended(for example on another worker that stopped)
+                if is_game_over(self.lobby_code):
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if data is _END:
+                return
+            if data is _RESYNC:
+                current = get_details(self.lobby_code)
+                if current is None:
+                    return
+                yield snapshot_event(current[1])
+                continue
+            yield data
+
+class SpectatorHub:
+    def __init__(self, max_backlog: int = cfg.SPECTATOR_QUEUE_SIZE, batch: int = cfg.SPECTATOR_FANOUT_BATCH):
+        self.max_backlog = max_backlog
+        self.batch = max(1, batch)
+        #spectators of every lobby(connected to this worker)
+        self.lobbies: dict[str, set[SpectatorStream]] = {}
+        #events waiting to be handed to the spectators(lobby code, event), in order
+        self._pending: deque = deque()
+        self._fanout: asyncio.Task | None = None
+
+    #Method for adding a spectator to a lobby
+    def subscribe(self, lobby_code: str) -> SpectatorStream:
+        stream = SpectatorStream(lobby_code, self.max_backlog)
+        self.lobbies.setdefault(lobby_code, set()).add(stream)
+        return stream
+
+    #Method for removing a spectator(the spectator disconnected or the stream ended)
+    def unsubscribe(self, stream: SpectatorStream):
+        streams = self.lobbies.get(stream.lobby_code)
+        if streams is None:
+            return
+        streams.discard(stream)
+        if not streams:
+            del self.lobbies[stream.lobby_code]
+
+    #Method to determine if a lobby has spectators on this worker
+    def has_spectators(self, lobby_code: str) -> bool:
+        return lobby_code in self.lobbies
+
+    #Method for queueing an encoded event(see sse_event) for every spectator of a lobby
+    def deliver(self, lobby_code: str, data: str):
+        if lobby_code in self.lobbies:
+            self._enqueue(lobby_code, data)
+
+    #Method for ending the streams of a lobby after the events that are already queued
+    def end_lobby(self, lobby_code: str):
+        if lobby_code in self.lobbies:
+            self._enqueue(lobby_code, _END)
+
+    def _enqueue(self, lobby_code: str, data):
+        self._pending.append((lobby_code, data))
+        if self._fanout is None or self._fanout.done():
+            self._fanout = asyncio.create_task(self._fanout_loop())
+
+    async def _fanout_loop(self):
+        while self._pending:
+            lobby_code, data = self._pending.popleft()
+            streams = list(self.lobbies.pop(lobby_code, ()) if data is _END else self.lobbies.get(lobby_code, ()))
+            for start in range(0, len(streams), self.batch):
+                if start:
+                    await asyncio.sleep(0)
+                for stream in streams[start:start + self.batch]:
+                    stream.send(data)
+            await asyncio.sleep(0)
+
+    def __len__(self):
+        return sum(len(streams) for streams in self.lobbies.values())
@@ -0,0 +1,245 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import threading
+from multiprocessing.managers import BaseManager
+from GameState import LobbyState, PlayerState, TeamState
+import services.service as sv
+import services.config as cfg
+
+# Lobby state used by the lobby manager(lobbies, teams, players and the player id counter)
+#  - "memory": the state is kept in the worker process(one server worker, the original behaviour)
+#  - "shared": the state is kept in a state server process(started by "cluster.py") and every server worker
+#    calls it over a local socket, so a lobby can be used from any worker
+#  - Every method is one atomic operation on the state, so two workers can never(for example) both start
+#    the same game or overfill a team
+#  - In "shared" mode the methods return copies, changes must always be made through the backend methods
+#  - Every change of a lobby gives it a new version(one counter for all the lobbies, so a version is never reused
+#    even by a new lobby with the same code), the cached lobby details are only rebuilt when the version changed
+#  - dump_state() and load_state() convert the whole state to(and from) plain tuples for the state snapshots
+#    (see StateSnapshot), the player id counter and the version counter are kept so ids and versions are not reused
+
+class MemoryStateBackend:
+    def __init__(self):
+        #the state server handles every worker on its own thread
+        self._lock = threading.RLock()
+        self._lobbies: dict[str, LobbyState] = {}
+        #player id -> (lobby code, team id)
+        self._players: dict[int, tuple[str, str]] = {}
+        self._next_player_id = 1
+        self._version = 0
+
+    #Method that gives a lobby a new version after it was changed
+    def _changed(self, lobby: LobbyState):
+        self._version += 1
+        lobby.version = self._version
+
+    #Method that returns a new(unique) player id
+    def next_player_id(self) -> int:
+        with self._lock:
+            player_id = self._next_player_id
+            self._next_player_id += 1
+            return player_id
+
+    #Method for adding a new lobby, returns the(unique) lobby code of the lobby
+    def create_lobby(self, lobby: LobbyState) -> str:
+        with self._lock:
+            lobby_code = sv.generate_lobby_code(self._lobbies)
+            self._changed(lobby)
+            self._lobbies[lobby_code] = lobby
+            return lobby_code
+
+    #Method to get a lobby, None if the lobby does not exist
+    def get_lobby(self, lobby_code: str) -> LobbyState | None:
+        with self._lock:
+            return self._lobbies.get(lobby_code)
+
+    #Method to get the version of a lobby, None if the lobby does not exist
+    def get_lobby_version(self, lobby_code: str) -> int | None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            return lobby.version if lobby else None
+
+    #Method to determine if a lobby exists
+    def lobby_exists(self, lobby_code: str) -> bool:
+        with self._lock:
+            return lobby_code in self._lobbies
+
+    #Method for deleting a lobby and all its players
+    def delete_lobby(self, lobby_code: str):
+        with self._lock:
+            lobby = self._lobbies.pop(lobby_code, None)
+            if not lobby:
+                return
+            for team in lobby.teams.values():
+                for player_id in team.players:
+                    if self._players.get(player_id, (None,))[0] == lobby_code:
+                        del self._players[player_id]
+
+    #Method for adding a player to the team with the least players
+    #- returns the player(with the team id) or None if the lobby does not exist or both teams are full
+    def add_player(self, lobby_code: str, player: PlayerState) -> PlayerState | None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            if not lobby:
+                return None
+            teamA, teamB = list(lobby.teams.values())
+            team = teamA if len(teamA.players) <= len(teamB.players) else teamB
+            if len(team.players) >= team.max_players:
+                return None
+            player.team_id = team.id
+            team.add_player(player)
+            self._players[player.id] = (lobby_code, team.id)
+            self._changed(lobby)
+            return player
+
+    #Method to find a player, returns the lobby code, the team id and the player(None if the player is not in a lobby)
+    def find_player(self, player_id: int) -> tuple[str, str, PlayerState] | None:
+        with self._lock:
+            found = self._players.get(player_id)
+            if not found:
+                return None
+            lobby_code, team_id = found
+            return lobby_code, team_id, self._lobbies[lobby_code].teams[team_id].players[player_id]
+
+    #Method for removing a player from their team
+    #- returns the number of players left in the team(None if the player is not in a lobby)
+    def remove_player(self, player_id: int) -> int | None:
+        with self._lock:
+            found = self._players.pop(player_id, None)
+            if not found:
+                return None
+            lobby_code, team_id = found
+            lobby = self._lobbies[lobby_code]
+            team = lobby.teams[team_id]
+            team.remove_player(player_id)
+            self._changed(lobby)
+            return len(team.players)
+
+    #Method for starting a game, returns False if the game was already started(or is over)
+    def start_game(self, lobby_code: str, start_time: float, duration: float) -> bool:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            if not lobby or lobby.game_status != 'not_started':
+                return False
+            lobby.game_status = 'running'
+            lobby.start_time = start_time
+            lobby.duration = duration
+            self._changed(lobby)
+            return True
+
+    #Method for ending a game, returns the lobby or None if the game was already over
+    def end_game(self, lobby_code: str) -> LobbyState | None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            if not lobby or lobby.game_status == 'game_over':
+                return None
+            lobby.game_status = 'game_over'
+            self._changed(lobby)
+            return lobby
+
+    #Method for recording a hit on the opposing team
+    #- returns the score of the shooter team, the score of the team that was shot, the hits of the shooter team,
+    #    the hits of the player and the shots of the team that was shot(None if the game is not running)
+    def record_hit(self, lobby_code: str, shooter_team_id: str, shot_team_id: str,
+                   player_id: int) -> tuple[int, int, int, int, int] | None:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            if not lobby or lobby.game_status != 'running':
+                return None
+            team_shooter, team_shot = lobby.teams[shooter_team_id], lobby.teams[shot_team_id]
+            team_shooter.hits += 1
+            team_shooter.score += 15
+            player = team_shooter.get_player(player_id)
+            if player:
+                player.hits += 1
+            team_shot.shots += 1
+            self._changed(lobby)
+            return (team_shooter.score, team_shot.score, team_shooter.hits, player.hits if player else 0,
+                    team_shot.shots)
+
+    #Method that returns the whole state as plain tuples: the next player id, the version counter and the lobbies
+    #- lobby: (code, game status, time remaining, start time, duration, allowed inactive time,
+    #    allowed active time for detail, version, teams)
+    #- team: (id, color, shape, max players, score, hits, misses, shots, players), player: (id, name, hits)
+    def dump_state(self) -> tuple:
+        with self._lock:
+            lobbies = [(lobby_code, lobby.game_status, lobby.time_remaining, lobby.start_time, lobby.duration,
+                        lobby.allowed_inactive_time, lobby.allowed_active_time_for_detail, lobby.version,
+                        [(team.id, team.color, team.shape, team.max_players, team.score, team.hits, team.misses,
+                          team.shots, [(player.id, player.name, player.hits) for player in team.players.values()])
+                         for team in lobby.teams.values()])
+                       for lobby_code, lobby in self._lobbies.items()]
+            return self._next_player_id, self._version, lobbies
+
+    #Method that replaces the state with a state returned by dump_state()
+    def load_state(self, state: tuple):
+        next_player_id, version, lobbies = state
+        with self._lock:
+            self._lobbies.clear()
+            self._players.clear()
+            for (lobby_code, game_status, time_remaining, start_time, duration, allowed_inactive_time,
+                 allowed_active_time_for_detail, lobby_version, teams) in lobbies:
+                lobby = LobbyState(teams={})
+                lobby.game_status = game_status
+                lobby.time_remaining = time_remaining
+                lobby.start_time = start_time
+                lobby.duration = duration
+                lobby.allowed_inactive_time = allowed_inactive_time
+                lobby.allowed_active_time_for_detail = allowed_active_time_for_detail
+                lobby.version = lobby_version
+                for team_id, color, shape, max_players, score, hits, misses, shots, players in teams:
+                    team = lobby.teams[team_id] = TeamState(team_id, color, shape, max_players)
+                    team.score, team.hits, team.misses, team.shots = score, hits, misses, shots
+                    for player_id, name, player_hits in players:
+                        team.add_player(PlayerState(player_id, name, team_id, player_hits))
+                        self._players[player_id] = (lobby_code, team_id)
+                self._lobbies[lobby_code] = lobby
+            self._next_player_id = max(self._next_player_id, next_player_id)
+            self._version = max(self._version, version)
+
+    #Method for moving the start time of a running game(the game keeps the time it had left after a restart)
+    def rebase_game(self, lobby_code: str, start_time: float) -> bool:
+        with self._lock:
+            lobby = self._lobbies.get(lobby_code)
+            if not lobby or lobby.game_status != 'running':
+                return False
+            lobby.start_time = start_time
+            self._changed(lobby)
+            return True
+
+#Manager used to serve(and connect to) the shared state in the state server process
+class StateManager(BaseManager):
+    pass
+
+#The state of the state server process
+_shared_state: MemoryStateBackend | None = None
+
+def _get_shared_state() -> MemoryStateBackend:
+    global _shared_state
+    if _shared_state is None:
+        _shared_state = MemoryStateBackend()
+    return _shared_state
+
+StateManager.register("state", callable=_get_shared_state)
+
+#Method that parses a "host:port" address
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+#Method for starting the state server process(used by "cluster.py"), the manager must be shut down by the caller
+def serve_state(address: str = cfg.STATE_ADDRESS, authkey: str = cfg.STATE_AUTHKEY) -> StateManager:
+    manager = StateManager(address=parse_address(address), authkey=authkey.encode())
+    manager.start()
+    return manager
+
+#Method for creating the state backend that is configured with STATE_BACKEND
+#- the "shared" backend connects to the state server, the state server must already be running
+def create_state_backend(kind: str = cfg.STATE_BACKEND, address: str = cfg.STATE_ADDRESS,
+                         authkey: str = cfg.STATE_AUTHKEY):
+    if kind != "shared":
+        return MemoryStateBackend()
+    manager = StateManager(address=parse_address(address), authkey=authkey.encode())
+    manager.connect()
+    return manager.state()
@@ -0,0 +1,105 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import marshal
+import os
+import threading
+import time
+from typing import Callable
+import services.config as cfg
+
+# Snapshot of the lobby state on disk, so a restarted server(for example a deploy) can continue the games
+#  - The lobby manager captures the state(the lobbies, the player id counter and the timers of the games, see
+#    LobbyManager.capture_state) as plain tuples, the snapshot is written at shutdown and every `interval` seconds
+#  - The file is a short header(magic and format version) followed by the tuples encoded with marshal(it only
+#    stores plain values, reading a snapshot can not run code like pickle can), it is written to a temporary file
+#    on a thread and then renamed, so a snapshot is never half written and the event loop does not wait for the disk
+#  - A snapshot older than `max_age` seconds(or with another format version) is not restored
+#  - The snapshot is only written by this worker, so it is only used with the "memory" state backend
+
+_MAGIC = b"LSSNAP"
+_FORMAT = 3
+
+class StateSnapshot:
+    def __init__(self, path: str = cfg.STATE_SNAPSHOT, interval: float = cfg.STATE_SNAPSHOT_INTERVAL,
+                 max_age: float = cfg.STATE_SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.written = 0
+        self.last_size = 0
+        #a snapshot written at shutdown waits for a periodic snapshot that is being written(and an older
+        #    snapshot never replaces a newer one)
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    #Method to determine if the snapshots are switched on
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    #Method that encodes a captured state(with the time it was captured)
+    @staticmethod
+    def encode(state: tuple, saved_at: float) -> bytes:
+        return _MAGIC + bytes((_FORMAT,)) + marshal.dumps((saved_at, state))
+
+    #Method that decodes a snapshot, returns the time it was captured and the state(None if it is not a snapshot)
+    @staticmethod
+    def decode(data: bytes) -> tuple[float, tuple] | None:
+        if data[:len(_MAGIC)] != _MAGIC or data[len(_MAGIC):len(_MAGIC) + 1] != bytes((_FORMAT,)):
+            return None
+        return marshal.loads(data[len(_MAGIC) + 1:])
+
+    #Method for writing a captured state(atomically, see above)
+    #- saved_at: the time the state was captured(now by default)
+    def write(self, state: tuple, saved_at: float | None = None):
+        saved_at = time.time() if saved_at is None else saved_at
+        data = self.encode(state, saved_at)
+        temporary = f"{self.path}.tmp"
+        with self._lock:
+            if saved_at < self._saved_at:
+                return
+            self._saved_at = saved_at
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, self.path)
+            self.written += 1
+            self.last_size = len(data)
+
+    #Method for reading the snapshot, returns the time it was captured and the state
+    #- None if there is no snapshot, it could not be read or it is older than max_age
+    def read(self) -> tuple[float, tuple] | None:
+        if not self.enabled:
+            return None
+        try:
+            with open(self.path, "rb") as file:
+                snapshot = self.decode(file.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading the state snapshot: {e!r}")
+            return None
+        if snapshot is None:
+            print("The state snapshot has an unknown format, it is not restored")
+            return None
+        saved_at, state = snapshot
+        if self.max_age and time.time() - saved_at > self.max_age:
+            return None
+        return saved_at, state
+
+    #Task that writes a snapshot every `interval` seconds
+    #- capture returns the state to write(captured on the event loop), None if there is nothing new to write
+    async def run(self, capture: Callable[[], tuple | None]):
+        if not self.enabled or not self.interval:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            saved_at = time.time()
+            state = capture()
+            if state is None:
+                continue
+            try:
+                await asyncio.to_thread(self.write, state, saved_at)
+            except Exception as e:
+                print(f"Error writing the state snapshot: {e!r}")
@@ -0,0 +1,238 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING
+import services.config as cfg
+
+#The computer vision model(OpenCV and numpy) is only imported when the engine is started, so that the
+#    server can start(and answer the health checks) before the model is loaded
+if TYPE_CHECKING:
+    from ComputerVisionModel import ComputerVisionModel
+
+# Vision engine used to run the shape detection without blocking the event loop
+#  - "inline" mode runs the ComputerVisionModel directly on the event loop(the original behaviour)
+#  - "process" mode sends the detection to a pool of worker processes, the frame bytes are written
+#    into shared memory slots so that only the slot index and length have to be sent to the worker
+#  - The number of slots is the queue depth, when all the slots are in use the next frame waits for a free slot
+#  - start() loads the model(and starts the workers) in the background and runs a warm-up detection on a synthetic
+#    frame in the model and in every worker(see ComputerVisionModel.warm_up), so the first shots do not pay for
+#    OpenCV's first calls. The engine is "ready" when this is done, the frames sent before wait for it
+#  - If the model can not be loaded or warmed up the engine is "failed", the frames are then answered as
+#    misses straight away(instead of waiting for an engine that will never be ready)
+#  - The time taken by every startup step is kept in `startup`(in seconds)
+
+#State of a worker process(each worker has its own model and its own view of the shared memory slots)
+_worker_model: "ComputerVisionModel | None" = None
+_worker_slots: list[shared_memory.SharedMemory] = []
+
+#Method used to initialize a worker process when the pool starts it
+#- the model is warmed up before the worker takes its first frame
+def _init_worker(min_area: int, roi_mode: str, roi_size: float, slot_names: list[str], warm_up: bool = False):
+    global _worker_model, _worker_slots
+    from ComputerVisionModel import ComputerVisionModel
+    _worker_model = ComputerVisionModel(min_area=min_area, roi_mode=roi_mode, roi_size=roi_size)
+    _worker_slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    if warm_up:
+        _worker_model.warm_up()
+
+#Method sent to the workers to start them(the pool only starts a worker when there is work for it)
+#- it waits a little so that every warm-up job is given to a different worker
+def _worker_started(delay: float) -> int:
+    time.sleep(delay)
+    return os.getpid()
+
+#Method that runs inside the worker process
+#- Reads the frame from the shared memory slot(or uses the frame that was sent directly if it did not fit)
+#- If timed is True, the stage timings are returned with the shapes
+def _detect_in_worker(slot_index: int, length: int, is_base64: bool, color: str, roi=None, frame=None, timed=False):
+    if frame is None:
+        frame = _worker_slots[slot_index].buf[:length]
+    timings = {} if timed else None
+    try:
+        if is_base64:
+            shapes = _worker_model.detect_shape(frame, color, roi, timings)
+        else:
+            shapes = _worker_model.detect_shape_from_bytes(frame, color, roi, timings)
+        return (shapes, timings) if timed else shapes
+    finally:
+        #release the view so that the slot can be re-used/closed
+        if isinstance(frame, memoryview):
+            frame.release()
+
+class VisionEngine:
+    def __init__(self, mode: str = cfg.VISION_ENGINE_MODE, workers: int = cfg.VISION_WORKERS,
+                 queue_depth: int = cfg.VISION_QUEUE_DEPTH, slot_size: int = cfg.VISION_FRAME_SLOT_SIZE, min_area=100,
+                 roi_mode: str = cfg.VISION_ROI_MODE, roi_size: float = cfg.VISION_ROI_SIZE, warm_up: bool = cfg.VISION_WARMUP):
+        self.mode = mode if mode in ("inline", "process") else "inline"
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.slot_size = slot_size
+        self.min_area = min_area
+        self.roi_mode = roi_mode
+        self.roi_size = roi_size
+        self.warm_up = warm_up
+        #The model used for the inline mode(and as a fallback if the pool breaks), loaded by start()
+        self.model: "ComputerVisionModel | None" = None
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: list[shared_memory.SharedMemory] = []
+        self._free_slots: asyncio.Queue | None = None
+        self.ready = False
+        self.failed = False
+        self._ready = asyncio.Event()
+        self.startup: dict[str, float] = {}
+
+    #Method for loading the model, warming it up and starting the worker processes(in "process" mode)
+    #- Must be called from the running event loop(the app lifespan), the loading is done on a thread
+    #- If the model can not be loaded or warmed up the engine is marked as failed and the error is raised
+    async def start(self):
+        if self.ready or self.failed:
+            return
+        start = time.perf_counter()
+        try:
+            self.model = await asyncio.to_thread(self._load_model)
+            self.startup["vision_load"] = time.perf_counter() - start
+            if self.warm_up:
+                step = time.perf_counter()
+                await asyncio.to_thread(self.model.warm_up)
+                self.startup["vision_warm_up"] = time.perf_counter() - step
+        except BaseException:
+            self.model = None
+            self.failed = True
+            #wake the frames that are waiting, they are answered as misses
+            self._ready.set()
+            raise
+
+        if self.mode == "process":
+            step = time.perf_counter()
+            await self._start_workers()
+            self.startup["vision_workers"] = time.perf_counter() - step
+
+        self.startup["vision_ready"] = time.perf_counter() - start
+        self.ready = True
+        self._ready.set()
+
+    def _load_model(self) -> "ComputerVisionModel":
+        from ComputerVisionModel import ComputerVisionModel
+        return ComputerVisionModel(min_area=self.min_area, roi_mode=self.roi_mode, roi_size=self.roi_size)
+
+    async def _start_workers(self):
+        try:
+            self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_size) for _ in range(self.queue_depth)]
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self.min_area, self.roi_mode, self.roi_size,
+                                                           [slot.name for slot in self._slots], self.warm_up))
+            #start every worker now(they are warmed up by the initializer) instead of on the first frames
+            jobs = [self._executor.submit(_worker_started, 0.05) for _ in range(self.workers)]
+            await asyncio.gather(*(asyncio.wrap_future(job) for job in jobs))
+        except Exception as e:
+            print(f"Error starting vision workers, falling back to inline detection: {e}")
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self._release_slots()
+            self.mode = "inline"
+            return
+
+        self._free_slots = asyncio.Queue()
+        for index in range(len(self._slots)):
+            self._free_slots.put_nowait(index)
+
+    #Method for stopping the worker processes and releasing the shared memory
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._release_slots()
+
+    #Number of frames currently waiting for/using a worker
+    def pending(self) -> int:
+        if self._free_slots is None:
+            return 0
+        return len(self._slots) - self._free_slots.qsize()
+
+    #Method for detecting the shape in a frame, returns the same result as ComputerVisionModel.detect_shape
+    #- image: base64 encoded image(is_base64=True) or the raw JPEG bytes(is_base64=False)
+    #- roi: (optional) region of interest declared by the client
+    #- timings: (optional) dictionary the stage timings are added to(see ComputerVisionModel), in "process" mode
+    #    the time spent waiting for a free slot is added as the "queue" stage
+    async def detect_shape(self, image, color: str, is_base64: bool = True, roi=None, timings: dict | None = None) -> list:
+        if not self.ready:
+            await self._ready.wait()
+        if self.failed:
+            return []
+        if self._executor is None:
+            return self._detect_inline(image, color, is_base64, roi, timings)
+
+        #a frame that is not an image(for example "image": null in a JSON shot) is a miss, like in "inline" mode
+        if not isinstance(image, (str, bytes, bytearray, memoryview)):
+            return []
+        try:
+            data = image.encode("ascii") if isinstance(image, str) else image
+        except UnicodeEncodeError:
+            return []
+        start = time.perf_counter()
+        slot_index = await self._free_slots.get()
+        #the slot is given back if the frame is not handed to a worker(whatever the error)
+        try:
+            if timings is not None:
+                timings["queue"] = time.perf_counter() - start
+            timed = timings is not None
+            loop = asyncio.get_running_loop()
+            if len(data) <= self.slot_size:
+                self._slots[slot_index].buf[:len(data)] = data
+                future = self._executor.submit(_detect_in_worker, slot_index, len(data), is_base64, color, roi, None, timed)
+            else:
+                #frame is too big for the slot, send it to the worker directly
+                future = self._executor.submit(_detect_in_worker, slot_index, len(data), is_base64, color, roi, bytes(data), timed)
+            #The slot is only released when the worker is done with it(even if the awaiting shot was cancelled)
+            future.add_done_callback(lambda _: self._release_slot_threadsafe(loop, slot_index))
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._free_slots.put_nowait(slot_index)
+            print(f"Vision workers unavailable, using inline detection: {e}")
+            return self._detect_inline(image, color, is_base64, roi, timings)
+        except Exception as e:
+            self._free_slots.put_nowait(slot_index)
+            print(f"Error sending a frame to the vision workers: {e!r}")
+            return []
+        except BaseException:
+            self._free_slots.put_nowait(slot_index)
+            raise
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            print(f"Vision workers unavailable, using inline detection: {e}")
+            return self._detect_inline(image, color, is_base64, roi, timings)
+        if not timed:
+            return result
+        shapes, worker_timings = result
+        timings.update(worker_timings)
+        return shapes
+
+    def _detect_inline(self, image, color: str, is_base64: bool, roi=None, timings: dict | None = None) -> list:
+        if is_base64:
+            return self.model.detect_shape(image, color, roi, timings)
+        return self.model.detect_shape_from_bytes(image, color, roi, timings)
+
+    def _release_slot_threadsafe(self, loop: asyncio.AbstractEventLoop, slot_index: int):
+        try:
+            loop.call_soon_threadsafe(self._free_slots.put_nowait, slot_index)
+        except RuntimeError:
+            pass #event loop has already been closed(server shutting down)
+
+    def _release_slots(self):
+        for slot in self._slots:
+            try:
+                slot.close()
+                slot.unlink()
+            except (FileNotFoundError, BufferError):
+                pass
+        self._slots = []
+        self._free_slots = None
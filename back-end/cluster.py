@@ -0,0 +1,46 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import argparse
+import asyncio
+import os
+import threading
+import uvicorn
+import services.config as cfg
+from StateBackend import serve_state
+from PubSub import PubSubHub
+
+# Launcher used to run the API on more than one server worker process(see the Procfile)
+#  - With one worker(CLUSTER_WORKERS=1, the default) the API is started exactly like "uvicorn main:app"
+#  - With more workers, the state server(StateBackend) and the pub/sub hub(PubSub) are started first and every
+#    worker is configured(with environment variables) to use them, so a lobby can be used from any worker
+#  - Every worker has its own vision engine, VISION_WORKERS is per server worker
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Laser-Shooter API on one or more worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=cfg.CLUSTER_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run("main:app", host=args.host, port=args.port)
+        return
+
+    #start the shared state server and the pub/sub hub for the workers
+    state_manager = serve_state(cfg.STATE_ADDRESS, cfg.STATE_AUTHKEY)
+    hub = PubSubHub(cfg.PUBSUB_ADDRESS)
+    threading.Thread(target=asyncio.run, args=(hub.serve(),), daemon=True).start()
+
+    #the workers are started by uvicorn, they read the backends(and the keys) from the environment
+    os.environ["STATE_BACKEND"] = "shared"
+    os.environ["STATE_AUTHKEY"] = cfg.STATE_AUTHKEY
+    os.environ["WS_RESUME_SECRET"] = cfg.WS_RESUME_SECRET
+    os.environ["PUBSUB_BACKEND"] = "socket"
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        state_manager.shutdown()
+
+if __name__ == "__main__":
+    main()
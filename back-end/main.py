@@ -1,30 +1,120 @@
 # Phiwokwakhe Khathwane : 2022004325
 # Welcome Galane        : 2024671386 
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+import time
+#start of the import of the app, used for the startup timings(see "/ready")
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse, JSONResponse
 from contextlib import asynccontextmanager
 import asyncio
-from ComputerVisionModel import ComputerVisionModel
+import hmac
+import json
+from VisionEngine import VisionEngine
 import services.service as sv
-from models import MissedShotPayload, Player,Team, ShotHitPayload, JoinedTeamPayload, Message
-from ConnectionManager import ConnectionManager
+import services.config as cfg
+from models import MissedShotPayload, BusyPayload, Player, Message, SessionPayload
+from GameState import PlayerState, TeamState
+from ConnectionManager import ConnectionManager, ClientConnection
 from LobbyManager import LobbyManager
+from StateBackend import create_state_backend
+from PubSub import create_pubsub
+from services.metrics import metrics, Gauge
+from ShotIntake import ShotIntake, DetectionLimiter
+from CaptureQuality import CaptureController
+from LobbySnapshots import etag_matches
+from ShotCapture import ShotCapture
 
 
 #models and managers definitions
-vision_model = ComputerVisionModel()
-c_manager = ConnectionManager()
-l_manager = LobbyManager(c_manager)
+#- the lobby state and the broadcasts can be shared with other server workers(see "cluster.py")
+vision_engine = VisionEngine()
+c_manager = ConnectionManager(pubsub=create_pubsub())
+l_manager = LobbyManager(c_manager, create_state_backend())
+#limits the number of shots in detection over all the players
+detection_limiter = DetectionLimiter()
+#lowers the capture settings of the clients when the detection is overloaded
+capture_controller = CaptureController(detection_limiter)
+#writes the shots recieved to a file for "tools/shot_replay.py"(off unless SHOT_CAPTURE is set)
+shot_capture = ShotCapture()
+
+#time(in seconds) taken by every startup step, the vision engine's steps are added when it is ready
+startup_timings: dict[str, float] = {}
+
+#metrics that are read from the managers when the metrics are collected
+metrics.add(Gauge("active_games", "Games whose timers are run by this worker.", lambda: [((), len(l_manager.active_lobbies))]))
+metrics.add(Gauge("lobby_connections", "Websocket connections per lobby.",
+                  lambda: [((lobby_code,), sum(len(team) for team in teams.values()))
+                           for lobby_code, teams in c_manager.active_connections.items()], ("lobby",)))
+metrics.add(Gauge("vision_pending_frames", "Frames waiting for/being processed by the vision workers.",
+                  lambda: [((), vision_engine.pending())]))
+metrics.add(Gauge("ws_dropped_messages_total", "Messages dropped because a client could not keep up.",
+                  lambda: [((), c_manager.dropped_messages)], type="counter"))
+metrics.add(Gauge("ws_reaped_connections_total", "Websocket connections closed because the client stopped answering.",
+                  lambda: [((), c_manager.reaped_connections)], type="counter"))
+metrics.add(Gauge("lobby_inbox_events", "Events waiting in the lobby actors' inboxes.",
+                  lambda: [((), sum(actor.inbox.qsize() for actor in l_manager.actors.values()))]))
+metrics.add(Gauge("spectator_connections", "Spectator streams connected to this worker.",
+                  lambda: [((), len(c_manager.spectators))]))
+metrics.add(Gauge("results_pending", "Game results waiting to be written to the results store.",
+                  lambda: [((), len(l_manager.results.pending))]))
+metrics.add(Gauge("results_written_total", "Game results written to the results store.",
+                  lambda: [((), l_manager.results.written)], type="counter"))
+metrics.add(Gauge("shots_captured_total", "Shots written to the shot capture file.",
+                  lambda: [((), shot_capture.captured)], type="counter"))
+metrics.add(Gauge("shots_capture_dropped_total", "Shots not captured because the capture file was full or the writes fell behind.",
+                  lambda: [((), shot_capture.dropped)], type="counter"))
+metrics.add(Gauge("capture_level", "Capture settings level sent to the clients(0 is the best quality).",
+                  lambda: [((), capture_controller.level)]))
+metrics.add(Gauge("state_snapshots_written_total", "State snapshots written for restarts.",
+                  lambda: [((), l_manager.snapshot.written)], type="counter"))
+metrics.add(Gauge("state_snapshot_bytes", "Size of the last state snapshot.",
+                  lambda: [((), l_manager.snapshot.last_size)]))
+metrics.add(Gauge("startup_seconds", "Time taken by every startup step of this worker.",
+                  lambda: [((step,), seconds) for step, seconds in startup_timings.items()], ("step",)))
 
-#counter variable for player id's
-id_counter : int = 1
+#Task that starts the vision engine(loads and warms up the model) after the server has started, so the server
+#    can answer the health checks while the model is loading
+#- If the engine fails to start, "/ready" stays 503(status "failed") and the shots are answered as misses
+async def start_vision_engine(started: float):
+    try:
+        await vision_engine.start()
+    except Exception as e:
+        print(f"Error starting the vision engine: {e!r}")
+        return
+    startup_timings.update(vision_engine.startup)
+    startup_timings["ready"] = time.perf_counter() - started
 
-#create a background task for the game timer loop
+#create a background task for the game timer loop and start the vision engine(in the background)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    startup_timings["import"] = time.perf_counter() - _import_started
+    vision_task = asyncio.create_task(start_vision_engine(_import_started))
+    #continue the games of the last server process(see StateSnapshot) before the timers are started
+    step = time.perf_counter()
+    restored = l_manager.restore_state()
+    startup_timings["state_restore"] = time.perf_counter() - step
+    if restored:
+        print(f"Restored {restored} lobbies from the state snapshot")
+    await c_manager.start()
     asyncio.create_task(l_manager.game_timer_loop())
+    asyncio.create_task(c_manager.heartbeat_loop())
+    asyncio.create_task(metrics.probe_event_loop())
+    asyncio.create_task(capture_controller.run(c_manager))
+    asyncio.create_task(l_manager.results_loop())
+    snapshot_task = asyncio.create_task(l_manager.snapshot_loop())
+    capture_task = asyncio.create_task(shot_capture.run())
     yield
+    snapshot_task.cancel()
+    capture_task.cancel()
+    await shot_capture.close()
+    await l_manager.close_results()
+    l_manager.save_state()
+    await c_manager.shutdown()
+    vision_task.cancel()
+    vision_engine.shutdown()
 
 #Fast API configuration and middleware
 app = FastAPI(lifespan=lifespan)
@@ -44,6 +134,30 @@ app.add_middleware(
 async def root():
     return {"message": "Phiwo and Galane were here!"}
 
+#Get endpoint for the readiness of the server(for the load balancer), the server is ready once the vision engine
+#    is warmed up, before that the shots would wait for it
+#- returns the startup timings(in seconds)
+@app.get("/ready")
+async def ready():
+    status = "ready" if vision_engine.ready else ("failed" if vision_engine.failed else "starting")
+    return JSONResponse({"status": status, "startup": startup_timings}, status_code=200 if vision_engine.ready else 503)
+
+#Get endpoint for the server metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+#Post endpoint for switching the recording of the metrics on or off in every worker
+#- Needs the METRICS_TOKEN in the "X-Metrics-Token" header, the endpoint is switched off if METRICS_TOKEN is not set
+@app.post("/metrics/{state}")
+async def set_metrics(state: str, x_metrics_token: str | None = Header(default=None)):
+    if not cfg.METRICS_TOKEN or not hmac.compare_digest((x_metrics_token or "").encode(), cfg.METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Not allowed to switch the metrics.")
+    if state not in ("on", "off"):
+        raise HTTPException(status_code=400, detail="state must be 'on' or 'off'.")
+    c_manager.set_metrics(state == "on")
+    return {"message": f"Metrics are {state}."}
+
 #API ENDPOINTS
 
 #Post endpoint that creates a lobby "room" and returns the lobby creation details
@@ -65,7 +179,6 @@ async def create_lobby(max_players: int):
 #    details will be returned to the client.
 @app.post("/JoinLobby/{lobby_code}/{username}")
 async def join_lobby(lobby_code: str, username: str):
-    global id_counter
     if not l_manager.lobby_code_exists(lobby_code):
         raise HTTPException(status_code=404, detail="Lobby not found.")
     
@@ -73,24 +186,50 @@ async def join_lobby(lobby_code: str, username: str):
         return {"message" : "Cannot join lobby, it is full."}
     
     #create a new player
-    player = Player(id=id_counter, name=username, team_id="", hits=0)
-    id_counter += 1
+    player = PlayerState(id=l_manager.next_player_id(), name=username)
     #Assign the player to a team randomly(well, not really randomly, but balancing the teams)
-    assign_team(lobby_code, player)
-    return {"message": f"Joined lobby {lobby_code}","user": player}
+    player = assign_team(lobby_code, player)
+    if not player:
+        return {"message" : "Cannot join lobby, it is full."}
+    return {"message": f"Joined lobby {lobby_code}","user": player.to_model()}
 
 #Get method for getting the lobby details given the lobby code
 @app.get("/GetLobbyDetails/{lobby_code}")
-async def get_lobby_details(lobby_code: str):
-    if not l_manager.lobby_code_exists(lobby_code):
+async def get_lobby_details(lobby_code: str, if_none_match: str | None = Header(default=None)):
+    #the details are cached per lobby version(see LobbySnapshots)
+    details = l_manager.get_lobby_details(lobby_code)
+    if not details:
+        raise HTTPException(status_code=404, detail="Lobby not found.")
+    etag, body = details
+
+    #the spectator already has these details
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+#Get method for the live events of a lobby(Server-Sent Events) for the spectators
+#- the first event is the lobby details, then the lobby events follow(see SpectatorHub)
+@app.get("/SpectateLobby/{lobby_code}")
+async def spectate_lobby(lobby_code: str):
+    #subscribe before getting the details, so that no event is missed in between
+    stream = c_manager.spectators.subscribe(lobby_code)
+    details = l_manager.get_lobby_details(lobby_code)
+    if not details:
+        c_manager.spectators.unsubscribe(stream)
         raise HTTPException(status_code=404, detail="Lobby not found.")
 
-    lobby = l_manager.get_lobby(lobby_code)
-    if not lobby:
-        return {"message": "lobby not found"}
+    async def events():
+        try:
+            async for event in stream.events(details[1], l_manager.get_lobby_details, l_manager.is_game_over):
+                yield event
+        finally:
+            c_manager.spectators.unsubscribe(stream)
 
-    #return a nicely formated lobby details    
-    return sv.to_lobby_details_json(lobby_code, lobby)
+    #"X-Accel-Buffering" stops proxies from buffering the stream
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 #Post method for exiting a lobby 
@@ -103,37 +242,36 @@ async def leave_team(lobby_code: str, player: Player):
     if not team:
         return {"message" : "Team does not exist."}
 
-    if player not in team.players:
+    entry = l_manager.find_player(player.id)
+    if not entry or entry.lobby_code != lobby_code or entry.team_id != team.id:
         return {"message" : "Player not in the team."}
     
-    #remove the player from the team
-    team.players.remove(player)
-
-    #if there are no players on the team, delete the lobby session
-    if len(team.players) == 0:
-        l_manager.remove_lobby(lobby_code)
+    #remove the player from the team(the lobby is removed if there are no players left on the team)
+    #- handled by the lobby's actor, in order with the other events of the lobby
+    await l_manager.player_left(lobby_code, player.id)
 
     return {"message": f"Left {player.team_id} in lobby {lobby_code}"}
 
 
 #Helper method to assign players to a team by balancing players
-def assign_team(lobby_code: str, player:Player):
+#- returns the player with the team id, or None if both teams are full
+def assign_team(lobby_code: str, player:PlayerState) -> PlayerState | None:
     if not l_manager.lobby_code_exists(lobby_code):
         raise HTTPException(status_code=404, detail="Lobby not found.")
     
     #everytime a player is added to a team, they will be connected to 
     # the websockets which will check if the maximum player count has been reached yet
-    teamA, teamB = l_manager.get_teams_in_lobby(lobby_code) 
-    if len(teamA.players) <= len(teamB.players):
-        player.team_id = teamA.id
-        teamA.players.append(player)
-    else:
-        player.team_id = teamB.id
-        teamB.players.append(player)
+    #- the team with the least players is picked by the lobby state(so that two workers can not overfill a team)
+    return l_manager.add_player(lobby_code, player)
 
 #Socket endpoint to handle image processing and broadcasting messages as well as connecting
+#- A player that lost its connection can connect again while the game is running with the query parameters
+#    "resume"(the resume token from the "session" message), "stream" and "last_id"(the stream and the id of the
+#    last message it got), the messages it missed are replayed
 @app.websocket("/ws/{lobby_code}/{team_name}/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, lobby_code: str, team_name:str, user_id: int):
+    resume = websocket.query_params.get("resume")
+    resuming = resume is not None and sv.is_resume_token(resume, lobby_code, user_id)
     #You can only connect if the lobby and team exist
     if not l_manager.lobby_code_exists(lobby_code):
         await websocket.close(code=1000)
@@ -142,60 +280,59 @@ async def websocket_endpoint(websocket: WebSocket, lobby_code: str, team_name:st
     if not team:
         await websocket.close(code=1000)
         return
-    #No one can join when a lobby is active
-    if l_manager.is_lobby_active(lobby_code):
+    #No one can join when a lobby is active(except the players that connect again)
+    if l_manager.is_lobby_active(lobby_code) and not resuming:
         await websocket.close(code=1000)
         return
 
     #if player is not in the team
-    player = team.get_player(user_id)
-    if not player:
+    #- the player connected to this socket is the shooter for all the shots recieved on it
+    entry = l_manager.find_player(user_id)
+    if not entry or entry.lobby_code != lobby_code or entry.team_id != team.id:
         await websocket.close(code=1000)
         return
+    player = entry.player
     
     #connect to the websocket
-    await c_manager.connect(lobby_code,team_name, websocket)
+    #- clients that offer the binary subprotocol can send binary shot frames instead of base64 in JSON
+    subprotocol = sv.BINARY_SUBPROTOCOL if sv.BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", []) else None
+    connection = await c_manager.connect(lobby_code,team_name, websocket, player.id, subprotocol)
+    #send the missed messages before any new broadcast is queued
+    replayed = c_manager.replay(connection, websocket.query_params.get("stream"),
+                                sv.to_int(websocket.query_params.get("last_id"), 0)) if resuming else None
+    session = SessionPayload(resume_token=sv.resume_token(lobby_code, player.id), stream=c_manager.stream_id,
+                             ping_interval=c_manager.ping_interval, idle_timeout=c_manager.idle_timeout)
+    await c_manager.send_personal_message(Message(type="session", payload=session), websocket)
+    #tell the client what frames to send
+    if capture_controller.enabled:
+        await c_manager.send_personal_message(capture_controller.message(), websocket)
 
-    #Broadcast successful joined message to lobby
-    joined_payload = JoinedTeamPayload(user_name=player.name, team_name=team_name, 
-                                      members_remaining=team.max_players - len(team.players), max_members=team.max_players)
-    message = Message(type='join', payload=joined_payload)
-    await c_manager.send_message_to_Lobby(lobby_code, message)
+    if resuming:
+        l_manager.player_resumed(lobby_code, team.id, player, replayed is not None)
+    else:
+        #Broadcast successful joined message to lobby and start the game if the lobby is full
+        #(the lobby manager sends the start game signal)
+        l_manager.player_joined(lobby_code, team.id, player)
 
-    #Check if the lobby is full yet
-    if l_manager.are_teams_full(lobby_code):
-        #send a start game signal
-        message = Message(type="start_game", payload=None)
-        await c_manager.send_message_to_Lobby(lobby_code=lobby_code, message=message)
-        await l_manager.start_lobby_game(lobby_code)
+    #the shots are recieved here and processed by another task(latest shot wins, see ShotIntake)
+    intake = ShotIntake()
+    processor = asyncio.create_task(process_shots(intake, websocket, lobby_code, team, player))
     try:
         while True:
-           #TODO: Recieve bytes instead
-           data = await websocket.receive_json()
-           #decode the json data
-           image_data, player, color_range = sv.decode_json(data)
-           missed_payload = MissedShotPayload(shooter_id=player.id)
-           message = Message(type="missed_shot", payload=missed_payload)
-           if not color_range:
-               #broadcast a missed shot message
-               await c_manager.send_personal_message(message, websocket)
+           shot = await receive_shot(websocket, connection)
+           connection.last_seen = time.monotonic()
+           if shot is None:
                continue
-           #detect the shape in the image
-           detected_shape = vision_model.detect_shape(image_data, color_range)
-           if not detected_shape or len(detected_shape) != 1:
-                #broadcast a missed shot message
-                await c_manager.send_personal_message(message, websocket)
-                continue
-           is_valid, opponent_team = is_valid_hit(detected_shape[0], team, lobby_code)
-           if not is_valid or not opponent_team:
-                #broadcast a missed shot message
-                await c_manager.send_personal_message(message, websocket)
-                continue
-           
-           #handle valid shot
-           await handle_valid_hit(lobby_code, team, opponent_team, player)
-           #Game over is handled by the loop defined h=in the lobby manager
-           
+           seq = shot[2]
+           if not intake.admit(cooldown=capture_controller.cooldown()):
+               shot_capture.record(shot, lobby_code, team.id, player.id, "cooldown")
+               await send_busy(websocket, player, seq, "cooldown")
+               continue
+           superseded = intake.offer(shot)
+           if superseded is not None:
+               capture_controller.observe_rejected()
+               shot_capture.record(superseded, lobby_code, team.id, player.id, "superseded")
+               await send_busy(websocket, player, superseded[2], "superseded")
 
     except WebSocketDisconnect as e:
         c_manager.disconnect(lobby_code,team_name, websocket)
@@ -203,34 +340,131 @@ async def websocket_endpoint(websocket: WebSocket, lobby_code: str, team_name:st
             await websocket.close()
         except:
             pass
+    finally:
+        processor.cancel()
 
-#Helper method to handle valid shots
-async def handle_valid_hit(lobby_code:str, team_shooter: Team, team_shot : Team, player_shooter: Player):
-    #Record a hit
-    team_shooter.hits += 1
-    team_shooter.score += 15
-    player_shooter.hits += 1
-    hit_payload = ShotHitPayload(team_score=team_shooter.score, team_name=team_shooter.id, player_id=player_shooter.id)
-    message = Message(type="hit", payload=hit_payload)
-    
-    #braodcast a hit message to all players in the shooter team
-    await c_manager.send_message_to_team(lobby_code,team_shooter.id,message)
+#Task that processes the shots of a player one at a time
+#- If there are too many shots in detection over all the players, the shot is answered with "busy" straight away
+#- A shot that could not be processed(an error) is answered with "missed_shot", every shot gets an answer
+async def process_shots(intake: ShotIntake, websocket: WebSocket, lobby_code: str, team: TeamState, player: PlayerState):
+    while True:
+        shot = await intake.next()
+        if not detection_limiter.try_acquire():
+            capture_controller.observe_rejected()
+            shot_capture.record(shot, lobby_code, team.id, player.id, "overloaded")
+            await send_busy(websocket, player, shot[2], "overloaded")
+            continue
+        start = time.perf_counter()
+        try:
+            await handle_shot(shot, websocket, lobby_code, team, player)
+        except Exception as e:
+            print(f"Error processing a shot: {e}")
+            shot_capture.record(shot, lobby_code, team.id, player.id, "error", detection=time.perf_counter() - start)
+            try:
+                message = Message(type="missed_shot", payload=MissedShotPayload(shooter_id=player.id, seq=shot[2]))
+                await c_manager.send_personal_message(message, websocket)
+            except Exception:
+                pass
+        finally:
+            capture_controller.observe(time.perf_counter() - start)
+            detection_limiter.release()
 
-    #Record a short
-    team_shot.shots += 1
-    shot_payload = ShotHitPayload(team_score=team_shot.score,team_name=team_shot.id, player_id=player_shooter.id)
-    message = Message(type="shot", payload=shot_payload)
-    
-    #broadcast a shot message to all players in the opposing team
-    await c_manager.send_message_to_team(lobby_code,team_shot.id,message)
+#Helper method to detect the shape in a shot and send the result
+async def handle_shot(shot, websocket: WebSocket, lobby_code: str, team: TeamState, player: PlayerState):
+    image_data, color, seq, roi, is_base64, _ = shot
+    shot_start = time.perf_counter()
+    timings = {} if metrics.enabled or shot_capture.enabled else None
+    missed_payload = MissedShotPayload(shooter_id=player.id, seq=seq)
+    message = Message(type="missed_shot", payload=missed_payload)
+    if not color:
+        #broadcast a missed shot message
+        await c_manager.send_personal_message(message, websocket)
+        record_shot(shot, lobby_code, team, player, "no_color", shot_start, timings)
+        return
+    #detect the shape in the image(off the event loop when the engine runs in "process" mode)
+    detected_shape = await vision_engine.detect_shape(image_data, color, is_base64, roi, timings)
+    if not detected_shape or len(detected_shape) != 1:
+        #broadcast a missed shot message
+        await c_manager.send_personal_message(message, websocket)
+        record_shot(shot, lobby_code, team, player, "miss", shot_start, timings, detected_shape)
+        return
+    is_valid, opponent_team = is_valid_hit(detected_shape[0], team, lobby_code)
+    if not is_valid or not opponent_team:
+        #broadcast a missed shot message
+        await c_manager.send_personal_message(message, websocket)
+        record_shot(shot, lobby_code, team, player, "miss", shot_start, timings, detected_shape)
+        return
+
+    #handle valid shot(the lobby's actor records the hit and broadcasts it, the shooter does not wait for it)
+    l_manager.player_hit(lobby_code, team.id, opponent_team.id, player.id, seq)
+    record_shot(shot, lobby_code, team, player, "hit", shot_start, timings, detected_shape)
+    #Game over is handled by the loop defined h=in the lobby manager
+
+#Helper method to tell the shooter that a shot was not processed
+async def send_busy(websocket: WebSocket, player: PlayerState, seq: int | None, reason: str):
+    message = Message(type="busy", payload=BusyPayload(shooter_id=player.id, seq=seq, reason=reason))
+    await c_manager.send_personal_message(message, websocket)
+    if metrics.enabled:
+        metrics.shots_total.inc(reason)
+
+#Helper method to recieve the next shot from a player's websocket
+#- Binary frames use the binary shot protocol and text frames use the original JSON format
+#- Returns the image, the colour, the sequence number, the region of interest,
+#    if the image is base64 encoded and the time it was recieved, or None if the frame could not be decoded
+#- The shooter is always the player connected to the websocket(the player sent in the frame is not trusted)
+#- A "pong" marks the connection as answering the pings(see ConnectionManager)
+async def receive_shot(websocket: WebSocket, connection: ClientConnection | None = None):
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+
+    if frame.get("bytes") is not None:
+        decoded = sv.decode_binary_frame(frame["bytes"])
+        if decoded is None:
+            return None
+        image_data, color, seq, roi = decoded
+        return image_data, color, seq, roi, False, time.time()
+
+    try:
+        data = json.loads(frame.get("text") or "")
+    except ValueError:
+        return None
+    #the "pong" answers to the pings only keep the connection alive
+    if isinstance(data, dict) and data.get("type") == "pong":
+        if connection is not None:
+            connection.answers_pings = True
+        return None
+    if not isinstance(data, dict):
+        return None
+    image_data, color, seq, roi = sv.decode_json(data)
+    return image_data, color, seq, roi, True, time.time()
+
+#Helper method to record the metrics of a shot and add it to the shot capture
+def record_shot(shot, lobby_code: str, team: TeamState, player: PlayerState, result: str, start: float,
+                timings: dict | None, detected_shape=()):
+    shot_capture.record(shot, lobby_code, team.id, player.id, result, detected_shape or (), timings,
+                        time.perf_counter() - start)
+    record_shot_metrics(result, start, timings)
+
+#Helper method to record the metrics of a shot
+def record_shot_metrics(result: str, start: float, timings: dict | None):
+    if not metrics.enabled or timings is None:
+        return
+    metrics.shots_total.inc(result)
+    metrics.shot_seconds.observe(time.perf_counter() - start, result)
+    metrics.observe_stages(timings)
 
 #Helper method to check if a shot is valid or not
-def is_valid_hit(detected_shape:str, team:Team, lobby_code:str) -> tuple[bool,Team | None]:    
+#- the shot is not a hit if the teams are not found(for example the lobby was removed after the game over)
+def is_valid_hit(detected_shape:str, team:TeamState, lobby_code:str) -> tuple[bool,TeamState | None]:    
 
-    teamA, teamB = l_manager.get_teams_in_lobby(lobby_code)
+    lobby = l_manager.state.get_lobby(lobby_code)
+    if not lobby or len(lobby.teams) < 2:
+        return False, None
+    teamA, teamB = l_manager.get_teams_in_lobby(lobby_code, lobby)
     
     if not teamA or not teamB:
-        raise HTTPException(status_code=500, detail="Opposing team not found.")
+        return False, None
     
     if detected_shape == teamA.shape:
         return True, teamA if teamA.id != team.id else teamB
@@ -2,8 +2,9 @@
 # Welcome Galane        : 2024671386 
 
 from turtle import st
-from pydantic import BaseModel
+from pydantic import BaseModel, field_serializer
 from typing import Union, Literal
+import json
 
 #Models for Teams and Players
 class Player(BaseModel):
@@ -23,6 +24,7 @@ class Player(BaseModel):
         return hash(self.id)
 
 #-This will be used for spectators to see team scores and player stats
+#-The players are indexed by their id(they are still returned as a list in the API responses)
 class Team(BaseModel):
     id: str
     score: int = 0
@@ -31,24 +33,35 @@ class Team(BaseModel):
     hits: int = 0
     misses: int = 0
     shots: int = 0
-    players: list[Player] = []
+    players: dict[int, Player] = {}
     max_players: int
 
+    @field_serializer("players")
+    def _serialize_players(self, players: dict[int, Player]) -> list[Player]:
+        return list(players.values())
+
     #gets the player from the players
     def get_player(self, user_id: int) -> Player | None:
-        for player in self.players:
-            if player.id == user_id:
-                return player
-        #user not found in team
-        return None
+        return self.players.get(user_id)
+
+    #adds a player to the team
+    def add_player(self, player: Player):
+        self.players[player.id] = player
+
+    #removes a player from the team, returns the removed player(None if the player was not in the team)
+    def remove_player(self, user_id: int) -> Player | None:
+        return self.players.pop(user_id, None)
 
 class Lobby(BaseModel):
     teams: dict[str, Team]
     game_status: Literal['not_started','game_over','running'] = 'not_started'
     #Time remaining after the game has started(default is 60 seconds)
-    time_remaining: int = 60
+    time_remaining: float = 60
+    #Wall clock time(seconds since the epoch) the game was started at and the game duration(in seconds)
+    start_time: float | None = None
+    duration: float = 60
 
-    #a lobby has a life time of 3 minuites before game_status = 'running', otherwise
+    #a lobby has a life time of 2 minuites(in seconds) before game_status = 'running', otherwise
     # it will be removed and everyone will be disconnected 
     allowed_inactive_time: int =  120 
     # After the game has ended, the lobby will be allowed to be still active
@@ -60,34 +73,166 @@ class Lobby(BaseModel):
 
 
 #Models for WebSocket messages
-class ShotHitPayload(BaseModel):
-    team_score: int
-    team_name: str
-    player_id: int
-
-class GameOverPayload(BaseModel):
-    winning_team_name: str
-    winning_team_score: int
-    losing_team_name: str
-    losing_team_score: int
-
-class MissedShotPayload(BaseModel):
-    shooter_id: int
-
-class TimerReportPayload(BaseModel):
-    time_remaining: float
+#- Plain classes with __slots__(no validation), they are created on the hot path for every shot and timer report
+#- Every field in __slots__ is sent in the payload, in the same order
+class WsPayload:
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class ShotHitPayload(WsPayload):
+    __slots__ = ("team_score", "team_name", "player_id", "seq")
+
+    def __init__(self, team_score: int, team_name: str, player_id: int, seq: int | None = None):
+        self.team_score = team_score
+        self.team_name = team_name
+        self.player_id = player_id
+        self.seq = seq #sequence number of the shot sent by the shooter
+
+class GameOverPayload(WsPayload):
+    __slots__ = ("winning_team_name", "winning_team_score", "losing_team_name", "losing_team_score")
+
+    def __init__(self, winning_team_name: str, winning_team_score: int, losing_team_name: str, losing_team_score: int):
+        self.winning_team_name = winning_team_name
+        self.winning_team_score = winning_team_score
+        self.losing_team_name = losing_team_name
+        self.losing_team_score = losing_team_score
+
+class MissedShotPayload(WsPayload):
+    __slots__ = ("shooter_id", "seq")
+
+    def __init__(self, shooter_id: int, seq: int | None = None):
+        self.shooter_id = shooter_id
+        self.seq = seq #sequence number of the shot sent by the shooter
+
+#Sent to the shooter when a shot was not processed
+#- reason: "superseded"(a newer shot was sent before this one was processed), "cooldown"(the player shot too fast)
+#    or "overloaded"(the server has too many shots to process)
+class BusyPayload(WsPayload):
+    __slots__ = ("shooter_id", "seq", "reason")
+
+    def __init__(self, shooter_id: int, seq: int | None, reason: Literal['superseded', 'cooldown', 'overloaded']):
+        self.shooter_id = shooter_id
+        self.seq = seq
+        self.reason = reason
+
+#Sent to tell the clients what frames to send(see CaptureQuality), lowered when the server is overloaded
+#- max_size: longest side of the frames in pixels, jpeg_quality: 0-100, max_fire_rate: shots per second
+class CaptureSettingsPayload(WsPayload):
+    __slots__ = ("level", "max_size", "jpeg_quality", "max_fire_rate")
+
+    def __init__(self, level: int, max_size: int, jpeg_quality: int, max_fire_rate: float):
+        self.level = level
+        self.max_size = max_size
+        self.jpeg_quality = jpeg_quality
+        self.max_fire_rate = float(max_fire_rate)
+
+class TimerReportPayload(WsPayload):
+    __slots__ = ("time_remaining",)
+
+    def __init__(self, time_remaining: float):
+        self.time_remaining = float(time_remaining)
+
+#Sent when the game starts, the clients can count down the time themselves
+#- start_time and server_time are the server's wall clock times(seconds since the epoch)
+#- timer_mode is "broadcast" if the server sends a timer_report every second or "client" if
+#    the server only sends a clock_sync every few seconds
+class StartGamePayload(WsPayload):
+    __slots__ = ("start_time", "duration", "server_time", "time_remaining", "timer_mode")
+
+    def __init__(self, start_time: float, duration: float, server_time: float, time_remaining: float,
+                 timer_mode: Literal['broadcast', 'client']):
+        self.start_time = float(start_time)
+        self.duration = float(duration)
+        self.server_time = float(server_time)
+        self.time_remaining = float(time_remaining)
+        self.timer_mode = timer_mode
+
+#Sent every few seconds in the "client" timer mode to correct the clients' count down
+class ClockSyncPayload(WsPayload):
+    __slots__ = ("server_time", "time_remaining")
+
+    def __init__(self, server_time: float, time_remaining: float):
+        self.server_time = float(server_time)
+        self.time_remaining = float(time_remaining)
 
 #This is to be broadcasted everytime a new user connects to the websocket
-class JoinedTeamPayload(BaseModel):
-    user_name: str #User who just joined
-    team_name: str #team they have been joined to
-    members_remaining: int
-    max_members: int
+class JoinedTeamPayload(WsPayload):
+    __slots__ = ("user_name", "team_name", "members_remaining", "max_members")
+
+    def __init__(self, user_name: str, team_name: str, members_remaining: int, max_members: int):
+        self.user_name = user_name #User who just joined
+        self.team_name = team_name #team they have been joined to
+        self.members_remaining = members_remaining
+        self.max_members = max_members
+
+#Sent to the spectators after every hit(see SpectatorHub) with the new totals of the shooter team, the player
+#    and the target team
+class SpectatorScorePayload(WsPayload):
+    __slots__ = ("team_id", "score", "hits", "player_id", "player_hits", "target_team_id", "target_shots")
+
+    def __init__(self, team_id: str, score: int, hits: int, player_id: int, player_hits: int, target_team_id: str,
+                 target_shots: int):
+        self.team_id = team_id
+        self.score = score
+        self.hits = hits
+        self.player_id = player_id
+        self.player_hits = player_hits
+        self.target_team_id = target_team_id
+        self.target_shots = target_shots
+
+#Sent to a player when the websocket is connected(see ConnectionManager)
+#- resume_token: token used to connect again to the lobby while the game is running
+#- stream: id of the message stream of the server worker, the broadcasts have a message id("id") in that stream
+#- ping_interval and idle_timeout: the server sends a ping every ping_interval seconds and closes a connection it
+#    did not hear from for idle_timeout seconds
+class SessionPayload(WsPayload):
+    __slots__ = ("resume_token", "stream", "ping_interval", "idle_timeout")
+
+    def __init__(self, resume_token: str, stream: str, ping_interval: float, idle_timeout: float):
+        self.resume_token = resume_token
+        self.stream = stream
+        self.ping_interval = float(ping_interval)
+        self.idle_timeout = float(idle_timeout)
+
+#Sent every few seconds to check that the connection is alive, the client answers with a "pong" message
+class PingPayload(WsPayload):
+    __slots__ = ("server_time",)
+
+    def __init__(self, server_time: float):
+        self.server_time = float(server_time)
+
+#Sent to a player that connected again when the messages it missed could not be replayed, with the scores of
+#    both teams(the score of the player's team first)
+class SyncPayload(WsPayload):
+    __slots__ = ("team_name", "team_score", "enemy_team_name", "enemy_team_score")
+
+    def __init__(self, team_name: str, team_score: int, enemy_team_name: str, enemy_team_score: int):
+        self.team_name = team_name
+        self.team_score = team_score
+        self.enemy_team_name = enemy_team_name
+        self.enemy_team_score = enemy_team_score
 
 # Message payload types
-Payload = Union[ShotHitPayload, GameOverPayload, MissedShotPayload, TimerReportPayload, JoinedTeamPayload, None]
+Payload = Union[ShotHitPayload, GameOverPayload, MissedShotPayload, BusyPayload, CaptureSettingsPayload,
+                TimerReportPayload, StartGamePayload, ClockSyncPayload, JoinedTeamPayload, SpectatorScorePayload,
+                SessionPayload, PingPayload, SyncPayload, None]
+
+MessageType = Literal['hit', 'shot', 'game_over', 'missed_shot', 'busy', 'capture_settings', 'start_game','timer_report',
+                      'clock_sync','join','score','session','ping','sync']
 
 #Message sent to users via websockets
-class Message(BaseModel):
-    type: Literal['hit', 'shot', 'game_over', 'missed_shot', 'start_game','timer_report','join']
-    payload: Payload
\ No newline at end of file
+class Message:
+    __slots__ = ("type", "payload")
+
+    def __init__(self, type: MessageType, payload: Payload = None):
+        self.type = type
+        self.payload = payload
+
+    #Method that encodes the message as JSON(the same format as the previous pydantic model)
+    def to_json(self) -> str:
+        payload = self.payload.to_dict() if self.payload is not None else None
+        return _encode_json({"type": self.type, "payload": payload})
+
+_encode_json = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
@@ -0,0 +1,171 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import os
+import secrets
+
+#Server configuration values
+#- Every value can be overridden with an environment variable of the same name,
+#    this makes it possible to tune a deploy(Procfile/dyno) without changing code
+
+#Helper methods used to read typed environment variables with a default value
+def env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default).strip()
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+#Helper method used to read a key, a key that is not set is random(only this process knows it, "cluster.py"
+#    passes its keys to the workers it starts)
+def env_secret(name: str) -> str:
+    return env_str(name, "") or secrets.token_hex(32)
+
+#Vision engine(shape detection) settings
+#- VISION_ENGINE_MODE: "inline" runs detection on the event loop, "process" uses a pool of worker processes
+#- VISION_WORKERS: number of worker processes for the "process" mode
+#- VISION_QUEUE_DEPTH: maximum number of frames that can be waiting/processing in the pool at once
+#- VISION_FRAME_SLOT_SIZE: size(in bytes) of each shared memory slot used to pass frames to the workers
+VISION_ENGINE_MODE = env_str("VISION_ENGINE_MODE", "inline").lower()
+VISION_WORKERS = max(1, env_int("VISION_WORKERS", min(4, os.cpu_count() or 1)))
+VISION_QUEUE_DEPTH = max(1, env_int("VISION_QUEUE_DEPTH", VISION_WORKERS * 2))
+VISION_FRAME_SLOT_SIZE = max(1024, env_int("VISION_FRAME_SLOT_SIZE", 1024 * 1024))
+
+#Warm-up of the vision engine(see VisionEngine.start)
+#- VISION_WARMUP: run a detection on a synthetic frame(in the model and in every worker) before the server reports
+#    that it is ready, so the first shots do not pay for OpenCV's first calls
+VISION_WARMUP = env_str("VISION_WARMUP", "true").lower() in ("1", "true", "yes", "on")
+
+#Region of interest(ROI) used for shape detection(see ComputerVisionModel)
+#- VISION_ROI_MODE: "full" uses the whole frame, "window" uses a window around the crosshair and
+#    "grow" starts with a window around the crosshair and grows it while the shape does not fit
+#- VISION_ROI_SIZE: size of the(starting) window as a fraction of the frame size
+VISION_ROI_MODE = env_str("VISION_ROI_MODE", "full").lower()
+VISION_ROI_SIZE = env_float("VISION_ROI_SIZE", 0.5)
+
+#Decoding of the shot frames(see ImageDecoder)
+#- VISION_DECODER: "auto" uses libjpeg-turbo(PyTurboJPEG) when it is installed and OpenCV otherwise,
+#    "opencv" or "turbojpeg" pick the decoder
+#- VISION_DECODE_SCALE: "auto" picks the scale the frames are decoded at(1, 2, 4 or 8) from the frame size,
+#    or a fixed scale
+#- VISION_TARGET_SIZE: size of the smallest target that must be detected, as a fraction of the shorter
+#    side of the frame(used to pick the scale)
+VISION_DECODER = env_str("VISION_DECODER", "auto").lower()
+VISION_DECODE_SCALE = env_str("VISION_DECODE_SCALE", "auto").lower()
+VISION_TARGET_SIZE = env_float("VISION_TARGET_SIZE", 0.1)
+
+#WebSocket broadcast settings(see ConnectionManager)
+#- WS_SEND_QUEUE_SIZE: maximum number of messages waiting to be sent to one client
+#- WS_BACKLOG_POLICY: what happens when a client's queue is full, "drop" drops the message and
+#    "disconnect" disconnects the client
+#- WS_CLOSE_TIMEOUT: seconds to wait for a websocket to close
+WS_SEND_QUEUE_SIZE = max(1, env_int("WS_SEND_QUEUE_SIZE", 64))
+WS_BACKLOG_POLICY = env_str("WS_BACKLOG_POLICY", "disconnect").lower()
+WS_CLOSE_TIMEOUT = env_float("WS_CLOSE_TIMEOUT", 5.0)
+
+#WebSocket heartbeat and reconnects(see ConnectionManager)
+#- WS_PING_INTERVAL: seconds between two pings sent to the clients(0 switches the heartbeat off)
+#- WS_IDLE_TIMEOUT: a connection that answered a ping and then did not send anything(a pong or a shot) for this many
+#    seconds is closed(clients that never answer the pings are not closed for being silent)
+#- WS_REPLAY_SIZE: number of broadcasts kept per lobby to replay to a player that connects again
+#- WS_RESUME_WINDOW: seconds the broadcasts of a lobby are kept after its last player disconnected
+#- WS_RESUME_SECRET: key used to sign the resume tokens(must be the same for every server worker), random if it is
+#    not set("cluster.py" gives the same key to its workers), the random key is kept in the state snapshot so
+#    the tokens stay valid after a restart
+WS_PING_INTERVAL = max(0.0, env_float("WS_PING_INTERVAL", 15.0))
+WS_IDLE_TIMEOUT = max(1.0, env_float("WS_IDLE_TIMEOUT", 45.0))
+WS_REPLAY_SIZE = max(1, env_int("WS_REPLAY_SIZE", 256))
+WS_RESUME_WINDOW = max(0.0, env_float("WS_RESUME_WINDOW", 60.0))
+WS_RESUME_SECRET = env_secret("WS_RESUME_SECRET")
+WS_RESUME_SECRET_SET = bool(env_str("WS_RESUME_SECRET", ""))
+
+#Spectator stream settings(see SpectatorHub)
+#- SPECTATOR_QUEUE_SIZE: maximum number of events waiting to be sent to one spectator, a spectator that falls
+#    further behind gets a new snapshot instead of the events it missed
+#- SPECTATOR_KEEPALIVE: seconds without events after which a keep-alive comment is sent to the spectators
+#- SPECTATOR_FANOUT_BATCH: number of spectators an event is handed to before the other tasks(the players) can run
+SPECTATOR_QUEUE_SIZE = max(2, env_int("SPECTATOR_QUEUE_SIZE", 64))
+SPECTATOR_KEEPALIVE = max(1.0, env_float("SPECTATOR_KEEPALIVE", 15.0))
+SPECTATOR_FANOUT_BATCH = max(1, env_int("SPECTATOR_FANOUT_BATCH", 32))
+
+#Game timer settings(see LobbyManager)
+#- TIMER_SYNC_MODE: "broadcast" sends a timer_report to the lobby every second, "client" lets the clients
+#    count down from the start_game message and only sends a clock_sync correction every CLOCK_SYNC_INTERVAL seconds
+TIMER_SYNC_MODE = env_str("TIMER_SYNC_MODE", "broadcast").lower()
+CLOCK_SYNC_INTERVAL = max(1.0, env_float("CLOCK_SYNC_INTERVAL", 10.0))
+
+#Multi-worker settings(see "cluster.py", StateBackend and PubSub)
+#- CLUSTER_WORKERS: number of server worker processes started by "cluster.py", with more than one worker
+#    the lobby state and the broadcasts are shared between the workers
+#- STATE_BACKEND: "memory" keeps the lobbies in the worker, "shared" uses the state server at STATE_ADDRESS
+#- PUBSUB_BACKEND: "memory" only sends messages to the worker's websockets, "socket" also forwards them to
+#    the other workers through the hub at PUBSUB_ADDRESS
+#- STATE_AUTHKEY: key used by the workers to connect to the state server(random if it is not set, "cluster.py"
+#    gives the same key to its workers, set it when the state server is started another way)
+CLUSTER_WORKERS = max(1, env_int("CLUSTER_WORKERS", 1))
+STATE_BACKEND = env_str("STATE_BACKEND", "memory").lower()
+STATE_ADDRESS = env_str("STATE_ADDRESS", "127.0.0.1:8701")
+STATE_AUTHKEY = env_secret("STATE_AUTHKEY")
+PUBSUB_BACKEND = env_str("PUBSUB_BACKEND", "memory").lower()
+PUBSUB_ADDRESS = env_str("PUBSUB_ADDRESS", "127.0.0.1:8702")
+
+#Game results store(see ResultsStore)
+#- RESULTS_DB: SQLite file the results of the finished games are written to(every server worker uses the same file)
+#- RESULTS_FLUSH_INTERVAL: seconds between two writes of the results, a finished lobby is removed once its
+#    result is written
+#- RESULTS_MAX_AGE: seconds the results are kept for(0 keeps them forever)
+RESULTS_DB = env_str("RESULTS_DB", "results.sqlite3")
+RESULTS_FLUSH_INTERVAL = max(0.1, env_float("RESULTS_FLUSH_INTERVAL", 1.0))
+RESULTS_MAX_AGE = max(0.0, env_float("RESULTS_MAX_AGE", 24 * 3600))
+
+#Snapshot of the lobby state for restarts(see StateSnapshot), only used with the "memory" state backend
+#- STATE_SNAPSHOT: file the lobbies and their timers are written to(at shutdown and every
+#    STATE_SNAPSHOT_INTERVAL seconds) and restored from at startup, an empty value switches the snapshots off
+#- STATE_SNAPSHOT_INTERVAL: seconds between two snapshots while the server is running(0 only writes at shutdown)
+#- STATE_SNAPSHOT_MAX_AGE: snapshots older than this(in seconds) are not restored
+STATE_SNAPSHOT = env_str("STATE_SNAPSHOT", "state.snapshot")
+STATE_SNAPSHOT_INTERVAL = max(0.0, env_float("STATE_SNAPSHOT_INTERVAL", 5.0))
+STATE_SNAPSHOT_MAX_AGE = max(0.0, env_float("STATE_SNAPSHOT_MAX_AGE", 300))
+
+#Metrics settings(see services/metrics.py)
+#- METRICS_ENABLED: record the metrics shown on "/metrics"
+#- METRICS_TOKEN: token needed to switch the metrics on or off with "POST /metrics/{on|off}"(in the
+#    "X-Metrics-Token" header), the endpoint is switched off if it is not set
+METRICS_ENABLED = env_str("METRICS_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+METRICS_TOKEN = env_str("METRICS_TOKEN", "")
+
+#Shot admission control(see ShotIntake)
+#- SHOT_COOLDOWN: minimum time(in seconds) between two shots of a player, faster shots are answered with "busy"
+#- SHOT_MAX_IN_FLIGHT: maximum number of shots in detection over all the players, more shots are answered with "busy"
+SHOT_COOLDOWN = max(0.0, env_float("SHOT_COOLDOWN", 0.5))
+SHOT_MAX_IN_FLIGHT = max(1, env_int("SHOT_MAX_IN_FLIGHT", VISION_QUEUE_DEPTH * 2))
+
+#Shot traffic capture(see ShotCapture and "tools/shot_replay.py")
+#- SHOT_CAPTURE: file the shots recieved on the websockets are appended to(with the detection results and the stage
+#    timings), an empty value(the default) switches the capture off. "{pid}" is replaced by the worker's process id
+#- SHOT_CAPTURE_MAX_BYTES: the shots are no longer captured once the file reaches this size(0 has no limit)
+#- SHOT_CAPTURE_FLUSH_INTERVAL: seconds between two writes of the captured shots
+#- SHOT_CAPTURE_MAX_PENDING: bytes of captured shots that can wait for the next write, more shots are not captured
+SHOT_CAPTURE = env_str("SHOT_CAPTURE", "")
+SHOT_CAPTURE_MAX_BYTES = max(0, env_int("SHOT_CAPTURE_MAX_BYTES", 1024 ** 3))
+SHOT_CAPTURE_FLUSH_INTERVAL = max(0.05, env_float("SHOT_CAPTURE_FLUSH_INTERVAL", 0.5))
+SHOT_CAPTURE_MAX_PENDING = max(1, env_int("SHOT_CAPTURE_MAX_PENDING", 64 * 1024 ** 2))
+
+#Adaptive capture quality(see CaptureQuality)
+#- CAPTURE_ADAPTIVE: send capture settings(frame size, JPEG quality and fire rate) to the clients and lower
+#    them when the detection is overloaded
+#- CAPTURE_INTERVAL: seconds between two load checks
+#- CAPTURE_LATENCY_HIGH: average detection time(in seconds) of a shot above which the settings are lowered
+#- CAPTURE_LATENCY_LOW: average detection time(in seconds) of a shot below which the settings can go up again
+CAPTURE_ADAPTIVE = env_str("CAPTURE_ADAPTIVE", "true").lower() in ("1", "true", "yes", "on")
+CAPTURE_INTERVAL = max(0.5, env_float("CAPTURE_INTERVAL", 2.0))
+CAPTURE_LATENCY_HIGH = env_float("CAPTURE_LATENCY_HIGH", 0.25)
+CAPTURE_LATENCY_LOW = env_float("CAPTURE_LATENCY_LOW", 0.1)
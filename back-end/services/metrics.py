@@ -0,0 +1,135 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import asyncio
+import bisect
+import time
+from typing import Callable
+import services.config as cfg
+
+# Metrics of the server(exposed in the Prometheus text format on the "/metrics" endpoint)
+#  - Counters and histograms are updated by the code that is being measured, gauges are read when the
+#    metrics are collected
+#  - Recording is switched on or off with METRICS_ENABLED(metrics.enabled), or while the server is running with
+#    "POST /metrics/{on|off}"(every worker is switched, see ConnectionManager.set_metrics), when it is off the
+#    instrumented code only checks the flag
+#  - Every server worker has its own metrics
+
+#Default histogram buckets(in seconds)
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+#Helper method to format the labels of a sample
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._bucket_labels = [f'le="{bound}"' for bound in buckets] + ['le="+Inf"']
+        #labels -> [bucket counts..., count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        values = self._values.get(labels)
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, values in self._values.items():
+            cumulative = 0
+            for bucket, count in zip(self._bucket_labels, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, bucket)} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {values[-1]}")
+        return lines
+
+#Gauge that is read when the metrics are collected
+#- the callback returns a list of (label values, value)
+#- type can be set to "counter" for a total that is kept by the code that is being measured
+class Gauge:
+    def __init__(self, name: str, help: str, callback: Callable[[], list[tuple[tuple, float]]], labelnames: tuple = (),
+                 type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+        self.type = type
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Metrics:
+    def __init__(self, enabled: bool = cfg.METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+
+        #shot pipeline
+        self.shot_stage_seconds = self.add(Histogram("shot_stage_seconds", "Time spent in each stage of the shot pipeline.", ("stage",)))
+        self.shot_seconds = self.add(Histogram("shot_seconds", "Time from receiving a shot frame to sending the result.", ("result",)))
+        self.shots_total = self.add(Counter("shots_total", "Shot frames received by result.", ("result",)))
+
+        #broadcasts
+        self.broadcast_seconds = self.add(Histogram("broadcast_seconds", "Time taken to encode and queue a message.", ("target",)))
+        self.messages_queued_total = self.add(Counter("messages_queued_total", "Messages queued for websocket clients."))
+        self.ws_send_seconds = self.add(Histogram("ws_send_seconds", "Time taken to write one message to a websocket."))
+
+        #event loop and game timer loop
+        self.event_loop_lag_seconds = self.add(Histogram("event_loop_lag_seconds", "How late the event loop wakes up a sleeping task."))
+        self.timer_loop_seconds = self.add(Histogram("timer_loop_seconds", "Time taken by one iteration of the game timer loop."))
+        self.timer_lateness_seconds = self.add(Histogram("timer_lateness_seconds", "How late the game timer deadlines are handled.", ("kind",)))
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    #Method for adding the per stage timings of a shot(see ComputerVisionModel)
+    def observe_stages(self, timings: dict):
+        for stage, seconds in timings.items():
+            self.shot_stage_seconds.observe(seconds, stage)
+
+    #Method that returns all the metrics in the Prometheus text format
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    #Task that measures the event loop lag(how late a sleep of `interval` seconds wakes up)
+    async def probe_event_loop(self, interval: float = 0.5):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            if self.enabled:
+                self.event_loop_lag_seconds.observe(max(0.0, time.perf_counter() - start - interval))
+
+#The metrics of this server worker
+metrics = Metrics()
@@ -1,8 +1,13 @@
 # Phiwokwakhe Khathwane : 2022004325
 # Welcome Galane        : 2024671386 
 
+import base64
+import hashlib
+import hmac
 import random
-from models import Lobby, Player, Team
+import struct
+from GameState import LobbyState, TeamState
+import services.config as cfg
 
 #Predefined colors and shapes
 colors = ['blue','green']
@@ -18,6 +23,21 @@ color_ranges = {
     "orange": [([10, 100, 100], [20, 255, 255])],
     "purple": [([140, 100, 100], [160, 255, 255])]
 }
+
+#Colour ids used by the binary shot frames(the id is the index in the list)
+#- This list must match the one in the front-end "WebSocketService.ts", new colours must be appended
+color_ids = ["red", "blue", "green", "yellow", "orange", "purple"]
+
+#Binary shot frame protocol(negotiated per connection with the websocket subprotocol)
+#- The frame starts with a fixed header(network byte order) followed by the raw JPEG bytes:
+#    version(1 byte), colour id(1 byte), flags(2 bytes), player id(4 bytes), sequence number(4 bytes)
+#- If the SHOT_FLAG_ROI flag is set, the header is followed by the region of interest
+#    x, y, width, height(2 bytes each, in pixels) before the JPEG bytes
+BINARY_SUBPROTOCOL = "laser-shooter.binary.v1"
+SHOT_FRAME_VERSION = 1
+SHOT_FRAME_HEADER = struct.Struct("!BBHII")
+SHOT_FRAME_ROI = struct.Struct("!HHHH")
+SHOT_FLAG_ROI = 0x1
 #Temp: Index variable to pick a color and a shape
 shape_index = 0
 
@@ -49,12 +69,12 @@ def generate_team_names(colors:list, shape:str):
 
 #Method to create a team, using the previous two methods
 #- The same shape is assigned for both teams but different shapes
-def create_teams(lobbies: dict[str, dict[str, Team]] = {}):
+def create_teams(lobbies: dict[str, dict[str, TeamState]] = {}):
     colors, shape = pick_color_shape_combo()
     teamA_id, teamB_id = generate_team_names(colors, shape)
 
-    teamA = Team(id=teamA_id, score= 0, color=colors[0], shape=shape, hits=0, misses=0, shots=0, players=[], max_players=0)
-    teamB = Team(id=teamB_id, score= 0, color=colors[1], shape=shape, hits=0, misses=0, shots=0, players=[], max_players=0)
+    teamA = TeamState(id=teamA_id, color=colors[0], shape=shape, max_players=0)
+    teamB = TeamState(id=teamB_id, color=colors[1], shape=shape, max_players=0)
 
     #TODO: validation of unique color/shape
     _ = lobbies
@@ -62,29 +82,70 @@ def create_teams(lobbies: dict[str, dict[str, Team]] = {}):
 
 #The json data should contain the following keys:
 #- image: base64 encoded image string
-#- player: a Player object in dict format
+#- player: a Player object in dict format(ignored, the shooter is the player connected to the websocket)
 #- color: the color that is being seeing by the player
+#- seq: (optional) sequence number of the shot, it is sent back in the shot results
+#- roi: (optional) region of interest [x, y, width, height] in pixels
 def decode_json(data):
     image_data = data.get("image")
-    player = Player(**data.get("player"))
     color = data.get("color")
-    color_range = color_ranges.get(color)
-    print(color)
-    return image_data, player, color_range
+    color = color if color in color_ranges else None
+    seq = data.get("seq")
+    roi = data.get("roi")
+    return image_data, color, seq, roi
+
+#Method used to decode a binary shot frame(see SHOT_FRAME_HEADER)
+#- returns None if the frame is not valid, otherwise the JPEG bytes, the colour(None if it is unknown),
+#    the sequence number and the region of interest(None if not declared)
+#- the player id in the header is ignored, the shooter is the player connected to the websocket
+def decode_binary_frame(data: bytes):
+    if len(data) <= SHOT_FRAME_HEADER.size:
+        return None
+    version, color_id, flags, _, seq = SHOT_FRAME_HEADER.unpack_from(data)
+    if version != SHOT_FRAME_VERSION:
+        return None
+    offset = SHOT_FRAME_HEADER.size
+    roi = None
+    if flags & SHOT_FLAG_ROI:
+        if len(data) <= offset + SHOT_FRAME_ROI.size:
+            return None
+        roi = SHOT_FRAME_ROI.unpack_from(data, offset)
+        offset += SHOT_FRAME_ROI.size
+    color = color_ids[color_id] if color_id < len(color_ids) else None
+    color = color if color in color_ranges else None
+    image_data = memoryview(data)[offset:]
+    return image_data, color, seq, roi
+
+#Method that converts a query parameter to an int, `default` if it is missing or not a number
+def to_int(value: str | None, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+#Method that returns the resume token of a player, used to connect again to a running game(see ConnectionManager)
+#- the token is signed with WS_RESUME_SECRET, so every server worker(and a restarted server) can check it
+def resume_token(lobby_code: str, player_id: int) -> str:
+    digest = hmac.new(cfg.WS_RESUME_SECRET.encode(), f"{lobby_code}:{player_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+#Method to check the resume token of a player
+def is_resume_token(token: str, lobby_code: str, player_id: int) -> bool:
+    return hmac.compare_digest(token.encode(), resume_token(lobby_code, player_id).encode())
 
-#API response body for lobby details
-def to_lobby_details_json(lobby_code:str, lobby: Lobby):
+#API response body for lobby details(the teams are converted to the API models)
+def to_lobby_details_json(lobby_code:str, lobby: LobbyState):
     teams = [team for team in lobby.teams.values()]
     teamA, teamB = teams[0], teams[1]
     return {"code": lobby_code,
         "colors": [teamA.color, teamB.color],
         "shape": teamA.shape,
-        "teams": [teamA, teamB],
+        "teams": [teamA.to_model(), teamB.to_model()],
         "game_status": lobby.game_status,
         "time_remaining": lobby.time_remaining}
 
 #API response body for lobby creation status
-def to_lobby_creation_json(lobby_code:str, teamA: Team, teamB: Team, game_status: str = "not_started"):
+def to_lobby_creation_json(lobby_code:str, teamA: TeamState, teamB: TeamState, game_status: str = "not_started"):
     return {"lobby_code": lobby_code,
         "colors": [teamA.color, teamB.color],
         "shape": teamA.shape,
@@ -0,0 +1,308 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+import cv2
+import numpy as np
+import websockets
+import services.service as sv
+from tools.stats import summarise
+
+# Load generator for the game API
+#  - Creates N lobbies with M players each through the real "/CreateLobby", "/JoinLobby" and "/ws/..." endpoints,
+#    waits for the games to start and then every player fires synthetic shot frames at a fixed rate
+#  - Some of the frames contain the opposing team's shape(a hit), the others are empty(a miss)
+#  - Reports the throughput and the p50/p95/p99 of:
+#       shot latency: shot sent -> "hit"/"missed_shot" recieved by the shooter("busy" answers are counted separately)
+#       broadcast latency: shot sent -> "hit"/"shot" recieved by the other players of the lobby
+#       server timer lag: how late the server's timer reports are(the lag of the server's event loop)
+#       client loop lag: lag of the load generator's own event loop(if it is high, the results are not reliable)
+#  - The capture settings levels sent by the server are reported(the frames themselves are not scaled)
+#  - Optional spectators poll "/GetLobbyDetails" of every lobby with the last ETag, the latency and the number of
+#    full(200) and not modified(304) replies are reported, or("--spectator-mode stream") follow the live events
+#    of the lobby on "/SpectateLobby", the number of events they recieved is reported
+#  - The results are printed and written as JSON so that they can be compared between releases
+#
+# Usage(from "back-end/", with the API running):
+#   python -m tools.loadgen --lobbies 10 --players 4 --rate 2 --duration 20 --output results.json
+
+#Colours of the synthetic frames(BGR)
+FRAME_COLORS = {
+    "red": (0, 0, 255), "blue": (255, 0, 0), "green": (0, 255, 0),
+    "yellow": (0, 230, 255), "orange": (0, 140, 255), "purple": (200, 0, 160),
+}
+
+#Method that creates a JPEG frame with a triangle of the colour in the middle(or an empty frame if color is None)
+def make_frame(color: str | None, width: int, height: int) -> bytes:
+    image = np.full((height, width, 3), 255, np.uint8)
+    if color:
+        size = min(width, height) // 3
+        cx, cy = width // 2, height // 2
+        points = np.array([[cx, cy - size], [cx - size, cy + size], [cx + size, cy + size]], np.int32)
+        cv2.fillPoly(image, [points], FRAME_COLORS[color])
+    _, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buffer.tobytes()
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        #send time of every shot, (shooter id, seq) -> time, and the shots that were not answered yet
+        self.sent: dict[tuple[int, int], float] = {}
+        self.pending: set[tuple[int, int]] = set()
+        self.shot_latency: list[float] = []
+        self.broadcast_latency: list[float] = []
+        self.timer_lag: list[float] = []
+        self.loop_lag: list[float] = []
+        self.capture_levels: list[int] = []
+        self.details_latency: list[float] = []
+        self.counts = {"shots": 0, "hits": 0, "misses": 0, "busy": 0, "unanswered": 0, "errors": 0,
+                       "details_full": 0, "details_not_modified": 0, "spectator_events": 0}
+        self.frames: dict[str | None, bytes] = {}
+        self.started = 0
+
+    #Helper method for the HTTP endpoints(ran on a thread so that it does not block the sockets)
+    async def _post(self, path: str) -> dict:
+        def post():
+            request = urllib.request.Request(self.base_url + path, method="POST")
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read())
+        return await asyncio.to_thread(post)
+
+    #Helper method for getting the lobby details with an ETag, returns the new ETag(None on an error)
+    async def _get_details(self, lobby_code: str, etag: str | None) -> str | None:
+        def get():
+            request = urllib.request.Request(f"{self.base_url}/GetLobbyDetails/{lobby_code}",
+                                             headers={"If-None-Match": etag} if etag else {})
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+                    return response.status, response.headers.get("ETag")
+            except urllib.error.HTTPError as e:
+                return e.code, etag
+        start = time.perf_counter()
+        status, new_etag = await asyncio.to_thread(get)
+        self.details_latency.append(time.perf_counter() - start)
+        if status == 200:
+            self.counts["details_full"] += 1
+        elif status == 304:
+            self.counts["details_not_modified"] += 1
+        else:
+            return None
+        return new_etag
+
+    async def run(self) -> dict:
+        width, height = self.args.frame_size
+        for color in sv.colors:
+            self.frames[color] = make_frame(color, width, height)
+        self.frames[None] = make_frame(None, width, height)
+
+        probe = asyncio.create_task(self._probe_loop_lag())
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._run_lobby(index) for index in range(self.args.lobbies)),
+                                       return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        probe.cancel()
+
+        for result in results:
+            if isinstance(result, Exception):
+                self.counts["errors"] += 1
+                print(f"Lobby failed: {result!r}")
+        self.counts["unanswered"] = len(self.pending)
+        answered = self.counts["hits"] + self.counts["misses"]
+        return {
+            "config": {"base_url": self.base_url, "lobbies": self.args.lobbies, "players": self.args.players,
+                       "rate": self.args.rate, "duration": self.args.duration, "hit_ratio": self.args.hit_ratio,
+                       "protocol": self.args.protocol, "frame_size": list(self.args.frame_size),
+                       "spectators": self.args.spectators, "spectator_mode": self.args.spectator_mode,
+                       "poll_interval": self.args.poll_interval},
+            "lobbies_started": self.started,
+            "counts": self.counts,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_shots_per_s": round(answered / self.args.duration, 3) if self.args.duration else None,
+            "shot_latency": summarise(self.shot_latency),
+            "broadcast_latency": summarise(self.broadcast_latency),
+            "server_timer_lag": summarise(self.timer_lag),
+            "client_loop_lag": summarise(self.loop_lag),
+            "details_latency": summarise(self.details_latency),
+            "capture_level": {"max": max(self.capture_levels, default=None),
+                              "last": self.capture_levels[-1] if self.capture_levels else None,
+                              "messages": len(self.capture_levels)},
+        }
+
+    #Creates a lobby, joins and connects all the players and fires the shots
+    async def _run_lobby(self, index: int):
+        lobby = await self._post(f"/CreateLobby/{self.args.players}")
+        lobby_code = lobby["lobby_code"]
+        team_colors = dict(zip(lobby["teams"], lobby["colors"]))
+
+        #a player connects right after joining(the game starts when the last player connects)
+        sockets = []
+        try:
+            for number in range(self.args.players):
+                joined = await self._post(f"/JoinLobby/{lobby_code}/load{index}_{number}")
+                user = joined["user"]
+                subprotocols = [sv.BINARY_SUBPROTOCOL] if self.args.protocol == "binary" else None
+                websocket = await websockets.connect(f"{self.ws_url}/ws/{lobby_code}/{user['team_id']}/{user['id']}",
+                                                     subprotocols=subprotocols, max_size=None)
+                sockets.append((user, websocket))
+
+            game_started = asyncio.Event()
+            enemy_colors = {user["id"]: next(color for team, color in team_colors.items() if team != user["team_id"])
+                            for user, _ in sockets}
+            readers = [asyncio.create_task(self._read(user, websocket, game_started)) for user, websocket in sockets]
+            await asyncio.wait_for(game_started.wait(), timeout=30)
+            self.started += 1
+
+            spectate = self._follow if self.args.spectator_mode == "stream" else self._spectate
+            spectators = [asyncio.create_task(spectate(lobby_code)) for _ in range(self.args.spectators)]
+            shooters = [asyncio.create_task(self._shoot(user, websocket, enemy_colors[user["id"]]))
+                        for user, websocket in sockets]
+            await asyncio.gather(*shooters)
+            for spectator in spectators:
+                spectator.cancel()
+            #give the last shots some time to be answered
+            await asyncio.sleep(self.args.drain)
+            for reader in readers:
+                reader.cancel()
+        finally:
+            for _, websocket in sockets:
+                await websocket.close()
+
+    #Polls the lobby details like a spectator(until it is cancelled)
+    async def _spectate(self, lobby_code: str):
+        etag = None
+        await asyncio.sleep(random.uniform(0, self.args.poll_interval))
+        while True:
+            etag = await self._get_details(lobby_code, etag)
+            await asyncio.sleep(self.args.poll_interval)
+
+    #Follows the live events of the lobby like a spectator(until it is cancelled)
+    #- the Server-Sent Events are read from a plain socket, every "data:" line is one event
+    async def _follow(self, lobby_code: str):
+        host, _, port = self.base_url.split("://", 1)[1].partition(":")
+        reader, writer = await asyncio.open_connection(host, int(port or 80))
+        try:
+            writer.write(f"GET /SpectateLobby/{lobby_code} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(b"data: "):
+                    self.counts["spectator_events"] += 1
+        finally:
+            writer.close()
+
+    #Fires shots at the configured rate until the duration is over
+    async def _shoot(self, user: dict, websocket, enemy_color: str):
+        interval = 1 / self.args.rate
+        seq = 0
+        #spread the players' shots so that they do not all fire at the same time
+        await asyncio.sleep(random.random() * interval)
+        next_shot = time.perf_counter()
+        end = next_shot + self.args.duration
+        while next_shot < end:
+            seq += 1
+            hit = random.random() < self.args.hit_ratio
+            color = enemy_color if hit else None
+            frame = self.frames[color]
+            self.sent[(user["id"], seq)] = time.perf_counter()
+            self.pending.add((user["id"], seq))
+            self.counts["shots"] += 1
+            if websocket.subprotocol == sv.BINARY_SUBPROTOCOL:
+                color_id = sv.color_ids.index(enemy_color)
+                header = sv.SHOT_FRAME_HEADER.pack(sv.SHOT_FRAME_VERSION, color_id, 0, user["id"], seq)
+                await websocket.send(header + frame)
+            else:
+                await websocket.send(json.dumps({"image": base64.b64encode(frame).decode(), "player": user,
+                                                 "color": enemy_color, "seq": seq}))
+            next_shot += interval
+            await asyncio.sleep(max(0.0, next_shot - time.perf_counter()))
+
+    #Reads the messages of a player and records the latencies
+    async def _read(self, user: dict, websocket, game_started: asyncio.Event):
+        try:
+            async for data in websocket:
+                now = time.perf_counter()
+                message = json.loads(data)
+                kind, payload = message["type"], message["payload"] or {}
+                if kind == "start_game":
+                    game_started.set()
+                elif kind == "timer_report":
+                    elapsed = 60 - payload["time_remaining"]
+                    self.timer_lag.append(elapsed - int(elapsed))
+                elif kind == "ping":
+                    #answer the heartbeat like the web client(see ConnectionManager)
+                    await websocket.send(json.dumps({"type": "pong"}))
+                elif kind == "capture_settings":
+                    self.capture_levels.append(payload["level"])
+                elif kind == "busy":
+                    key = (payload["shooter_id"], payload.get("seq"))
+                    if key in self.pending:
+                        self.pending.discard(key)
+                        self.counts["busy"] += 1
+                elif kind in ("hit", "shot", "missed_shot"):
+                    shooter = payload.get("player_id", payload.get("shooter_id"))
+                    key = (shooter, payload.get("seq"))
+                    sent = self.sent.get(key)
+                    if sent is None:
+                        continue
+                    if shooter == user["id"] and kind != "shot":
+                        if key in self.pending:
+                            self.pending.discard(key)
+                            self.shot_latency.append(now - sent)
+                            self.counts["hits" if kind == "hit" else "misses"] += 1
+                    elif shooter != user["id"]:
+                        self.broadcast_latency.append(now - sent)
+        except websockets.ConnectionClosed:
+            pass
+
+    #Measures how late the load generator's own event loop wakes up
+    async def _probe_loop_lag(self, interval: float = 0.1):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+def _frame_size(value: str) -> tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the Laser-Shooter API.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--lobbies", type=int, default=5, help="number of lobbies")
+    parser.add_argument("--players", type=int, default=2, help="players per lobby(even number)")
+    parser.add_argument("--rate", type=float, default=2.0, help="shots per second per player")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of shooting(the games last 60 seconds)")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="fraction of the shots that contain the target")
+    parser.add_argument("--protocol", choices=("binary", "json"), default="binary")
+    parser.add_argument("--frame-size", type=_frame_size, default=(640, 480), help="WIDTHxHEIGHT of the frames")
+    parser.add_argument("--spectators", type=int, default=0, help="spectators polling the details of each lobby")
+    parser.add_argument("--spectator-mode", choices=("poll", "stream"), default="poll",
+                        help="spectators poll the lobby details or follow the live events")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between the polls of a spectator")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for the last answers")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+    if args.players < 2 or args.players % 2 != 0:
+        parser.error("--players must be an even number greater than or equal to 2")
+
+    results = asyncio.run(LoadGenerator(args).run())
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import argparse
+import itertools
+import json
+import os
+import random
+import cv2
+import numpy as np
+import services.service as sv
+
+# Synthetic image corpus for the shape detection(ComputerVisionModel)
+#  - Every image has one shape of one of the colours in "services/service.py"(color_ranges) in the middle of the frame
+#    with a known label, so the detection can be checked without a camera
+#  - The images vary in shape, colour, scale, rotation, noise, JPEG quality and resolution
+#  - Clutter adds smaller blobs and strokes of the same colour around the shape(the shape stays the largest),
+#    the detection must still pick the labelled shape
+#  - The colour of a shape is the middle of the colour's(first) HSV range, so new colours are picked up automatically
+#
+# Usage(from "back-end/"), writes the JPEG images and a "labels.json" file with the ground truth:
+#   python -m tools.shape_corpus --output corpus/
+
+SHAPES = ["triangle", "square", "rectangle", "circle"]
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+QUALITIES = [50, 80, 95]
+NOISE_LEVELS = [0, 8, 20]
+SCALES = [0.2, 0.35, 0.5]
+ROTATIONS = [0, 20, 60]
+
+#Method to get the BGR colour in the middle of a colour's HSV range
+def color_to_bgr(color: str) -> tuple[int, int, int]:
+    lower, upper = sv.color_ranges[color][0]
+    hsv = np.uint8([[[(lower[0] + upper[0]) // 2, (max(lower[1], 150) + upper[1]) // 2, (max(lower[2], 150) + upper[2]) // 2]]])
+    return tuple(int(value) for value in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0])
+
+#Method that returns the outline points of a shape centred on (0, 0) with the given size(height) and rotation
+def shape_points(shape: str, size: float, rotation: float) -> np.ndarray:
+    if shape == "triangle":
+        points = [(0, -size / 2), (-size / 2, size / 2), (size / 2, size / 2)]
+    elif shape == "square":
+        points = [(-size / 2, -size / 2), (size / 2, -size / 2), (size / 2, size / 2), (-size / 2, size / 2)]
+    elif shape == "rectangle":
+        points = [(-size, -size / 2), (size, -size / 2), (size, size / 2), (-size, size / 2)]
+    else:
+        angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+        points = list(zip(np.cos(angles) * size / 2, np.sin(angles) * size / 2))
+    angle = np.deg2rad(rotation)
+    rotate = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    return np.array(points) @ rotate.T
+
+#Method that creates one image(BGR) of a shape
+#- scale: size of the shape as a fraction of the shorter side of the frame
+#- noise: standard deviation of the gaussian noise added to the frame
+#- clutter: number of smaller blobs and strokes of the same colour drawn outside the shape
+def render_shape(shape: str, color: str, resolution: tuple[int, int], scale: float, rotation: float,
+                 noise: float, seed: int = 0, clutter: int = 0) -> np.ndarray:
+    width, height = resolution
+    image = np.full((height, width, 3), 235, np.uint8)
+    points = shape_points(shape, scale * min(width, height), rotation) + (width / 2, height / 2)
+    cv2.fillPoly(image, [np.round(points).astype(np.int32)], color_to_bgr(color), lineType=cv2.LINE_AA)
+    rng = np.random.default_rng(seed)
+    if clutter:
+        _draw_clutter(image, cv2.boundingRect(np.round(points).astype(np.int32)), color_to_bgr(color), clutter, rng)
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    return image
+
+#Method that draws small blobs and strokes outside the box (x, y, width, height) of the shape
+def _draw_clutter(image: np.ndarray, box, bgr, count: int, rng):
+    height, width = image.shape[:2]
+    x, y, w, h = box
+    #keep a margin around the shape, so the clutter never touches it
+    x0, y0, x1, y1 = x - 10, y - 10, x + w + 10, y + h + 10
+    size = max(4.0, 0.06 * min(width, height))
+    drawn, attempts = 0, 0
+    while drawn < count and attempts < count * 50:
+        attempts += 1
+        cx, cy = rng.uniform(size, width - size), rng.uniform(size, height - size)
+        if x0 - size < cx < x1 + size and y0 - size < cy < y1 + size:
+            continue
+        if drawn % 2 == 0:
+            blob = shape_points(SHAPES[int(rng.integers(len(SHAPES)))], rng.uniform(0.3, 1.0) * size, rng.uniform(0, 90))
+            cv2.fillPoly(image, [np.round(blob + (cx, cy)).astype(np.int32)], bgr, lineType=cv2.LINE_AA)
+        else:
+            angle = rng.uniform(0, np.pi)
+            end = (cx + np.cos(angle) * size, cy + np.sin(angle) * size)
+            cv2.line(image, (int(cx), int(cy)), (int(end[0]), int(end[1])), bgr, int(rng.integers(1, 4)))
+        drawn += 1
+
+#Method that encodes an image as JPEG
+def encode_jpeg(image: np.ndarray, quality: int) -> bytes:
+    _, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+#Method that generates the corpus as (label, JPEG bytes)
+#- the label has the shape, colour and all the settings of the image
+#- "configuration" groups the images with the same resolution, JPEG quality, noise level(and clutter)
+def generate_corpus(shapes=SHAPES, colors=None, resolutions=RESOLUTIONS, qualities=QUALITIES, noise_levels=NOISE_LEVELS,
+                    scales=SCALES, rotations=ROTATIONS, seed: int = 0, clutter: int = 0):
+    colors = colors or list(sv.color_ranges.keys())
+    rng = random.Random(seed)
+    for resolution, quality, noise in itertools.product(resolutions, qualities, noise_levels):
+        configuration = f"{resolution[0]}x{resolution[1]}_q{quality}_n{noise}" + (f"_c{clutter}" if clutter else "")
+        for shape, color, scale, rotation in itertools.product(shapes, colors, scales, rotations):
+            image = render_shape(shape, color, resolution, scale, rotation, noise, seed=rng.randrange(1 << 30),
+                                 clutter=clutter)
+            label = {"shape": shape, "color": color, "resolution": list(resolution), "quality": quality,
+                     "noise": noise, "scale": scale, "rotation": rotation, "clutter": clutter,
+                     "configuration": configuration}
+            yield label, encode_jpeg(image, quality)
+
+#Method for writing the corpus to a folder(the images and "labels.json")
+def write_corpus(folder: str, corpus) -> int:
+    os.makedirs(folder, exist_ok=True)
+    labels = []
+    for index, (label, jpeg) in enumerate(corpus):
+        label["file"] = f"{index:05d}_{label['shape']}_{label['color']}.jpg"
+        with open(os.path.join(folder, label["file"]), "wb") as file:
+            file.write(jpeg)
+        labels.append(label)
+    with open(os.path.join(folder, "labels.json"), "w") as file:
+        json.dump(labels, file, indent=1)
+    return len(labels)
+
+#Method for reading a corpus that was written with write_corpus
+def read_corpus(folder: str):
+    with open(os.path.join(folder, "labels.json")) as file:
+        labels = json.load(file)
+    for label in labels:
+        with open(os.path.join(folder, label["file"]), "rb") as file:
+            yield label, file.read()
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic shape detection corpus.")
+    parser.add_argument("--output", required=True, help="folder to write the images and labels.json to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clutter", type=int, default=0, help="number of smaller blobs and strokes around every shape")
+    args = parser.parse_args()
+    count = write_corpus(args.output, generate_corpus(seed=args.seed, clutter=args.clutter))
+    print(f"Wrote {count} images to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import urllib.request
+from collections import Counter, defaultdict
+import websockets
+import services.config as cfg
+import services.service as sv
+from ComputerVisionModel import ComputerVisionModel
+from ImageDecoder import ImageDecoder
+from ShotCapture import STAGES, CapturedShot, read_capture
+from tools.stats import summarise
+
+# Replays a shot capture(written by the server with SHOT_CAPTURE, see ShotCapture) to profile and regression test
+#    the shape detection on real traffic
+#  - "model" target(the default): runs the detection of every captured shot again with ComputerVisionModel(set up
+#    like the server, or with the options below) and compares the detected shapes with the captured ones. The
+#    captured and replayed stage timings are reported side by side, "--check" exits with 1 if a detection changed
+#  - "server" target: creates a lobby on a running API for every captured lobby(with the same number of players),
+#    connects the players and sends the captured frames(binary or JSON, the way they were sent) on the websockets
+#    of the players that sent them. Reports the answers("hit", "missed_shot" or "busy") per captured result and
+#    the latency of the answers next to the captured latency. The new lobbies have their own shapes, so the
+#    hits are not expected to be the same, and the games last as long as the server's games
+#  - The shots are sent at the times they were recieved("--speed 1"), faster("--speed 4") or as fast as
+#    possible("--speed 0"), the lag behind that schedule is reported
+#  - "--summary" only reports the captured shots(results, lobbies, players and the captured timings)
+#
+# Usage(from "back-end/"):
+#   python -m tools.shot_replay shots.capture --summary
+#   python -m tools.shot_replay shots.capture --speed 0 --check
+#   python -m tools.shot_replay shots.capture --roi-mode grow --decode-scale 1 --output replay.json
+#   python -m tools.shot_replay shots.capture --target server --base-url http://127.0.0.1:8000 --speed 2
+
+#Results of the shots that were detected(the rejected shots have no captured detection)
+DETECTED = ("hit", "miss", "error")
+
+#Method that summarises the captured shots(and the captured timings)
+def summarise_capture(shots: list[CapturedShot]) -> dict:
+    stages = defaultdict(list)
+    for shot in shots:
+        for stage, seconds in shot.timings.items():
+            stages[stage].append(seconds)
+    detected = [shot for shot in shots if shot.result in DETECTED]
+    return {
+        "shots": len(shots),
+        "duration_s": round(shots[-1].received_at - shots[0].received_at, 3) if shots else 0.0,
+        "results": dict(Counter(shot.result for shot in shots)),
+        "lobbies": len({shot.lobby_code for shot in shots}),
+        "players": len({shot.player_id for shot in shots}),
+        "base64_frames": sum(shot.is_base64 for shot in shots),
+        "frame_bytes": summarise_sizes([len(shot.image) for shot in shots]),
+        "wait": summarise([shot.wait for shot in shots]),
+        "detection": summarise([shot.detection for shot in detected]),
+        "stages": {stage: summarise(stages[stage]) for stage in STAGES if stage in stages},
+    }
+
+def summarise_sizes(sizes: list[int]) -> dict:
+    return {"min": min(sizes, default=None), "mean": round(sum(sizes) / len(sizes)) if sizes else None,
+            "max": max(sizes, default=None)}
+
+#Method that waits until the time a shot should be sent, returns how late it is(in seconds)
+#- start: the time the replay started, first: the time the first shot was recieved
+async def wait_for_shot(shot: CapturedShot, start: float, first: float, speed: float) -> float:
+    if not speed:
+        return 0.0
+    due = start + (shot.received_at - first) / speed
+    delay = due - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return max(0.0, time.perf_counter() - due)
+
+#Method that runs the detection of the captured shots again and compares it with the captured detection
+async def replay_model(shots: list[CapturedShot], model: ComputerVisionModel, speed: float, examples: int = 20) -> dict:
+    stages = defaultdict(list)
+    detection, lag = [], []
+    counts = Counter()
+    mismatches = []
+    start = time.perf_counter()
+    first = shots[0].received_at if shots else 0.0
+    for shot in shots:
+        lag.append(await wait_for_shot(shot, start, first, speed))
+        timings = {}
+        began = time.perf_counter()
+        if shot.is_base64:
+            shapes = model.detect_shape(shot.image, shot.color, shot.roi, timings)
+        else:
+            shapes = model.detect_shape_from_bytes(shot.image, shot.color, shot.roi, timings)
+        detection.append(time.perf_counter() - began)
+        for stage, seconds in timings.items():
+            stages[stage].append(seconds)
+        counts["replayed"] += 1
+        if shot.result not in ("hit", "miss"):
+            continue
+        counts["compared"] += 1
+        if sorted(shapes) == sorted(shot.shapes):
+            counts["matches"] += 1
+            continue
+        counts["mismatches"] += 1
+        if len(mismatches) < examples:
+            mismatches.append({"received_at": shot.received_at, "lobby": shot.lobby_code, "player": shot.player_id,
+                               "seq": shot.seq, "color": shot.color, "captured": shot.shapes, "replayed": shapes})
+    return {
+        "counts": {"replayed": counts["replayed"], "compared": counts["compared"], "matches": counts["matches"],
+                   "mismatches": counts["mismatches"]},
+        "mismatch_examples": mismatches,
+        "elapsed_s": round(time.perf_counter() - start, 3),
+        "detection": summarise(detection),
+        "stages": {stage: summarise(stages[stage]) for stage in STAGES if stage in stages},
+        "schedule_lag": summarise(lag),
+    }
+
+class ServerReplay:
+    def __init__(self, base_url: str, speed: float, drain: float):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        self.speed = speed
+        self.drain = drain
+        #captured player(lobby code, player id) -> (websocket, new player id), and the shots that were not
+        #    answered yet: (new player id, seq) -> (send time, captured shot)
+        self.players: dict[tuple[str, int], tuple] = {}
+        self.sockets = []
+        self.pending: dict[tuple[int, int], tuple[float, CapturedShot]] = {}
+        self.seqs: Counter = Counter()
+        self.latency: list[float] = []
+        self.captured_latency: list[float] = []
+        self.lag: list[float] = []
+        self.outcomes: Counter = Counter()
+        self.counts = Counter()
+
+    #Helper method for the HTTP endpoints(ran on a thread so that it does not block the sockets)
+    async def _post(self, path: str) -> dict:
+        def post():
+            request = urllib.request.Request(self.base_url + path, method="POST")
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read())
+        return await asyncio.to_thread(post)
+
+    #Creates a lobby for a captured lobby and connects its players, returns when the game started
+    #- the players of a captured team are given the new players of one team(the teams are kept together)
+    async def _set_up_lobby(self, lobby_code: str, players: list[tuple[str, int]], readers: list):
+        captured_teams = defaultdict(list)
+        for team_name, player_id in players:
+            captured_teams[team_name].append(player_id)
+        size = 2 * max(len(team) for team in captured_teams.values())
+        lobby = await self._post(f"/CreateLobby/{size}")
+
+        #a player connects right after joining(the game starts when the last player connects)
+        game_started = asyncio.Event()
+        unassigned = iter(captured_teams.values())
+        teams = {}
+        for number in range(size):
+            joined = await self._post(f"/JoinLobby/{lobby['lobby_code']}/replay_{lobby_code}_{number}")
+            user = joined["user"]
+            websocket = await websockets.connect(f"{self.ws_url}/ws/{lobby['lobby_code']}/{user['team_id']}/{user['id']}",
+                                                 subprotocols=[sv.BINARY_SUBPROTOCOL], max_size=None)
+            self.sockets.append(websocket)
+            readers.append(asyncio.create_task(self._read(user["id"], websocket, game_started)))
+            if user["team_id"] not in teams:
+                teams[user["team_id"]] = iter(next(unassigned, []))
+            player_id = next(teams[user["team_id"]], None)
+            if player_id is not None:
+                self.players[(lobby_code, player_id)] = (websocket, user["id"])
+        await asyncio.wait_for(game_started.wait(), timeout=30)
+
+    async def run(self, shots: list[CapturedShot]) -> dict:
+        lobbies = defaultdict(dict)
+        for shot in shots:
+            lobbies[shot.lobby_code].setdefault((shot.team_name, shot.player_id), None)
+        readers = []
+        try:
+            await asyncio.gather(*(self._set_up_lobby(lobby_code, list(players), readers)
+                                   for lobby_code, players in lobbies.items()))
+            start = time.perf_counter()
+            first = shots[0].received_at if shots else 0.0
+            for shot in shots:
+                self.lag.append(await wait_for_shot(shot, start, first, self.speed))
+                await self._send(shot)
+            await asyncio.sleep(self.drain)
+            elapsed = time.perf_counter() - start
+        finally:
+            for reader in readers:
+                reader.cancel()
+            for websocket in self.sockets:
+                await websocket.close()
+        self.counts["unanswered"] = len(self.pending)
+        return {
+            "counts": dict(self.counts),
+            "outcomes": dict(sorted(self.outcomes.items())),
+            "elapsed_s": round(elapsed, 3),
+            "latency": summarise(self.latency),
+            "captured_latency": summarise(self.captured_latency),
+            "schedule_lag": summarise(self.lag),
+        }
+
+    #Sends a captured shot on the websocket of the player that sent it
+    async def _send(self, shot: CapturedShot):
+        websocket, player_id = self.players[(shot.lobby_code, shot.player_id)]
+        self.seqs[player_id] += 1
+        seq = self.seqs[player_id]
+        if shot.is_base64:
+            frame = json.dumps({"image": bytes(shot.image).decode(), "color": shot.color, "seq": seq,
+                                "roi": list(shot.roi) if shot.roi is not None else None})
+        else:
+            color_id = sv.color_ids.index(shot.color) if shot.color in sv.color_ids else 255
+            flags = sv.SHOT_FLAG_ROI if shot.roi else 0
+            frame = sv.SHOT_FRAME_HEADER.pack(sv.SHOT_FRAME_VERSION, color_id, flags, player_id, seq)
+            if shot.roi:
+                frame += sv.SHOT_FRAME_ROI.pack(*(min(max(int(value), 0), 0xFFFF) for value in shot.roi))
+            frame += shot.image
+        self.pending[(player_id, seq)] = (time.perf_counter(), shot)
+        try:
+            await websocket.send(frame)
+            self.counts["sent"] += 1
+        except websockets.ConnectionClosed:
+            #the game is over(or the server closed the connection)
+            del self.pending[(player_id, seq)]
+            self.counts["not_sent"] += 1
+
+    #Reads the messages of a player and records the answers to its shots
+    async def _read(self, player_id: int, websocket, game_started: asyncio.Event):
+        try:
+            async for data in websocket:
+                now = time.perf_counter()
+                message = json.loads(data)
+                kind, payload = message["type"], message.get("payload") or {}
+                if kind == "start_game":
+                    game_started.set()
+                elif kind == "ping":
+                    await websocket.send(json.dumps({"type": "pong"}))
+                elif kind in ("hit", "missed_shot", "busy"):
+                    shooter = payload.get("player_id", payload.get("shooter_id"))
+                    if shooter != player_id:
+                        continue
+                    sent = self.pending.pop((shooter, payload.get("seq")), None)
+                    if sent is None:
+                        continue
+                    sent_at, shot = sent
+                    answer = payload.get("reason", kind) if kind == "busy" else kind
+                    self.outcomes[f"{shot.result}->{answer}"] += 1
+                    self.counts[answer] += 1
+                    self.latency.append(now - sent_at)
+                    self.captured_latency.append(shot.wait + shot.detection)
+        except websockets.ConnectionClosed:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a shot capture on the shape detection or a running server.")
+    parser.add_argument("capture", help="capture file written by the server(SHOT_CAPTURE)")
+    parser.add_argument("--target", choices=("model", "server"), default="model")
+    parser.add_argument("--summary", action="store_true", help="only summarise the captured shots")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed(1 is the captured pace, 0 is as fast as possible)")
+    parser.add_argument("--results", help="comma separated captured results to replay(default: the detected shots for"
+                                          " the model, every shot for the server)")
+    parser.add_argument("--lobby", help="only replay the shots of this lobby")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most this many shots")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if a replayed detection is not the captured one")
+    parser.add_argument("--decoder", default=cfg.VISION_DECODER, choices=("auto", "opencv", "turbojpeg"))
+    parser.add_argument("--decode-scale", default=cfg.VISION_DECODE_SCALE, choices=("auto", "1", "2", "4", "8"))
+    parser.add_argument("--target-size", type=float, default=cfg.VISION_TARGET_SIZE)
+    parser.add_argument("--roi-mode", default=cfg.VISION_ROI_MODE, choices=("full", "window", "grow"))
+    parser.add_argument("--roi-size", type=float, default=cfg.VISION_ROI_SIZE)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for the last answers(server target)")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    if args.results:
+        results = set(args.results.split(","))
+    else:
+        results = set(DETECTED) if args.target == "model" else None
+    #the shots are replayed in the order they were recieved(they are captured in the order they were answered)
+    captured = sorted(read_capture(args.capture), key=lambda shot: shot.received_at)
+    shots = [shot for shot in captured if (results is None or shot.result in results)
+             and (not args.lobby or shot.lobby_code == args.lobby) and (args.target == "server" or shot.color)]
+    if args.limit:
+        shots = shots[:args.limit]
+
+    report = {"capture": summarise_capture(captured)}
+    if not args.summary:
+        report["config"] = {"target": args.target, "speed": args.speed, "shots": len(shots),
+                            "results": sorted(results) if results else "all", "lobby": args.lobby}
+        if args.target == "model":
+            decoder = ImageDecoder(args.decoder, args.decode_scale, args.target_size)
+            model = ComputerVisionModel(roi_mode=args.roi_mode, roi_size=args.roi_size, decoder=decoder)
+            report["config"].update({"decoder": decoder.backend, "decode_scale": args.decode_scale,
+                                     "target_size": args.target_size, "roi_mode": args.roi_mode,
+                                     "roi_size": args.roi_size})
+            report["replay"] = asyncio.run(replay_model(shots, model, args.speed))
+        else:
+            report["config"]["base_url"] = args.base_url
+            report["replay"] = asyncio.run(ServerReplay(args.base_url, args.speed, args.drain).run(shots))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    if args.check and report.get("replay", {}).get("counts", {}).get("mismatches"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
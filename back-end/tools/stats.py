@@ -0,0 +1,21 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+# Helper methods for summarising the timings of the tools(load generator and benchmarks)
+
+#Method that returns the p-th percentile(nearest rank) of the values
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+#Method that summarises latencies(in seconds) as milliseconds
+def summarise(values: list[float]) -> dict:
+    summary = {"count": len(values)}
+    for p in (50, 95, 99):
+        value = percentile(values, p)
+        summary[f"p{p}_ms"] = None if value is None else round(value * 1000, 3)
+    summary["max_ms"] = round(max(values) * 1000, 3) if values else None
+    return summary
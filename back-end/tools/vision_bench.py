@@ -0,0 +1,111 @@
+# Phiwokwakhe Khathwane : 2022004325
+# Welcome Galane        : 2024671386
+
+import argparse
+import base64
+import json
+import time
+from collections import defaultdict
+from ComputerVisionModel import ComputerVisionModel
+from ImageDecoder import ImageDecoder
+from tools.shape_corpus import SHAPES, generate_corpus, read_corpus
+from tools.stats import summarise
+
+# Offline benchmark of the shape detection(ComputerVisionModel), runs headless(no camera or server needed)
+#  - Runs the detection on the synthetic corpus(see tools/shape_corpus.py) and compares it with the labels
+#  - Reports, per configuration(resolution, JPEG quality and noise level), the classification accuracy and the
+#    time spent in every stage of the pipeline(base64, imdecode, hsv, mask, contours, classify)
+#  - The accuracy is also reported per shape and per colour
+#  - The model is set up to classify all the shapes(the game only uses the shapes in "services/service.py")
+#
+# Usage(from "back-end/"):
+#   python -m tools.vision_bench --output bench.json
+#   python -m tools.vision_bench --quick --roi-mode grow
+#   python -m tools.vision_bench --quick --clutter 12   (smaller blobs and strokes of the same colour around the shapes)
+#   python -m tools.vision_bench --decode-scale 1       (decode the frames at full resolution)
+#   python -m tools.vision_bench --corpus corpus/     (use a corpus written by tools.shape_corpus)
+
+STAGES = ["base64", "imdecode", "hsv", "mask", "contours", "classify"]
+
+#Method that runs the benchmark, returns the results
+def run_benchmark(corpus, model: ComputerVisionModel, repeat: int = 1) -> dict:
+    per_configuration = defaultdict(lambda: {"images": 0, "correct": 0, "stages": defaultdict(list), "total": []})
+    per_shape = defaultdict(lambda: [0, 0])
+    per_color = defaultdict(lambda: [0, 0])
+    confusion = defaultdict(int)
+
+    for label, jpeg in corpus:
+        image_base64 = base64.b64encode(jpeg).decode()
+        group = per_configuration[label["configuration"]]
+        for run in range(repeat):
+            timings = {}
+            start = time.perf_counter()
+            detected = model.detect_shape(image_base64, label["color"], timings=timings)
+            group["total"].append(time.perf_counter() - start)
+            for stage in STAGES:
+                group["stages"][stage].append(timings.get(stage, 0.0))
+
+        predicted = detected[0] if len(detected) == 1 else ("" if not detected else "ambiguous")
+        correct = predicted == label["shape"]
+        group["images"] += 1
+        group["correct"] += correct
+        per_shape[label["shape"]][0] += 1
+        per_shape[label["shape"]][1] += correct
+        per_color[label["color"]][0] += 1
+        per_color[label["color"]][1] += correct
+        confusion[f"{label['shape']}->{predicted or 'none'}"] += 1
+
+    images = sum(group["images"] for group in per_configuration.values())
+    correct = sum(group["correct"] for group in per_configuration.values())
+    return {
+        "images": images,
+        "accuracy": round(correct / images, 4) if images else None,
+        "per_shape_accuracy": {shape: round(c / n, 4) for shape, (n, c) in per_shape.items()},
+        "per_color_accuracy": {color: round(c / n, 4) for color, (n, c) in per_color.items()},
+        "confusion": dict(sorted(confusion.items())),
+        "configurations": {
+            name: {"images": group["images"], "accuracy": round(group["correct"] / group["images"], 4),
+                   "total": summarise(group["total"]),
+                   "stages": {stage: summarise(values) for stage, values in group["stages"].items()}}
+            for name, group in sorted(per_configuration.items())
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the speed and accuracy of the shape detection.")
+    parser.add_argument("--corpus", help="folder with a corpus written by tools.shape_corpus(generated if not given)")
+    parser.add_argument("--quick", action="store_true", help="use a small generated corpus(one resolution and quality)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times every image is detected(for the timings)")
+    parser.add_argument("--clutter", type=int, default=0, help="smaller blobs and strokes around every generated shape")
+    parser.add_argument("--decoder", default="auto", choices=("auto", "opencv", "turbojpeg"))
+    parser.add_argument("--decode-scale", default="auto", choices=("auto", "1", "2", "4", "8"))
+    parser.add_argument("--target-size", type=float, default=0.1, help="smallest target as a fraction of the frame(auto scale)")
+    parser.add_argument("--roi-mode", default="full", choices=("full", "window", "grow"))
+    parser.add_argument("--roi-size", type=float, default=0.5)
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = read_corpus(args.corpus)
+    elif args.quick:
+        corpus = generate_corpus(resolutions=[(640, 480)], qualities=[80], noise_levels=[0, 20], clutter=args.clutter)
+    else:
+        corpus = generate_corpus(clutter=args.clutter)
+
+    decoder = ImageDecoder(args.decoder, args.decode_scale, args.target_size)
+    model = ComputerVisionModel(roi_mode=args.roi_mode, roi_size=args.roi_size, decoder=decoder)
+    model.shapes = SHAPES
+    results = run_benchmark(corpus, model, max(1, args.repeat))
+    results["config"] = {"corpus": args.corpus or ("quick" if args.quick else "generated"), "repeat": args.repeat,
+                         "clutter": args.clutter, "decoder": decoder.backend,
+                         "decode_scale": args.decode_scale, "target_size": args.target_size,
+                         "roi_mode": args.roi_mode, "roi_size": args.roi_size}
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -78,8 +78,14 @@ const Index: React.FC = () => {
       WebSocketService.connect(lobby?.code, user.teamId, user.id, handleGameMessage);
     }
 
-    //poll the data periodically for spactators
+    //follow the live events of the lobby for spectators
+    //-the data is polled periodically if the browser can not follow the events
     if(user.role === 'spectator'){
+      const stopSpectating = lobbyService.spectateLobby(lobby.code, setLobbyDetails);
+      if(stopSpectating){
+        return stopSpectating;
+      }
+
       const interval = setInterval(() => {
         fetchLobbyDetails(lobby.code!) 
       }, 2000);
@@ -71,6 +71,17 @@ function Index() {
    return () => CameraService.stopCamera();
   }, []);
 
+  //Count down the game timer locally(the server only sends occasional clock corrections)
+  useEffect(() => {
+   const interval = setInterval(() => {
+    const remaining = WebSocketService.getTimeRemaining();
+    if (remaining !== null) {
+     setTimer(Math.floor(remaining));
+    }
+   }, 250);
+   return () => clearInterval(interval);
+  }, []);
+
   //Color detection loop
   useEffect(() => {
    const detectLoop = () => {
@@ -142,9 +153,20 @@ function Index() {
      setEnemyScore((s)=> s + 15);
      updateStatus("Got hit");
      break;
+    case "sync":
+     //Connected again and the missed messages could not be replayed, the server sent the scores
+     if (msg.payload) {
+      setScore(msg.payload.team_score);
+      setEnemyScore(msg.payload.enemy_team_score);
+     }
+     break;
     case "missed_shot":
      updateStatus("Missed");
      break;
+    case "busy":
+     //The server did not process the shot(fired too fast or the server is overloaded)
+     updateStatus(msg.payload?.reason === "cooldown" ? "Too fast!" : "Shot not processed");
+     break;
     case "timer_report":
      if (msg.payload?.time_remaining !== undefined) {
       setTimer(Math.floor(msg.payload.time_remaining));
@@ -202,11 +224,12 @@ function Index() {
    updateStatus("Reloading...");
    setReloadProgress(0);
 
-   //Simulate reload progress
+   //Simulate reload progress(the reload time follows the server's maximum fire rate)
    const startTime = Date.now();
+   const reloadTime = WebSocketService.getReloadTime();
    const interval = setInterval(() => {
     const elapsed = Date.now() - startTime;
-    const progress = Math.min((elapsed / 1000) * 100, 100);
+    const progress = Math.min((elapsed / reloadTime) * 100, 100);
     setReloadProgress(progress);
     if (progress >= 100) {
      clearInterval(interval);
@@ -221,12 +244,11 @@ function Index() {
     return;
    }*/
 
-   //Get current frame and make it a base64 image
+   //Get current frame
    const canvas = canvasRef.current;
    const ctx = canvas.getContext("2d");
    if (!ctx) return;
    ctx.drawImage(videoRef.current, 0, 0, canvas.width, canvas.height);
-   const imageBase64 = canvas.toDataURL("image/jpeg").split(",")[1];
 
    //Validate that enemy color is defined before shooting
    if (!shootColor) {
@@ -234,8 +256,8 @@ function Index() {
     return;
    }
 
-   //Send a shot to the server via the websocket service
-   WebSocketService.sendShot(imageBase64, user, shootColor);
+   //Send a shot to the server via the websocket service(the service encodes the frame)
+   WebSocketService.sendShotFrame(canvas, user, shootColor);
    updateStatus("Shot fired!");
   };
 
@@ -69,6 +69,47 @@ export const lobbyService={
     }
   },
 
+  //Follow the live events of a lobby(for spectators)
+  //-The first event has the lobby details, the score and timer updates are then applied to the details
+  //-Returns a method that stops the stream, or null if the browser does not support Server-Sent Events
+  spectateLobby(lobbyCode:string, onUpdate:(lobby:Lobby)=>void):(() => void)|null{
+    if (typeof EventSource === "undefined") {
+      return null;
+    }
+    const source = new EventSource(`${API}/SpectateLobby/${lobbyCode}`);
+    let lobby:Lobby|null = null;
+
+    source.onmessage = (event) => {
+      const msg = JSON.parse(event.data);
+      if (msg.type === "snapshot") {
+        lobby = msg.payload as Lobby;
+      } else if (lobby && msg.type === "score") {
+        //the new totals of the shooter team, the player and the target team
+        const p = msg.payload;
+        lobby = {...lobby, teams: lobby.teams.map((team) => {
+          if (team.id === p.team_id) {
+            const players = (team.players ?? []).map((player:any) => player.id === p.player_id ? {...player, hits: p.player_hits} : player);
+            return {...team, score: p.score, hits: p.hits, players};
+          }
+          return team.id === p.target_team_id ? {...team, shots: p.target_shots} : team;
+        })};
+      } else if (lobby && msg.type === "timer_report") {
+        lobby = {...lobby, time_remaining: msg.payload.time_remaining};
+      } else {
+        return;
+      }
+      onUpdate(lobby);
+    };
+
+    //The server ends the stream after the game over, it must not be reconnected then
+    source.onerror = () => {
+      if (lobby?.game_status === "game_over") {
+        source.close();
+      }
+    };
+    return () => source.close();
+  },
+
   //Leave Team
   leaveTeam: async (lobbyCode: string, user: User): Promise<void> => {
     // Check if the user is authenticated before attempting to leave
@@ -9,17 +9,61 @@ export interface GameMessage {
   payload: any;
 }
 
+//Capture settings announced by the server("capture_settings" message)
+//-max_size: longest side of the frames in pixels, jpeg_quality: 0-100, max_fire_rate: shots per second
+//-The server lowers them when it is overloaded, so the frames get smaller instead of the shots getting slower
+export interface CaptureSettings {
+  level: number;
+  max_size: number;
+  jpeg_quality: number;
+  max_fire_rate: number;
+}
+
+//Reload time(ms) used before the server sent its capture settings
+const DEFAULT_RELOAD_TIME = 1000;
+
 //Production websocket
 const wsUrl = import.meta.env.VITE_WS_URL;
 
 //Local websocket
 //const wsUrl = "ws://127.0.0.1:8000";
 
+//Binary shot protocol(must match the back-end "services/service.py")
+//-Header: version(1 byte), colour id(1 byte), flags(2 bytes), player id(4 bytes), sequence number(4 bytes)
+//-The header is followed by the raw JPEG bytes
+const BINARY_PROTOCOL = "laser-shooter.binary.v1";
+const SHOT_FRAME_VERSION = 1;
+const SHOT_HEADER_SIZE = 12;
+const SHOT_ROI_SIZE = 8;
+const SHOT_FLAG_ROI = 0x1;
+const COLOR_IDS = ["red", "blue", "green", "yellow", "orange", "purple"];
+
+//Reconnects after the connection was lost(the server replays the messages that were missed)
+//-The delay(ms) doubles after every attempt
+const RECONNECT_DELAY = 1000;
+const RECONNECT_ATTEMPTS = 5;
+
 //Websocket class to manage WebSocket connections for real-time game communication
 class WebSocketService {
   private socket: WebSocket | null = null;
   //An event halder for the messages that can be changes
   private messageHandler: (msg: GameMessage) => void = () => {};
+  //Sequence number of the last shot that was sent
+  private shotSeq = 0;
+  //Local time(ms) when the running game ends, kept up to date by the start_game, clock_sync and timer_report messages
+  private gameEndTime: number | null = null;
+  //Capture settings sent by the server(null until the server sends them)
+  private captureSettings: CaptureSettings | null = null;
+  //Canvas used to scale the frames down to the capture size
+  private captureCanvas: HTMLCanvasElement | null = null;
+  //Session sent by the server("session" message): the resume token, the message stream and the id of the last message
+  private resumeToken: string | null = null;
+  private stream: string | null = null;
+  private lastMessageId = 0;
+  //Lobby, team and user of the connection(used to connect again) and the reconnect attempts made
+  private target: { lobbyCode: string; teamId: string; userId: number } | null = null;
+  private reconnectAttempts = 0;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
 
   //Connect to the websocket
   connect(
@@ -34,16 +78,33 @@ class WebSocketService {
       return;
     }
 
+    this.target = { lobbyCode, teamId, userId };
+    this.messageHandler = onMessage;
+    this.open();
+  }
+
+  //Open the websocket, with the resume token when connecting again
+  private open() {
+    if (!this.target) return;
+    const { lobbyCode, teamId, userId } = this.target;
+    let url = `${wsUrl}/ws/${lobbyCode}/${teamId}/${userId}`;
+    if (this.resumeToken) {
+      const query = new URLSearchParams({ resume: this.resumeToken, stream: this.stream ?? "", last_id: String(this.lastMessageId) });
+      url += `?${query.toString()}`;
+    }
+
     //Initialize websocket with lobby, team and user details
-    this.socket = new WebSocket(`${wsUrl}/ws/${lobbyCode}/${teamId}/${userId}`);
+    //-Offer the binary shot protocol, older servers will ignore it and we fall back to JSON
+    const socket = new WebSocket(url, [BINARY_PROTOCOL]);
+    this.socket = socket;
 
     //Handle websocket connection opening
-    this.socket.onopen = () => {
+    socket.onopen = () => {
+      this.reconnectAttempts = 0;
     };
-    this.messageHandler = onMessage;
 
     //Parse the websocket message
-    this.socket.onmessage = (event) => {
+    socket.onmessage = (event) => {
       try {
 
         //Get the raw message from websocket
@@ -59,17 +120,96 @@ class WebSocketService {
           return;
         }
 
+        //Keep track of the last message(the broadcasts have a message id) and answer the pings
+        if (typeof message.id === "number") {
+          this.lastMessageId = message.id;
+        }
+        if (message.type === "ping") {
+          socket.send(JSON.stringify({ type: "pong", last_id: this.lastMessageId }));
+          return;
+        }
+        if (message.type === "session" && message.payload) {
+          //a new message stream(another server) counts the messages from the start
+          if (message.payload.stream !== this.stream) {
+            this.lastMessageId = 0;
+          }
+          this.resumeToken = message.payload.resume_token;
+          this.stream = message.payload.stream;
+          return;
+        }
+
+        //Keep the game clock in sync before the page handles the message
+        this.updateGameClock(message as GameMessage);
+        if (message.type === "capture_settings" && message.payload) {
+          this.captureSettings = message.payload as CaptureSettings;
+        }
+
         //If we failed to parse the message, print the error in console
         this.messageHandler(message as GameMessage);
       } catch (err) {
       }
     };
 
-    //Close the socket connection 
-    this.socket.onclose = () => {
+    //Connect again if the connection was lost(the server closes the connection with 1000 when the game is over)
+    socket.onclose = (event) => {
+      if (this.socket !== socket) return;
+      this.socket = null;
+      if (event.code === 1000 || !this.resumeToken || this.reconnectAttempts >= RECONNECT_ATTEMPTS) return;
+      const delay = RECONNECT_DELAY * 2 ** this.reconnectAttempts++;
+      this.reconnectTimer = setTimeout(() => {
+        this.reconnectTimer = null;
+        if (!this.socket) this.open();
+      }, delay);
     };
   }
 
+  //Update the local game clock from the server's time remaining
+  private updateGameClock(message: GameMessage) {
+    switch (message.type) {
+      case "start_game":
+      case "clock_sync":
+      case "timer_report":
+        if (message.payload?.time_remaining !== undefined) {
+          this.gameEndTime = Date.now() + message.payload.time_remaining * 1000;
+        }
+        break;
+      case "game_over":
+        this.gameEndTime = null;
+        break;
+    }
+  }
+
+  //Get the time remaining(in seconds) of the running game, null if no game is running
+  getTimeRemaining(): number | null {
+    if (this.gameEndTime === null) return null;
+    return Math.max(0, (this.gameEndTime - Date.now()) / 1000);
+  }
+
+  //Get the reload time(ms) between two shots from the server's maximum fire rate
+  getReloadTime(): number {
+    const rate = this.captureSettings?.max_fire_rate;
+    return rate && rate > 0 ? Math.round(1000 / rate) : DEFAULT_RELOAD_TIME;
+  }
+
+  //Scale the frame down to the capture size announced by the server(the frame is used as it is if it is small enough)
+  private scaleFrame(canvas: HTMLCanvasElement): HTMLCanvasElement {
+    const maxSize = this.captureSettings?.max_size;
+    const longest = Math.max(canvas.width, canvas.height);
+    if (!maxSize || longest <= maxSize) return canvas;
+
+    if (!this.captureCanvas) {
+      this.captureCanvas = document.createElement("canvas");
+    }
+    const scale = maxSize / longest;
+    const target = this.captureCanvas;
+    target.width = Math.round(canvas.width * scale);
+    target.height = Math.round(canvas.height * scale);
+    const ctx = target.getContext("2d");
+    if (!ctx) return canvas;
+    ctx.drawImage(canvas, 0, 0, target.width, target.height);
+    return target;
+  }
+
   //update the message handler
   chageMessageHandler(onMessage:(msg: GameMessage)=>void){
     this.messageHandler = onMessage;
@@ -80,8 +220,50 @@ class WebSocketService {
   return this.socket && this.socket.readyState === WebSocket.OPEN;
 }
 
+  //Method to send a shot from the current canvas frame
+  //-Uses a binary frame when the server accepted the binary protocol, otherwise a base64 image in JSON
+  //-The frame is scaled and compressed as the server's capture settings ask
+  //-roi: (optional) region [x, y, width, height] of the scaled frame the server should search for the shape, by default the
+  //  server uses its own region of interest mode(VISION_ROI_MODE)
+  async sendShotFrame(source: HTMLCanvasElement, player: User, color: string, roi?: number[]) {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+
+    const canvas = this.scaleFrame(source);
+    const quality = this.captureSettings ? this.captureSettings.jpeg_quality / 100 : undefined;
+    if (this.socket.protocol !== BINARY_PROTOCOL) {
+      this.sendShot(canvas.toDataURL("image/jpeg", quality).split(",")[1], player, color, roi);
+      return;
+    }
+
+    //Encode the frame as JPEG
+    const blob = await new Promise<Blob | null>((resolve) => canvas.toBlob(resolve, "image/jpeg", quality));
+    if (!blob) return;
+    const jpeg = new Uint8Array(await blob.arrayBuffer());
+
+    //Build the frame header and region of interest followed by the JPEG bytes
+    const roiSize = roi ? SHOT_ROI_SIZE : 0;
+    const frame = new Uint8Array(SHOT_HEADER_SIZE + roiSize + jpeg.byteLength);
+    const header = new DataView(frame.buffer);
+    const colorId = COLOR_IDS.indexOf(color);
+    header.setUint8(0, SHOT_FRAME_VERSION);
+    header.setUint8(1, colorId < 0 ? 255 : colorId);
+    header.setUint16(2, roi ? SHOT_FLAG_ROI : 0);
+    header.setUint32(4, player.id);
+    header.setUint32(8, ++this.shotSeq);
+    roi?.forEach((value, i) => header.setUint16(SHOT_HEADER_SIZE + i * 2, value));
+    frame.set(jpeg, SHOT_HEADER_SIZE + roiSize);
+
+    //Send the shot frame
+    try {
+      if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+        this.socket.send(frame);
+      }
+    } catch (error) {
+    }
+  }
+
   // Method to send a shot
-  sendShot(image: string, player: User, color: string) {
+  sendShot(image: string, player: User, color: string, roi?: number[]) {
   if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
 
   //Shot data object
@@ -93,7 +275,9 @@ class WebSocketService {
       team_id: player.teamId,
       hits: player.hits || 0
     },
-    color: color
+    color: color,
+    seq: ++this.shotSeq,
+    roi: roi
   };
 
   //Send the shot object
@@ -105,9 +289,21 @@ class WebSocketService {
 
   //Close the websocket connection
   disconnect() {
+    this.gameEndTime = null;
+    this.captureSettings = null;
+    this.target = null;
+    this.resumeToken = null;
+    this.stream = null;
+    this.lastMessageId = 0;
+    this.reconnectAttempts = 0;
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
     if (this.socket) {
-      this.socket.close();
+      const socket = this.socket;
       this.socket = null;
+      socket.close();
     }
   }
 }